@@ -0,0 +1,57 @@
+"""
+向量化吞吐基准：对比不同进程数、批大小下的 片段/秒，用于评估建索引机器的规格
+用法：
+    python project/03/bench_embedding.py --chunks 2000 --workers 1 2 4 --batch-sizes 16 32 64 128
+
+语料：默认用 docs/faq.md 的分块循环填充到指定数量，并随机截断以模拟长短不一的真实片段。
+"""
+
+import argparse
+import random
+import time
+
+from rag_qa_local_embedding import init_embeddings, load_and_split_documents
+from parallel_embedding import ParallelEmbedder
+
+
+def make_corpus(n: int, seed: int = 42):
+    """用 FAQ 分块构造 n 条长度不一的文本"""
+    rng = random.Random(seed)
+    base = [c.page_content for c in load_and_split_documents()]
+    corpus = []
+    while len(corpus) < n:
+        text = base[len(corpus) % len(base)]
+        corpus.append(text[: rng.randint(max(1, len(text) // 5), len(text))])
+    return corpus
+
+
+def run_once(texts, workers: int, batch_size: int, sort_by_length: bool) -> float:
+    """返回纯向量化阶段的吞吐（不含进程启动与模型加载时间）"""
+    with ParallelEmbedder(init_embeddings, workers=workers, batch_size=batch_size,
+                          sort_by_length=sort_by_length) as embedder:
+        # 预热：触发各进程加载模型
+        embedder.embed(texts[: workers * batch_size])
+        t0 = time.perf_counter()
+        embedder.embed(texts)
+        return len(texts) / (time.perf_counter() - t0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="embedding 吞吐基准")
+    parser.add_argument("--chunks", type=int, default=2000, help="参与测试的片段数")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="进程数列表")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[16, 32, 64, 128], help="批大小列表")
+    parser.add_argument("--no-sort", action="store_true", help="关闭按长度排序（用于对比 padding 浪费）")
+    args = parser.parse_args()
+
+    texts = make_corpus(args.chunks)
+    print(f"片段数: {len(texts)}，按长度排序: {not args.no_sort}")
+    print(f"{'workers':>8} {'batch':>6} {'chunks/s':>10}")
+    for workers in args.workers:
+        for batch_size in args.batch_sizes:
+            rate = run_once(texts, workers, batch_size, not args.no_sort)
+            print(f"{workers:>8} {batch_size:>6} {rate:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+BM25 倒排索引：与向量索引一起构建和保存，用于稀疏检索 / 混合检索
+功能：
+1. 中文按字符二元组（bigram）切词，英文/数字按词切分（订单号、快递单号、SF 等可精确命中）
+2. 建索引时与 FAISS 使用同一批片段，行号一一对应（第 i 行即 FAISS 中的第 i 个向量）
+3. 以 numpy 数组 + JSON 保存在向量库目录中（不使用 pickle），倒排表以 mmap 方式加载
+4. 提供 reciprocal rank fusion（RRF）用于融合稀疏与稠密检索的排序结果
+
+文件：
+- bm25.json              参数（k1、b、文档数）与词表
+- bm25.offsets.npy       int64 [V+1]：每个词的倒排表在 postings 中的起止位置
+- bm25.postings.npy      int32：倒排表中的行号
+- bm25.tf.npy            float32：对应的词频
+- bm25.doclen.npy        float32 [n]：每个片段的词数
+"""
+
+import json
+import math
+import re
+import unicodedata
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+BM25_META_FILE = "bm25.json"
+_CJK = r"㐀-䶿一-鿿豈-﫿"
+_TOKEN_RE = re.compile(rf"[{_CJK}]+|[a-z0-9]+")
+
+
+def tokenize(text: str):
+    """中文连续片段切成字符二元组（单字片段保留单字），英文/数字按词切分"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    tokens = []
+    for run in _TOKEN_RE.findall(text):
+        if "㐀" <= run[0]:
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+class BM25Index:
+    def __init__(self, terms, offsets, postings, tf, doc_len, k1: float = 1.5, b: float = 0.75):
+        self.terms = {t: i for i, t in enumerate(terms)}
+        self.offsets = offsets
+        self.postings = postings
+        self.tf = tf
+        self.doc_len = doc_len
+        self.k1 = k1
+        self.b = b
+        self.n = len(doc_len)
+        self.avgdl = float(doc_len.mean()) if self.n else 0.0
+        # BM25 分母中与查询无关的部分，加载时算好
+        self._norm = k1 * (1 - b + b * doc_len / self.avgdl) if self.n else doc_len
+
+    @classmethod
+    def build(cls, texts, k1: float = 1.5, b: float = 0.75):
+        """按行号顺序为 texts 建立倒排索引"""
+        postings = {}
+        doc_len = []
+        for row, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doc_len.append(sum(counts.values()))
+            for term, c in counts.items():
+                postings.setdefault(term, []).append((row, c))
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        for i, t in enumerate(terms):
+            offsets[i + 1] = offsets[i] + len(postings[t])
+        rows = np.fromiter((r for t in terms for r, _ in postings[t]), dtype=np.int32, count=int(offsets[-1]))
+        tf = np.fromiter((c for t in terms for _, c in postings[t]), dtype=np.float32, count=int(offsets[-1]))
+        return cls(terms, offsets, rows, tf, np.array(doc_len, dtype=np.float32), k1, b)
+
+    def idf(self, term_id: int) -> float:
+        df = int(self.offsets[term_id + 1] - self.offsets[term_id])
+        return math.log(1 + (self.n - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, k: int = 20):
+        """返回 (结果列表 [(行号, 分数)], 归一化置信度)
+
+        置信度 = 最高分 / 参考分，截断到 0~1。参考分为"平均长度的片段恰好包含每个查询词一次"
+        时的得分（即各查询词 idf 之和），可理解为最高分片段覆盖了多少查询词权重。
+        """
+        term_ids = [self.terms[t] for t in set(tokenize(query)) if t in self.terms]
+        if not term_ids or not self.n:
+            return [], 0.0
+        scores = np.zeros(self.n, dtype=np.float32)
+        ref_score = 0.0
+        for tid in term_ids:
+            start, end = self.offsets[tid], self.offsets[tid + 1]
+            rows = self.postings[start:end]
+            tf = self.tf[start:end]
+            idf = self.idf(tid)
+            scores[rows] += idf * tf * (self.k1 + 1) / (tf + self._norm[rows])
+            ref_score += idf
+        k = min(k, self.n)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        results = [(int(r), float(scores[r])) for r in top if scores[r] > 0]
+        confidence = min(1.0, results[0][1] / ref_score) if results and ref_score else 0.0
+        return results, confidence
+
+    def save(self, folder) -> None:
+        """保存到 folder（先写临时文件再替换，正在 mmap 读取旧文件的进程不受影响）"""
+        folder = Path(folder)
+        terms = sorted(self.terms, key=self.terms.get)
+        arrays = {
+            "bm25.offsets.npy": self.offsets,
+            "bm25.postings.npy": self.postings,
+            "bm25.tf.npy": self.tf,
+            "bm25.doclen.npy": self.doc_len,
+        }
+        for name, arr in arrays.items():
+            with (folder / (name + ".tmp")).open("wb") as f:
+                np.save(f, arr)
+        with (folder / (BM25_META_FILE + ".tmp")).open("w", encoding="utf-8") as f:
+            json.dump({"k1": self.k1, "b": self.b, "n": self.n, "terms": terms}, f, ensure_ascii=False)
+        for name in list(arrays) + [BM25_META_FILE]:
+            (folder / (name + ".tmp")).replace(folder / name)
+
+    @classmethod
+    def load(cls, folder):
+        folder = Path(folder)
+        with (folder / BM25_META_FILE).open("r", encoding="utf-8") as f:
+            meta = json.load(f)
+        return cls(
+            meta["terms"],
+            np.load(folder / "bm25.offsets.npy", mmap_mode="r"),
+            np.load(folder / "bm25.postings.npy", mmap_mode="r"),
+            np.load(folder / "bm25.tf.npy", mmap_mode="r"),
+            np.asarray(np.load(folder / "bm25.doclen.npy")),
+            meta["k1"],
+            meta["b"],
+        )
+
+
+def has_bm25_index(folder) -> bool:
+    return (Path(folder) / BM25_META_FILE).exists()
+
+
+def build_for_store(vectorstore, folder) -> None:
+    """为向量库按 FAISS 行号顺序建立并保存 BM25 索引"""
+    texts = (
+        vectorstore.docstore.search(vectorstore.index_to_docstore_id[i]).page_content
+        for i in range(vectorstore.index.ntotal)
+    )
+    BM25Index.build(texts).save(folder)
+
+
+def reciprocal_rank_fusion(rankings, k: int = 60):
+    """RRF：融合多个排序列表（每个列表为按相关度排序的 key），返回融合后的 key 顺序"""
+    scores = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
@@ -0,0 +1,131 @@
+"""
+FAISS 索引类型：为大规模知识库提供近似最近邻（ANN）索引
+支持的类型（INDEX_TYPE）：
+- flat：精确检索（默认，与 FAISS.from_documents 相同），检索耗时随片段数线性增长
+- ivf_flat：倒排 + 原始向量，查询时只扫描 nprobe 个聚类
+- ivf_pq：倒排 + 乘积量化，内存占用最小，召回率略低
+- hnsw：分层图索引，查询快、无需训练，但不支持删除
+
+说明：
+- IVF 类索引会自动用已有向量训练；数据量不足以训练时自动退回更简单的类型
+- 查询参数（nprobe / efSearch）在加载后通过 set_search_params 设置，可随时调整
+- 向量已归一化，沿用 L2 距离即等价于余弦相似度排序
+- 只有 flat 索引支持原地删除片段，其余类型删除时从向量清单整体重建（见 supports_remove）
+"""
+
+import math
+
+import faiss
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+# FAISS 建议每个聚类中心至少 39 个训练样本
+_MIN_POINTS_PER_CENTROID = 39
+
+
+def default_nlist(n: int) -> int:
+    """IVF 聚类数：约 4·√n，同时保证每个聚类有足够的训练样本"""
+    return max(1, min(int(4 * math.sqrt(n)), n // _MIN_POINTS_PER_CENTROID))
+
+
+def default_pq_m(dim: int) -> int:
+    """PQ 子空间数：能整除维度、每个子空间约 8 维"""
+    m = max(1, dim // 8)
+    while dim % m:
+        m -= 1
+    return m
+
+
+def resolve_index_type(index_type: str, n: int, nlist: int = 0) -> str:
+    """数据量不足以训练时退回更简单的索引类型"""
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"不支持的索引类型: {index_type}，可选: {', '.join(INDEX_TYPES)}")
+    nlist = nlist or default_nlist(n)
+    if index_type == "ivf_pq" and n < 256 * _MIN_POINTS_PER_CENTROID:
+        index_type = "ivf_flat"
+    if index_type == "ivf_flat" and (nlist < 8 or n < nlist * _MIN_POINTS_PER_CENTROID):
+        index_type = "flat"
+    return index_type
+
+
+def create_index(vectors: np.ndarray, index_type: str = "flat", nlist: int = 0, pq_m: int = 0, hnsw_m: int = 32):
+    """创建（必要时训练）一个空索引，返回 (索引, 实际使用的索引类型)；向量需另行 add"""
+    n, dim = vectors.shape
+    actual = resolve_index_type(index_type, n, nlist)
+    nlist = nlist or default_nlist(n)
+    if actual == "flat":
+        spec = "Flat"
+    elif actual == "ivf_flat":
+        spec = f"IVF{nlist},Flat"
+    elif actual == "ivf_pq":
+        spec = f"IVF{nlist},PQ{pq_m or default_pq_m(dim)}"
+    else:
+        spec = f"HNSW{hnsw_m},Flat"
+    index = faiss.index_factory(dim, spec, faiss.METRIC_L2)
+    if not index.is_trained:
+        # 训练样本数有上限，避免百万级数据训练过慢
+        max_train = max(nlist, 256) * 256
+        sample = vectors
+        if n > max_train:
+            rng = np.random.default_rng(0)
+            sample = vectors[rng.choice(n, max_train, replace=False)]
+        index.train(np.ascontiguousarray(sample, dtype=np.float32))
+    return index, actual
+
+
+def build_store(texts, vectors, embeddings, metadatas=None, ids=None, index_type: str = "flat", **params):
+    """用指定类型的索引构建 LangChain FAISS 向量库"""
+    matrix = np.asarray(vectors, dtype=np.float32)
+    index, actual = create_index(matrix, index_type, **params)
+    if actual != index_type:
+        print(f"片段数 {len(matrix)} 不足以训练 {index_type} 索引，改用 {actual}")
+    vectorstore = FAISS(embeddings, index, InMemoryDocstore(), {})
+    vectorstore.add_embeddings(list(zip(texts, matrix.tolist())), metadatas=metadatas, ids=ids)
+    return vectorstore
+
+
+def convert_store(vectorstore, index_type: str, **params):
+    """把（流式构建的）精确索引转换为指定类型：取出全部向量，训练新索引后按原顺序写回"""
+    if index_type == index_type_of(vectorstore.index):
+        return vectorstore
+    vectors = vectorstore.index.reconstruct_n(0, vectorstore.index.ntotal)
+    index, actual = create_index(vectors, index_type, **params)
+    if actual != index_type:
+        print(f"片段数 {len(vectors)} 不足以训练 {index_type} 索引，改用 {actual}")
+    index.add(vectors)
+    vectorstore.index = index
+    return vectorstore
+
+
+def index_type_of(index) -> str:
+    """识别已加载索引的类型"""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    return "flat"
+
+
+def supports_remove(index) -> bool:
+    """只有精确索引能原地删除向量，其余类型增量更新时需要整体重建
+
+    LangChain 的 FAISS.delete 删除后把 index_to_docstore_id 重新编号为 0..n-1，
+    只有 IndexFlat 的 remove_ids 会同样压缩行号；IVF 类索引删除后保留原有编号，
+    检索会映射到错误的片段，之后 add 还会复用仍在使用的编号；HNSW 则不支持删除。
+    """
+    return index_type_of(index) == "flat"
+
+
+def set_search_params(index, nprobe: int = 0, ef_search: int = 0) -> None:
+    """设置查询参数：IVF 的 nprobe、HNSW 的 efSearch（0 表示保持默认）"""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and nprobe:
+        ivf.nprobe = min(nprobe, ivf.nlist)
+    hnsw = faiss.downcast_index(index)
+    if isinstance(hnsw, faiss.IndexHNSW) and ef_search:
+        hnsw.hnsw.efSearch = ef_search
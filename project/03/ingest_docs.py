@@ -0,0 +1,232 @@
+"""
+阶段 2 扩展：流式导入整个文档目录到向量库
+功能：
+1. 递归遍历 DOCS_DIR 下的 .md / .txt 文件（按路径排序，保证每次顺序一致）
+2. 按段落分块读取文件并切分，不把整个文件或整个语料一次性读进内存
+3. 按固定批大小向量化，逐批追加到 FAISS 索引
+4. 实时输出进度与吞吐（片段/秒）
+5. 定期保存检查点，进程中断后可从检查点继续
+6. 可选多进程并行向量化（--workers），每次取 batch_size × workers 个片段分发给各进程
+7. 导入过程中使用精确索引，全部完成后按 --index-type 训练并转换为 ANN 索引
+
+用法：
+    python project/03/ingest_docs.py [--docs-dir DIR] [--output DIR] [--batch-size 64] [--workers 4]
+
+说明：
+- 流水线本身的内存占用只与批大小、读块大小有关；索引和 docstore 会随语料增长
+- 分块 id 使用内容哈希（与 rag_qa_local_embedding 的增量构建一致），
+  续跑时已入库的片段在向量化之前就会被跳过，重复内容也只入库一次
+"""
+
+import argparse
+import json
+import shutil
+import time
+from pathlib import Path
+
+from langchain_core.documents import Document
+from langchain_community.vectorstores import FAISS
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from rag_qa_local_embedding import (
+    DOCS_DIR, VECTOR_STORE_PATH, INDEX_TYPE, INDEX_PARAMS, init_embeddings, chunk_hash, save_vector_store,
+)
+from parallel_embedding import ParallelEmbedder
+import faiss_index
+
+DOC_SUFFIXES = (".md", ".txt")
+CHECKPOINT_FILE = "ingest_checkpoint.json"
+# 文件结束标记：分块流中出现它表示该文件的所有分块都已产出
+_FILE_END = None
+
+
+def iter_files(docs_dir: Path):
+    """按路径顺序遍历待导入的文档文件"""
+    for path in sorted(docs_dir.rglob("*")):
+        if path.is_file() and path.suffix.lower() in DOC_SUFFIXES:
+            yield path
+
+
+def iter_blocks(path: Path, block_chars: int):
+    """把文件读成若干文本块，每块约 block_chars 字符
+
+    块达到 block_chars 时，优先在块内最后一个空行（段落边界）处切开，余下的行留给下一块；
+    没有空行时在当前行末切开。单行超过 block_chars 时按 block_chars 分段读取，
+    因此内存占用不超过约 2 × block_chars，与文件大小和换行方式无关。
+    """
+    buf = []
+    size = 0
+    # buf 中最后一个空行之后的下标（0 表示块内没有空行）
+    cut = 0
+    with path.open("r", encoding="utf-8", errors="ignore") as f:
+        for line in iter(lambda: f.readline(block_chars), ""):
+            buf.append(line)
+            size += len(line)
+            if not line.strip():
+                cut = len(buf)
+            if size >= block_chars:
+                if cut == 0:
+                    cut = len(buf)
+                yield "".join(buf[:cut])
+                buf = buf[cut:]
+                size = sum(len(l) for l in buf)
+                cut = 0
+    if buf:
+        yield "".join(buf)
+
+
+def iter_chunks(files, docs_dir: Path, splitter, block_chars: int):
+    """逐文件、逐块切分，产出 (相对路径, Document)；每个文件结束时产出 (相对路径, _FILE_END)"""
+    for path in files:
+        rel = path.relative_to(docs_dir).as_posix()
+        for block in iter_blocks(path, block_chars):
+            for text in splitter.split_text(block):
+                yield rel, Document(page_content=text, metadata={"source": rel})
+        yield rel, _FILE_END
+
+
+def iter_batches(chunk_stream, batch_size: int, seen_ids: set):
+    """把分块流组装成批次，产出 (分块列表, 本批写入后即完成的文件列表)
+
+    已入库（或本次已出现过）的内容在这里就被过滤掉，不会再次向量化。
+    """
+    batch = []
+    finished = []
+    for rel, doc in chunk_stream:
+        if doc is _FILE_END:
+            finished.append(rel)
+            continue
+        doc.id = chunk_hash(doc)
+        if doc.id in seen_ids:
+            continue
+        seen_ids.add(doc.id)
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield batch, finished
+            batch, finished = [], []
+    if batch or finished:
+        yield batch, finished
+
+
+def load_checkpoint(partial_dir: Path, embeddings):
+    """读取检查点，返回 (向量库或 None, 已完成文件集合)"""
+    ckpt = partial_dir / CHECKPOINT_FILE
+    if not ckpt.exists():
+        return None, set()
+    with ckpt.open("r", encoding="utf-8") as f:
+        state = json.load(f)
+    vectorstore = FAISS.load_local(str(partial_dir), embeddings, allow_dangerous_deserialization=True)
+    return vectorstore, set(state.get("done_files", []))
+
+
+def save_checkpoint(partial_dir: Path, vectorstore, done_files: set):
+    vectorstore.save_local(str(partial_dir))
+    tmp = partial_dir / (CHECKPOINT_FILE + ".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump({"done_files": sorted(done_files), "chunks": vectorstore.index.ntotal}, f, ensure_ascii=False)
+    tmp.replace(partial_dir / CHECKPOINT_FILE)
+
+
+def ingest(
+    docs_dir: Path = DOCS_DIR,
+    output: Path = VECTOR_STORE_PATH,
+    batch_size: int = 64,
+    checkpoint_every: int = 20,
+    block_chars: int = 20000,
+    resume: bool = True,
+    workers: int = 1,
+    index_type: str = INDEX_TYPE,
+    embeddings_factory=init_embeddings,
+):
+    """流式导入 docs_dir 下的所有文档，构建向量库并保存到 output"""
+    partial_dir = output.with_name(output.name + ".partial")
+    embeddings = embeddings_factory()
+    splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50, length_function=len)
+
+    vectorstore, done_files = (None, set())
+    if resume:
+        vectorstore, done_files = load_checkpoint(partial_dir, embeddings)
+        if vectorstore is not None:
+            print(f"从检查点继续：已完成 {len(done_files)} 个文件，{vectorstore.index.ntotal} 个片段")
+    seen_ids = set(vectorstore.index_to_docstore_id.values()) if vectorstore is not None else set()
+    partial_dir.mkdir(parents=True, exist_ok=True)
+
+    files = (p for p in iter_files(docs_dir) if p.relative_to(docs_dir).as_posix() not in done_files)
+    stream = iter_chunks(files, docs_dir, splitter, block_chars)
+
+    # 单进程时复用上面已加载的模型
+    with ParallelEmbedder(embeddings_factory, workers=workers, batch_size=batch_size, local=embeddings) as embedder:
+        vectorstore, added, elapsed = _run_pipeline(
+            stream, embedder, embeddings, vectorstore, done_files, seen_ids,
+            partial_dir, batch_size * max(1, workers), checkpoint_every,
+        )
+
+    if vectorstore is None:
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        print(f"没有可导入的文档: {docs_dir}")
+        return None
+
+    # 全部完成：转换索引类型，按 STORE_FORMAT 保存最终结果并替换旧向量库
+    faiss_index.convert_store(vectorstore, index_type, **INDEX_PARAMS)
+    save_vector_store(vectorstore, partial_dir)
+    # 批次数不足 checkpoint_every 时从未写过检查点
+    (partial_dir / CHECKPOINT_FILE).unlink(missing_ok=True)
+    if output.exists():
+        shutil.rmtree(output)
+    partial_dir.replace(output)
+    print(f"导入完成：{len(done_files)} 个文件，共 {vectorstore.index.ntotal} 个片段，"
+          f"耗时 {elapsed:.1f} 秒，向量库已保存到: {output}")
+    return vectorstore
+
+
+def _run_pipeline(stream, embedder, embeddings, vectorstore, done_files, seen_ids,
+                  partial_dir, flush_size, checkpoint_every):
+    """逐批向量化并写入索引，返回 (向量库, 本次新增片段数, 耗时秒数)"""
+    t0 = time.perf_counter()
+    added = 0
+    for n, (batch, finished) in enumerate(iter_batches(stream, flush_size, seen_ids), 1):
+        if batch:
+            vectors = embedder.embed([d.page_content for d in batch])
+            pairs = list(zip([d.page_content for d in batch], vectors))
+            metadatas = [d.metadata for d in batch]
+            ids = [d.id for d in batch]
+            if vectorstore is None:
+                vectorstore = FAISS.from_embeddings(pairs, embeddings, metadatas=metadatas, ids=ids)
+            else:
+                vectorstore.add_embeddings(pairs, metadatas=metadatas, ids=ids)
+            added += len(batch)
+        done_files.update(finished)
+        elapsed = time.perf_counter() - t0
+        rate = added / elapsed if elapsed > 0 else 0.0
+        print(f"\r已完成文件 {len(done_files)}，本次新增片段 {added}，{rate:.1f} 片段/秒", end="", flush=True)
+        if vectorstore is not None and n % checkpoint_every == 0:
+            save_checkpoint(partial_dir, vectorstore, done_files)
+    print()
+    return vectorstore, added, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="流式导入文档目录到 FAISS 向量库")
+    parser.add_argument("--docs-dir", type=Path, default=DOCS_DIR, help="文档根目录")
+    parser.add_argument("--output", type=Path, default=VECTOR_STORE_PATH, help="向量库输出目录")
+    parser.add_argument("--batch-size", type=int, default=64, help="每批向量化的片段数")
+    parser.add_argument("--checkpoint-every", type=int, default=20, help="每隔多少批保存一次检查点")
+    parser.add_argument("--block-chars", type=int, default=20000, help="读取文件时每块的字符数")
+    parser.add_argument("--workers", type=int, default=1, help="并行向量化的进程数")
+    parser.add_argument("--index-type", choices=faiss_index.INDEX_TYPES, default=INDEX_TYPE, help="最终索引类型")
+    parser.add_argument("--no-resume", action="store_true", help="忽略已有检查点，从头导入")
+    args = parser.parse_args()
+    ingest(
+        docs_dir=args.docs_dir,
+        output=args.output,
+        batch_size=args.batch_size,
+        checkpoint_every=args.checkpoint_every,
+        block_chars=args.block_chars,
+        resume=not args.no_resume,
+        workers=args.workers,
+        index_type=args.index_type,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+内存映射向量库格式：快速启动、多进程共享内存、不使用 pickle
+目录结构：
+- index.faiss         FAISS 索引，加载时以 mmap 方式打开（向量不复制进进程内存）
+- chunks.text.bin     所有片段正文（UTF-8）首尾相接
+- chunks.meta.bin     所有片段 metadata（JSON，UTF-8）首尾相接
+- chunks.ids.bin      所有片段 id（UTF-8）首尾相接
+- chunks.offsets.npy  int64 [n+1, 3]：第 i 行片段在三个列文件中的起止偏移
+- chunks.idsort.npy   按 id 排序后的行号，用于按 id 二分查找
+- store.json          格式版本、片段数、索引类型
+
+第 i 行即 FAISS 索引中的第 i 个向量。列文件通过 mmap 按需读取，
+多个 worker 进程加载同一目录时，通过操作系统页缓存共享同一份物理内存。
+"""
+
+import json
+import mmap
+from collections.abc import Mapping
+from pathlib import Path
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+
+from faiss_index import index_type_of
+
+STORE_FORMAT = "mmap-columnar-v1"
+STORE_META_FILE = "store.json"
+_COLUMNS = ("text", "meta", "ids")
+
+
+def is_mmap_store(folder) -> bool:
+    return (Path(folder) / STORE_META_FILE).exists()
+
+
+def _tmp(path: Path) -> Path:
+    return path.with_name(path.name + ".tmp")
+
+
+def save_store(vectorstore, folder) -> None:
+    """把 LangChain FAISS 向量库保存为内存映射格式（会删除旧格式的 index.pkl）
+
+    所有文件先写临时文件再整体替换：正在以 mmap 方式读取旧文件的进程不受影响。
+    """
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    n = vectorstore.index.ntotal
+    offsets = np.zeros((n + 1, 3), dtype=np.int64)
+    ids = []
+    targets = [folder / f"chunks.{c}.bin" for c in _COLUMNS]
+    files = [_tmp(t).open("wb") for t in targets]
+    try:
+        for i in range(n):
+            _id = vectorstore.index_to_docstore_id[i]
+            doc = vectorstore.docstore.search(_id)
+            parts = (
+                doc.page_content.encode("utf-8"),
+                json.dumps(doc.metadata, ensure_ascii=False).encode("utf-8"),
+                _id.encode("utf-8"),
+            )
+            for col, data in enumerate(parts):
+                files[col].write(data)
+                offsets[i + 1, col] = offsets[i, col] + len(data)
+            ids.append(_id)
+    finally:
+        for f in files:
+            f.close()
+    targets += [folder / "chunks.offsets.npy", folder / "chunks.idsort.npy", folder / "index.faiss"]
+    with _tmp(targets[3]).open("wb") as f:
+        np.save(f, offsets)
+    with _tmp(targets[4]).open("wb") as f:
+        np.save(f, np.array(sorted(range(n), key=ids.__getitem__), dtype=np.int64))
+    faiss.write_index(vectorstore.index, str(_tmp(targets[5])))
+    with _tmp(folder / STORE_META_FILE).open("w", encoding="utf-8") as f:
+        json.dump({"format": STORE_FORMAT, "count": n, "index_type": index_type_of(vectorstore.index)}, f)
+    for t in targets + [folder / STORE_META_FILE]:
+        _tmp(t).replace(t)
+    (folder / "index.pkl").unlink(missing_ok=True)
+
+
+class _Columns:
+    """列文件的只读视图：按行号取出正文 / metadata / id"""
+
+    def __init__(self, folder: Path):
+        self.offsets = np.load(folder / "chunks.offsets.npy", mmap_mode="r")
+        self.idsort = np.load(folder / "chunks.idsort.npy", mmap_mode="r")
+        self._maps = {}
+        for c in _COLUMNS:
+            with (folder / f"chunks.{c}.bin").open("rb") as f:
+                # 空文件无法 mmap
+                size = f.seek(0, 2)
+                self._maps[c] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def get(self, row: int, col: int) -> str:
+        start, end = self.offsets[row, col], self.offsets[row + 1, col]
+        return self._maps[_COLUMNS[col]][start:end].decode("utf-8")
+
+    def row_of(self, _id: str) -> int:
+        """按 id 二分查找行号，找不到返回 -1"""
+        lo, hi = 0, len(self.idsort)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            row = int(self.idsort[mid])
+            if self.get(row, 2) < _id:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self.idsort) and self.get(int(self.idsort[lo]), 2) == _id:
+            return int(self.idsort[lo])
+        return -1
+
+    def document(self, row: int) -> Document:
+        return Document(id=self.get(row, 2), page_content=self.get(row, 0), metadata=json.loads(self.get(row, 1)))
+
+
+class ColumnarDocstore:
+    """只读 docstore：按需从列文件读取片段，接口与 InMemoryDocstore.search 一致"""
+
+    def __init__(self, columns: _Columns):
+        self._columns = columns
+
+    def search(self, search: str):
+        row = self._columns.row_of(search)
+        if row < 0:
+            return f"ID {search} not found."
+        return self._columns.document(row)
+
+
+class IndexToIdMap(Mapping):
+    """FAISS 行号 -> 片段 id 的惰性映射，启动时不必构建整张字典"""
+
+    def __init__(self, columns: _Columns):
+        self._columns = columns
+
+    def __getitem__(self, row):
+        if not 0 <= row < len(self._columns):
+            raise KeyError(row)
+        return self._columns.get(int(row), 2)
+
+    def __iter__(self):
+        return iter(range(len(self._columns)))
+
+    def __len__(self) -> int:
+        return len(self._columns)
+
+
+def load_store(folder, embeddings, in_memory: bool = False):
+    """加载内存映射格式的向量库
+
+    in_memory=False（默认）：索引以 mmap 打开，docstore 只读、按需读取，适合线上服务
+    in_memory=True：完整读入内存并转为可修改的 InMemoryDocstore，用于增量更新
+    """
+    folder = Path(folder)
+    with (folder / STORE_META_FILE).open("r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("format") != STORE_FORMAT:
+        raise ValueError(f"不支持的向量库格式: {meta.get('format')}")
+    columns = _Columns(folder)
+    index_path = str(folder / "index.faiss")
+    if in_memory:
+        index = faiss.read_index(index_path)
+        docs = [columns.document(i) for i in range(len(columns))]
+        docstore = InMemoryDocstore({d.id: d for d in docs})
+        return FAISS(embeddings, index, docstore, {i: d.id for i, d in enumerate(docs)})
+    # IVF 的倒排表用 IO_FLAG_MMAP 映射；Flat / HNSW 的向量数据用 IO_FLAG_MMAP_IFC 映射
+    if meta.get("index_type", "flat").startswith("ivf"):
+        flags = faiss.IO_FLAG_MMAP
+    else:
+        flags = faiss.IO_FLAG_MMAP_IFC
+    index = faiss.read_index(index_path, flags)
+    return FAISS(embeddings, index, ColumnarDocstore(columns), IndexToIdMap(columns))
@@ -0,0 +1,101 @@
+"""
+并行分批向量化：用进程池加速建索引时的 embedding 计算
+功能：
+1. 每个工作进程只加载一次 embedding 模型（进程池 initializer）
+2. 先按文本长度排序再分批，同一批内长度接近，减少 padding 浪费
+3. 批大小可调；各批结果按原始顺序合并，可直接用于构建同一个 FAISS 索引
+
+用法：
+    with ParallelEmbedder(init_embeddings, workers=4, batch_size=64) as embedder:
+        vectors = embedder.embed(texts)
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List
+
+# 工作进程内的 embedding 模型实例（每个进程各自一份）
+_worker_embeddings = None
+
+
+def _init_worker(factory: Callable, batch_size: int, threads: int):
+    """工作进程初始化：限制 torch 线程数，避免多个进程互相抢占 CPU，然后加载模型"""
+    global _worker_embeddings
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    _worker_embeddings = _with_batch_size(factory(), batch_size)
+
+
+def _embed_batch(texts: List[str]) -> List[List[float]]:
+    return _worker_embeddings.embed_documents(texts)
+
+
+def _with_batch_size(embeddings, batch_size: int):
+    # HuggingFaceEmbeddings 内部还会再按 batch_size 切分，这里与外层批大小对齐，一批只做一次前向计算
+    encode_kwargs = getattr(embeddings, "encode_kwargs", None)
+    if isinstance(encode_kwargs, dict):
+        encode_kwargs["batch_size"] = batch_size
+    return embeddings
+
+
+def make_batches(texts: List[str], batch_size: int, sort_by_length: bool = True):
+    """返回 [(原始下标列表, 文本列表), ...]；排序后相邻文本长度接近"""
+    order = list(range(len(texts)))
+    if sort_by_length:
+        order.sort(key=lambda i: len(texts[i]))
+    batches = []
+    for start in range(0, len(order), batch_size):
+        idx = order[start:start + batch_size]
+        batches.append((idx, [texts[i] for i in idx]))
+    return batches
+
+
+class ParallelEmbedder:
+    """多进程分批 embedding；workers <= 1 时在当前进程内执行（同样按长度排序分批）
+
+    local：调用方已加载的 embedding 实例，workers <= 1 时直接使用，不再调用 factory 重复加载模型
+    """
+
+    def __init__(self, factory: Callable, workers: int = 1, batch_size: int = 64, sort_by_length: bool = True,
+                 local=None):
+        self.factory = factory
+        self.local = local
+        self.workers = max(1, workers)
+        self.batch_size = batch_size
+        self.sort_by_length = sort_by_length
+        self._pool = None
+        self._local = None
+
+    def __enter__(self):
+        if self.workers > 1:
+            threads = max(1, (os.cpu_count() or 1) // self.workers)
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker,
+                initargs=(self.factory, self.batch_size, threads),
+            )
+        else:
+            self._local = _with_batch_size(self.local if self.local is not None else self.factory(), self.batch_size)
+        return self
+
+    def __exit__(self, *exc):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        return False
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """向量化 texts，返回顺序与输入一致"""
+        batches = make_batches(texts, self.batch_size, self.sort_by_length)
+        if self._pool is not None:
+            results = self._pool.map(_embed_batch, [b for _, b in batches])
+        else:
+            results = (self._local.embed_documents(b) for _, b in batches)
+        vectors = [None] * len(texts)
+        for (idx, _), batch_vectors in zip(batches, results):
+            for i, v in zip(idx, batch_vectors):
+                vectors[i] = v
+        return vectors
@@ -5,13 +5,22 @@
 2. 文本分块并使用本地 HuggingFace Embedding 模型建立向量库（FAISS）
 3. 支持命令行问答，基于文档检索回答
 4. 显示引用的文档片段
+5. 支持增量重建（--update）：按内容哈希比对分块，只向量化新增/变更的片段
+6. 支持多进程并行向量化（环境变量 EMBED_WORKERS / EMBED_BATCH_SIZE）
+7. 支持 ANN 索引类型（环境变量 INDEX_TYPE：flat / ivf_flat / ivf_pq / hnsw）
+8. 支持内存映射存储格式（环境变量 STORE_FORMAT=mmap）：启动快、多进程共享内存、不使用 pickle
+9. 保存向量库时同时建立 BM25 倒排索引，供混合检索使用
 
 注意：如果你的 API 支持 embedding，可以使用 rag_qa.py
 如果 API 不支持 embedding，使用此版本（需要下载模型，首次运行较慢）
 """
 
 import os
+import sys
+import json
+import hashlib
 from pathlib import Path
+import numpy as np
 from langchain.chat_models import init_chat_model
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_community.document_loaders import TextLoader
@@ -19,6 +28,10 @@ from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
 from langchain_huggingface import HuggingFaceEmbeddings
 from dotenv import load_dotenv
+from parallel_embedding import ParallelEmbedder
+import faiss_index
+import mmap_store
+import bm25_index
 
 load_dotenv()
 
@@ -28,6 +41,25 @@ DOCS_DIR = BASE_DIR / "docs"
 DATA_DIR = BASE_DIR / "data"
 VECTOR_STORE_PATH = DATA_DIR / "faiss_index_local"
 FAQ_FILE = DOCS_DIR / "faq.md"
+# 增量构建清单：记录每个分块的内容哈希及其向量，保存在向量库目录中
+MANIFEST_FILE = VECTOR_STORE_PATH / "manifest.json"
+MANIFEST_VECTORS_FILE = VECTOR_STORE_PATH / "manifest_vectors.npy"
+EMBEDDING_MODEL_NAME = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+# 建索引时的向量化并行度与批大小（1 个 worker 即在当前进程内分批计算）
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "1"))
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+# 索引类型及建索引参数（0 表示按数据量自动选择）
+INDEX_TYPE = os.getenv("INDEX_TYPE", "flat")
+INDEX_PARAMS = {
+    "nlist": int(os.getenv("IVF_NLIST", "0")),
+    "pq_m": int(os.getenv("PQ_M", "0")),
+    "hnsw_m": int(os.getenv("HNSW_M", "32")),
+}
+# 查询参数：IVF 扫描的聚类数、HNSW 的候选集大小
+SEARCH_NPROBE = int(os.getenv("SEARCH_NPROBE", "16"))
+SEARCH_EF_SEARCH = int(os.getenv("SEARCH_EF_SEARCH", "64"))
+# 保存格式：pickle（LangChain save_local）或 mmap（见 mmap_store.py）；加载时自动识别
+STORE_FORMAT = os.getenv("STORE_FORMAT", "pickle")
 
 
 def init_model():
@@ -45,7 +77,7 @@ def init_embeddings():
     # 使用中文友好的 embedding 模型
     # 首次运行会自动下载模型（约几百MB），需要一些时间
     return HuggingFaceEmbeddings(
-        model_name="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
+        model_name=EMBEDDING_MODEL_NAME,
         # 或者使用纯中文模型（如果上面的不行）：
         # model_name="sentence-transformers/distiluse-base-multilingual-cased",
         model_kwargs={'device': 'cpu'},  # 使用 CPU，如果有 GPU 可以改为 'cuda'
@@ -77,40 +109,162 @@ def load_and_split_documents():
     return chunks
 
 
-def build_vector_store():
-    """构建向量库并保存"""
+def chunk_hash(chunk) -> str:
+    """分块内容哈希，作为该分块在向量库中的 id（内容不变则 id 不变）"""
+    return hashlib.sha256(chunk.page_content.encode("utf-8")).hexdigest()[:32]
+
+
+def dedupe_chunks(chunks):
+    """为分块计算哈希并去重（内容完全相同的分块只保留第一个）"""
+    seen = {}
+    for chunk in chunks:
+        h = chunk_hash(chunk)
+        if h not in seen:
+            seen[h] = chunk
+    return seen
+
+
+def load_manifest():
+    """读取增量构建清单，返回 {哈希: 向量}；清单不存在或 embedding 模型已变化时返回空字典"""
+    if not MANIFEST_FILE.exists() or not MANIFEST_VECTORS_FILE.exists():
+        return {}
+    with MANIFEST_FILE.open("r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("embedding_model") != EMBEDDING_MODEL_NAME:
+        return {}
+    vectors = np.load(MANIFEST_VECTORS_FILE)
+    hashes = manifest.get("hashes", [])
+    if len(hashes) != len(vectors):
+        return {}
+    return dict(zip(hashes, vectors))
+
+
+def save_manifest(hash_to_vector):
+    """保存增量构建清单（先写临时文件再替换，避免中途退出留下半个清单）"""
+    hashes = list(hash_to_vector.keys())
+    dim = len(next(iter(hash_to_vector.values()))) if hashes else 0
+    vectors = np.array([hash_to_vector[h] for h in hashes], dtype=np.float32).reshape(len(hashes), dim)
+    tmp_vectors = MANIFEST_VECTORS_FILE.with_suffix(".tmp.npy")
+    np.save(tmp_vectors, vectors)
+    tmp_vectors.replace(MANIFEST_VECTORS_FILE)
+    tmp_manifest = MANIFEST_FILE.with_suffix(".tmp")
+    with tmp_manifest.open("w", encoding="utf-8") as f:
+        json.dump({"embedding_model": EMBEDDING_MODEL_NAME, "hashes": hashes}, f)
+    tmp_manifest.replace(MANIFEST_FILE)
+
+
+def build_vector_store(incremental: bool = False):
+    """构建向量库并保存
+
+    incremental=True 时只向量化新增/变更的分块：
+    - 能加载旧向量库时，直接从索引和 docstore 中删除已移除的分块、追加新分块
+    - 旧向量库不可用时，用清单中保存的向量重建索引，同样只需向量化新分块
+    """
     print("正在构建向量库...")
     print("（首次运行会下载 embedding 模型，可能需要几分钟）")
     
     # 加载并分块文档
     chunks = load_and_split_documents()
+    by_hash = dedupe_chunks(chunks)
     
     # 初始化 embeddings（首次运行会下载模型）
     print("正在初始化 embedding 模型...")
     embeddings = init_embeddings()
     
-    # 创建向量库
+    known = load_manifest() if incremental else {}
+    new_hashes = [h for h in by_hash if h not in known]
+    removed_hashes = [h for h in known if h not in by_hash]
+    print(f"分块总数 {len(by_hash)}：复用 {len(by_hash) - len(new_hashes)}，"
+          f"新增/变更 {len(new_hashes)}，删除 {len(removed_hashes)}")
+    
+    # 只向量化新增/变更的分块
     print("正在向量化文档...")
-    vectorstore = FAISS.from_documents(chunks, embeddings)
+    new_vectors = []
+    if new_hashes:
+        with ParallelEmbedder(init_embeddings, workers=EMBED_WORKERS, batch_size=EMBED_BATCH_SIZE,
+                              local=embeddings) as embedder:
+            new_vectors = embedder.embed([by_hash[h].page_content for h in new_hashes])
+    hash_to_vector = {h: known[h] for h in by_hash if h in known}
+    hash_to_vector.update(zip(new_hashes, new_vectors))
+    
+    vectorstore = None
+    if known and VECTOR_STORE_PATH.exists():
+        try:
+            vectorstore = load_vector_store(embeddings, writable=True)
+            # 旧向量库的 id 必须与清单一致、索引类型与配置一致，才能原地增删
+            expected_type = faiss_index.resolve_index_type(INDEX_TYPE, len(by_hash), INDEX_PARAMS["nlist"])
+            if set(vectorstore.index_to_docstore_id.values()) != set(known):
+                vectorstore = None
+            elif faiss_index.index_type_of(vectorstore.index) != expected_type:
+                vectorstore = None
+            elif removed_hashes and not faiss_index.supports_remove(vectorstore.index):
+                print("当前索引不支持删除，将使用清单中的向量重建")
+                vectorstore = None
+        except Exception as e:
+            print(f"旧向量库不可用，将使用清单中的向量重建: {e}")
+            vectorstore = None
+    
+    if vectorstore is not None and not new_hashes and not removed_hashes:
+        # 内容没有变化，保留原文件（避免索引版本变化导致下游缓存失效）
+        print("知识库无变化，无需重建")
+        return vectorstore
+    if vectorstore is not None:
+        # 原地更新：删除已移除的分块，追加新分块
+        if removed_hashes:
+            vectorstore.delete(removed_hashes)
+        if new_hashes:
+            vectorstore.add_embeddings(
+                list(zip([by_hash[h].page_content for h in new_hashes], new_vectors)),
+                metadatas=[by_hash[h].metadata for h in new_hashes],
+                ids=new_hashes,
+            )
+    else:
+        # 全量建索引（向量来自清单 + 本次新向量化的分块）
+        hashes = list(by_hash.keys())
+        vectorstore = faiss_index.build_store(
+            [by_hash[h].page_content for h in hashes],
+            [hash_to_vector[h] for h in hashes],
+            embeddings,
+            metadatas=[by_hash[h].metadata for h in hashes],
+            ids=hashes,
+            index_type=INDEX_TYPE,
+            **INDEX_PARAMS,
+        )
     
-    # 保存向量库
+    # 保存向量库与清单
     DATA_DIR.mkdir(exist_ok=True)
-    vectorstore.save_local(str(VECTOR_STORE_PATH))
+    save_vector_store(vectorstore, VECTOR_STORE_PATH)
+    save_manifest(hash_to_vector)
     print(f"向量库已保存到: {VECTOR_STORE_PATH}")
     
     return vectorstore
 
 
-def load_vector_store():
-    """加载已存在的向量库"""
+def save_vector_store(vectorstore, path):
+    """按 STORE_FORMAT 保存向量库，并为同一批片段建立 BM25 倒排索引"""
+    if STORE_FORMAT == "mmap":
+        mmap_store.save_store(vectorstore, path)
+    else:
+        vectorstore.save_local(str(path))
+        # 删除内存映射格式的标记文件，避免加载时误判格式
+        (Path(path) / mmap_store.STORE_META_FILE).unlink(missing_ok=True)
+    bm25_index.build_for_store(vectorstore, path)
+
+
+def load_vector_store(embeddings=None, writable=False):
+    """加载已存在的向量库（自动识别保存格式）；writable=True 时完整读入内存，以便增删片段"""
     print(f"正在加载向量库: {VECTOR_STORE_PATH}")
     
-    embeddings = init_embeddings()
-    vectorstore = FAISS.load_local(
-        str(VECTOR_STORE_PATH),
-        embeddings,
-        allow_dangerous_deserialization=True  # FAISS 需要此参数
-    )
+    embeddings = embeddings or init_embeddings()
+    if mmap_store.is_mmap_store(VECTOR_STORE_PATH):
+        vectorstore = mmap_store.load_store(VECTOR_STORE_PATH, embeddings, in_memory=writable)
+    else:
+        vectorstore = FAISS.load_local(
+            str(VECTOR_STORE_PATH),
+            embeddings,
+            allow_dangerous_deserialization=True  # FAISS 需要此参数
+        )
+    faiss_index.set_search_params(vectorstore.index, nprobe=SEARCH_NPROBE, ef_search=SEARCH_EF_SEARCH)
     
     print("向量库加载成功")
     return vectorstore
@@ -124,7 +278,8 @@ def get_vector_store():
         except Exception as e:
             print(f"加载向量库失败: {e}")
             print("重新构建向量库...")
-            return build_vector_store()
+            # 清单中保存了已有分块的向量，重建时只需向量化清单中没有的分块
+            return build_vector_store(incremental=True)
     else:
         return build_vector_store()
 
@@ -179,9 +334,12 @@ def main():
     print("\n正在初始化模型...")
     model = init_model()
     
-    # 获取向量库
+    # 获取向量库（带 --update 参数时先增量更新）
     print("\n正在准备向量库...")
-    vectorstore = get_vector_store()
+    if "--update" in sys.argv[1:]:
+        vectorstore = build_vector_store(incremental=True)
+    else:
+        vectorstore = get_vector_store()
     
     # 创建检索器（检索 top-3 相关文档）
     retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
@@ -0,0 +1,101 @@
+"""
+订单库查询基准：生成大规模合成订单，对比按订单号、完整快递单号、快递单号尾号的查询延迟
+用法：
+    python project/05/bench_order_store.py --orders 100000 1000000
+    python project/05/bench_order_store.py --orders 1000000 --db /tmp/orders_1m.db   # 保留数据库，下次直接复用
+
+说明：
+- 默认在临时目录建库，结束后删除；--db 指定的库已有足够订单时不再重复生成
+- 作为对照，同时测量旧实现的方式（按快递单号逐条扫描并用正则规范化）在同等数据量下的耗时
+"""
+
+import argparse
+import random
+import re
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from order_store import OrderStore, digits_of, generate_synthetic
+
+START_ID = 20000000
+
+
+def timed(fn, args_list):
+    latencies = []
+    found = 0
+    for args in args_list:
+        t0 = time.perf_counter()
+        if fn(args) is not None:
+            found += 1
+        latencies.append((time.perf_counter() - t0) * 1000)
+    return found / len(args_list), latencies
+
+
+def sample_tracking_numbers(store: OrderStore, n: int, seed: int = 2):
+    conn = sqlite3.connect(str(store.path))
+    total = conn.execute("SELECT MAX(rowid) FROM shipments").fetchone()[0]
+    rng = random.Random(seed)
+    rows = [conn.execute("SELECT tracking_number FROM shipments WHERE rowid = ?", (rng.randint(1, total),)).fetchone()
+            for _ in range(n)]
+    conn.close()
+    return [r[0] for r in rows if r]
+
+
+def linear_scan_baseline(store: OrderStore, queries, limit: int = 200000):
+    """旧实现的查找方式：遍历全部运单、逐条正则规范化后比较（只取前 limit 条运单，按比例估算全量耗时）"""
+    conn = sqlite3.connect(str(store.path))
+    rows = conn.execute("SELECT order_id, tracking_number FROM shipments LIMIT ?", (limit,)).fetchall()
+    total = conn.execute("SELECT COUNT(*) FROM shipments").fetchone()[0]
+    conn.close()
+    shipping = {oid: {"tracking_number": tn} for oid, tn in rows}
+    t0 = time.perf_counter()
+    for q in queries:
+        q_digits = re.sub(r"\D", "", q)
+        for k, v in shipping.items():
+            if q_digits == re.sub(r"\D", "", v["tracking_number"]):
+                break
+    per_query = (time.perf_counter() - t0) * 1000 / len(queries)
+    return per_query * total / max(len(rows), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="订单库查询延迟基准")
+    parser.add_argument("--orders", type=int, nargs="+", default=[100000], help="订单规模列表")
+    parser.add_argument("--queries", type=int, default=2000, help="每类查询的次数")
+    parser.add_argument("--db", default="", help="数据库路径（默认使用临时目录）")
+    args = parser.parse_args()
+
+    print(f"{'orders':>9} {'query':>16} {'hit_rate':>9} {'p50_ms':>8} {'p99_ms':>8}")
+    for n in args.orders:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(args.db) if args.db else Path(tmp) / f"orders_{n}.db"
+            store = OrderStore(path)
+            have = store.count()["orders"] - 3
+            if have < n:
+                t0 = time.perf_counter()
+                generate_synthetic(store, n - have, start_id=START_ID + have, seed=have)
+                print(f"{n:>9} {'生成数据':>16} {time.perf_counter() - t0:>8.1f}s")
+
+            rng = random.Random(1)
+            order_ids = [f"订单{START_ID + rng.randrange(n)}" for _ in range(args.queries)]
+            tracking = sample_tracking_numbers(store, args.queries)
+            suffixes = [digits_of(t)[-8:] for t in tracking]
+            cases = [
+                ("order_id", store.get_order, order_ids),
+                ("shipping_by_id", store.get_shipment, order_ids),
+                ("tracking_full", store.get_shipment, tracking),
+                ("tracking_suffix8", store.get_shipment, suffixes),
+            ]
+            for name, fn, queries in cases:
+                hit_rate, lat = timed(fn, queries)
+                print(f"{n:>9} {name:>16} {hit_rate:>9.3f} {np.percentile(lat, 50):>8.3f} {np.percentile(lat, 99):>8.3f}")
+            scan_ms = linear_scan_baseline(store, tracking[:20])
+            print(f"{n:>9} {'线性扫描(估算)':>16} {'-':>9} {scan_ms:>8.1f} {'-':>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+带缓存的检索器：包装 FAISS 向量库，减少重复问题的编码与检索开销
+功能：
+1. 问题归一化（全角转半角、去标点、合并空白、英文小写），归一化后相同的问题视为同一个
+2. 缓存问题向量（跳过 MiniLM 编码）和 top-k 文档 id（跳过 FAISS 检索），均为有界 LRU
+3. 检索结果按向量库版本区分，索引重建后旧结果自然失效；问题向量只依赖 embedding 模型，可跨版本复用
+4. 可选混合检索（传入 BM25 索引）：稀疏与稠密结果用 RRF 融合；
+   BM25 置信度足够高时只走稀疏检索，不调用 embedding 模型。调用方可先 bm25_search 判断是否走稀疏快速路径
+   （sparse_fast_path），再决定是否需要问题向量，检索结果通过 sparse 参数传回 invoke_with_score 复用
+5. invoke_with_score 额外返回最相关片段的余弦相似度（与 top-k 文档 id 一起缓存），
+   供调用方在知识库没有相关内容时提前返回
+"""
+
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from bm25_index import reciprocal_rank_fusion
+
+
+def normalize_query(text: str) -> str:
+    """问题归一化：NFKC（全角转半角）→ 小写 → 去标点 → 合并空白"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    text = "".join(
+        " " if unicodedata.category(ch).startswith(("P", "S")) else ch
+        for ch in text
+    )
+    text = re.sub(r"\s+", " ", text).strip()
+    # 中文之间的空格没有意义，只保留英文/数字之间的空格
+    return re.sub(r"(?<=[^\x00-\x7f]) | (?=[^\x00-\x7f])", "", text)
+
+
+class LRUStore:
+    """线程安全的有界 LRU 字典，记录命中/未命中次数"""
+
+    def __init__(self, max_entries: int = 2048):
+        self.max_entries = max_entries
+        self._data: "OrderedDict" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class CachingRetriever:
+    """带问题向量缓存与 top-k 结果缓存的检索器，接口与 vectorstore.as_retriever() 的 invoke 一致"""
+
+    def __init__(
+        self,
+        vectorstore,
+        k: int = 3,
+        index_version: str = "",
+        embedding_cache: Optional[LRUStore] = None,
+        result_cache: Optional[LRUStore] = None,
+        bm25=None,
+        fetch_k: int = 20,
+        fast_path_confidence: float = 0.6,
+        fast_path_margin: float = 1.5,
+        stats: Optional[Dict[str, int]] = None,
+        observe: Optional[Callable[[str, str, float], None]] = None,
+    ):
+        self.vectorstore = vectorstore
+        self.k = k
+        self.index_version = index_version
+        self.embedding_cache = embedding_cache if embedding_cache is not None else LRUStore()
+        self.result_cache = result_cache if result_cache is not None else LRUStore()
+        self.bm25 = bm25
+        self.fetch_k = fetch_k
+        self.fast_path_confidence = fast_path_confidence
+        self.fast_path_margin = fast_path_margin
+        # 各检索路径的次数（由调用方传入，检索器重建后继续累计）
+        self.stats = stats if stats is not None else {}
+        # 耗时上报：observe(阶段, 名称, 秒数)，用于 embedding 与检索的埋点
+        self.observe = observe
+
+    def embed_query(self, query: str) -> List[float]:
+        """获取问题向量（优先读缓存）"""
+        key = normalize_query(query)
+        vector = self.embedding_cache.get(key)
+        if vector is None:
+            t0 = time.perf_counter()
+            vector = self.vectorstore.embeddings.embed_query(key or query)
+            self._observe("embedding", t0)
+            self.embedding_cache.put(key, vector)
+        return vector
+
+    def invoke(self, query: str, k: Optional[int] = None, vector=None) -> List[Document]:
+        """检索 top-k 文档：命中结果缓存时只按 id 取回文档，不再编码和检索
+
+        vector：调用方已算好的问题向量（可选），避免重复编码
+        """
+        return self.invoke_with_score(query, k, vector)[0]
+
+    def invoke_with_score(
+        self, query: str, k: Optional[int] = None, vector=None, sparse=None
+    ) -> Tuple[List[Document], Optional[float]]:
+        """检索 top-k 文档，同时返回稠密检索第一名的余弦相似度
+
+        BM25 稀疏快速路径不计算向量，相似度为 None（关键词命中已足够明确，视为相关）。
+        sparse：调用方已执行的 bm25_search 结果（可选），避免重复检索
+        """
+        k = k or self.k
+        key = (self.index_version, normalize_query(query), k)
+        cached = self.result_cache.get(key)
+        if cached is not None:
+            self._count("cached")
+            ids, score = cached
+            return [self.vectorstore.docstore.search(_id) for _id in ids], score
+        if self.bm25 is None:
+            self._count("dense")
+            scored = self.search_with_score(vector if vector is not None else self.embed_query(query), k)
+            docs = [doc for doc, _ in scored]
+            score = scored[0][1] if scored else 0.0
+        else:
+            docs, score = self._hybrid_search(query, k, vector, sparse)
+        self.result_cache.put(key, ([doc.id for doc in docs], score))
+        return docs, score
+
+    def search_by_vector(self, vector, k: Optional[int] = None) -> List[Document]:
+        return [doc for doc, _ in self.search_with_score(vector, k)]
+
+    def search_with_score(self, vector, k: Optional[int] = None) -> List[Tuple[Document, float]]:
+        """按向量检索，返回 (文档, 余弦相似度)，按相似度从高到低
+
+        向量已归一化，索引返回的平方 L2 距离 d 与余弦相似度的关系为 cos = 1 - d / 2。
+        """
+        t0 = time.perf_counter()
+        scored = self.vectorstore.similarity_search_with_score_by_vector(vector, k=k or self.k)
+        self._observe("vector_search", t0)
+        return [(doc, 1.0 - float(distance) / 2.0) for doc, distance in scored]
+
+    def bm25_search(self, query: str):
+        """BM25 检索，返回 (结果, 归一化置信度)；未配置 BM25 时返回 None"""
+        if self.bm25 is None:
+            return None
+        t0 = time.perf_counter()
+        sparse = self.bm25.search(query, self.fetch_k)
+        self._observe("bm25_search", t0)
+        return sparse
+
+    def sparse_fast_path(self, sparse) -> bool:
+        """bm25_search 的结果是否足够明确，检索可以只走稀疏路径（不需要问题向量）"""
+        return sparse is not None and self._sparse_confident(*sparse)
+
+    def _hybrid_search(self, query: str, k: int, vector, sparse=None) -> Tuple[List[Document], Optional[float]]:
+        sparse, confidence = sparse if sparse is not None else self.bm25_search(query)
+        sparse_ids = [self.vectorstore.index_to_docstore_id[row] for row, _ in sparse]
+        if self._sparse_confident(sparse, confidence):
+            # 稀疏快速路径：关键词命中足够明确，跳过 embedding 模型
+            self._count("sparse_fast_path")
+            return [self.vectorstore.docstore.search(_id) for _id in sparse_ids[:k]], None
+        self._count("hybrid")
+        if vector is None:
+            vector = self.embed_query(query)
+        scored = self.search_with_score(vector, self.fetch_k)
+        by_id = {doc.id: doc for doc, _ in scored}
+        fused = reciprocal_rank_fusion([sparse_ids, [doc.id for doc, _ in scored]])[:k]
+        docs = [by_id[_id] if _id in by_id else self.vectorstore.docstore.search(_id) for _id in fused]
+        return docs, scored[0][1] if scored else 0.0
+
+    def _sparse_confident(self, sparse, confidence: float) -> bool:
+        """最高分的归一化置信度足够高，且明显领先第二名"""
+        if not sparse or confidence < self.fast_path_confidence:
+            return False
+        if len(sparse) == 1:
+            return True
+        return sparse[0][1] >= self.fast_path_margin * sparse[1][1]
+
+    def _observe(self, stage: str, t0: float) -> None:
+        if self.observe is not None:
+            self.observe(stage, "", time.perf_counter() - t0)
+
+    def _count(self, path: str) -> None:
+        self.stats[path] = self.stats.get(path, 0) + 1
@@ -2,25 +2,35 @@
 阶段 4：RAG + Agent 打造"客服 Agent 原型"
 功能：
 1. 将 RAG 问答封装成一个 Tool（faq_rag_tool）
-2. 增加业务工具（mock 数据）：
+2. 增加业务工具（数据来自 order_store 的 SQLite 订单库，首次使用时写入种子数据）：
    - query_order_status：查询订单状态
    - query_shipping_info：查询物流信息
+   - query_orders_batch / query_shipping_batch：一次查询多个订单（减少多订单对话的 LLM 轮数）
 3. 使用 Agent 组合这些工具，让 Agent 自动决定使用哪个工具
 4. 支持命令行交互
+5. faq_rag_tool 同时提供异步实现（供 06 API 的 agent.ainvoke 使用，等待模型时不占用线程）
+6. 流水线埋点：LLM / 工具 / embedding / 检索的耗时与 token 用量（metrics_callback + pipeline_metrics）
+7. 同一轮的多个工具调用并发执行，带并发上限与按工具超时（tool_executor）
+8. 快速路径：简单的查状态 / 查物流请求不经过 Agent 规划，直接调用工具作答（fast_path_router）
 """
 
 import os
+import sys
+import asyncio
+import contextlib
+import time
+import hashlib
+import importlib.util
 from pathlib import Path
-import re
+from typing import List, Tuple
 from dotenv import load_dotenv
 from langchain.chat_models import init_chat_model
-from langchain_core.tools import tool
+from langchain_core.tools import StructuredTool, ToolException, tool
 from langchain.agents import create_agent
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_community.vectorstores import FAISS
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_core.chat_history import InMemoryChatMessageHistory
 
 load_dotenv()
 
@@ -29,11 +39,110 @@ BASE_DIR = Path(__file__).parent.parent
 DATA_DIR = BASE_DIR / "data"
 VECTOR_STORE_PATH = DATA_DIR / "faiss_index_local"
 
+
+def _load_module(name: str, path: Path):
+    """按文件路径加载同项目中的模块（本文件可能被 api_server / eval 以同样方式加载）"""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+semantic_cache = _load_module("semantic_cache", Path(__file__).parent / "semantic_cache.py")
+faiss_index = _load_module("faiss_index", BASE_DIR / "03" / "faiss_index.py")
+mmap_store = _load_module("mmap_store", BASE_DIR / "03" / "mmap_store.py")
+bm25_index = _load_module("bm25_index", BASE_DIR / "03" / "bm25_index.py")
+# caching_retriever 依赖 bm25_index，需在其后加载
+caching_retriever = _load_module("caching_retriever", Path(__file__).parent / "caching_retriever.py")
+session_store = _load_module("session_store", Path(__file__).parent / "session_store.py")
+history_manager = _load_module("history_manager", Path(__file__).parent / "history_manager.py")
+instrumentation = _load_module("instrumentation", Path(__file__).parent / "instrumentation.py")
+order_store = _load_module("order_store", Path(__file__).parent / "order_store.py")
+tool_executor = _load_module("tool_executor", Path(__file__).parent / "tool_executor.py")
+# fast_path_router 依赖 history_manager 的订单号规则，需在其后加载
+fast_path_router = _load_module("fast_path_router", Path(__file__).parent / "fast_path_router.py")
+# retrieval_prefetch 依赖 caching_retriever 的问题归一化
+retrieval_prefetch = _load_module("retrieval_prefetch", Path(__file__).parent / "retrieval_prefetch.py")
+
+# 语义答案缓存配置（余弦距离阈值、TTL 秒数、条数与内存上限）
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "1") == "1"
+SEMANTIC_CACHE_MAX_DISTANCE = float(os.getenv("SEMANTIC_CACHE_MAX_DISTANCE", "0.08"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1024"))
+SEMANTIC_CACHE_MAX_MB = float(os.getenv("SEMANTIC_CACHE_MAX_MB", "32"))
+# 检索器缓存条数（问题向量、top-k 文档 id 各自独立计数）
+RETRIEVER_CACHE_MAX_ENTRIES = int(os.getenv("RETRIEVER_CACHE_MAX_ENTRIES", "4096"))
+# ANN 索引的查询参数（仅对 IVF / HNSW 索引生效）
+SEARCH_NPROBE = int(os.getenv("SEARCH_NPROBE", "16"))
+SEARCH_EF_SEARCH = int(os.getenv("SEARCH_EF_SEARCH", "64"))
+# 检索模式：hybrid（向量库目录中有 BM25 索引时启用混合检索）或 dense（仅向量检索）
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+# BM25 稀疏快速路径：归一化置信度下限、第一名相对第二名的分数倍数
+BM25_FAST_PATH_CONFIDENCE = float(os.getenv("BM25_FAST_PATH_CONFIDENCE", "0.6"))
+BM25_FAST_PATH_MARGIN = float(os.getenv("BM25_FAST_PATH_MARGIN", "1.5"))
+# 会话存储：memory（进程内 LRU/TTL）或 sqlite（WAL，多 worker 共享）
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")
+SESSION_DB_PATH = Path(os.getenv("SESSION_DB_PATH", str(DATA_DIR / "sessions.db")))
+SESSION_TTL = float(os.getenv("SESSION_TTL", "86400"))
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+SESSION_MAX_MB = float(os.getenv("SESSION_MAX_MB", "64"))
+# 对话历史 token 预算：预算内的近期消息原样保留，更早的消息折叠进滚动摘要
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "2000"))
+HISTORY_MIN_RECENT_MESSAGES = int(os.getenv("HISTORY_MIN_RECENT_MESSAGES", "2"))
+# 每个会话保存的消息条数兜底上限（正常由 token 预算与摘要控制长度）
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "200"))
+# 是否提供批量订单 / 物流查询工具（关闭后可在评估中对比 LLM 轮数）
+BATCH_TOOLS_ENABLED = os.getenv("BATCH_TOOLS_ENABLED", "1") == "1"
+# 工具并发执行：线程池大小、默认超时（秒）、按工具覆盖的超时（如 "faq_rag_tool=20,query_order_status=5"）
+TOOL_MAX_WORKERS = int(os.getenv("TOOL_MAX_WORKERS", "16"))
+TOOL_TIMEOUT = float(os.getenv("TOOL_TIMEOUT", "30"))
+TOOL_TIMEOUTS = tool_executor.parse_timeouts(os.getenv("TOOL_TIMEOUTS", ""))
+# 快速路径：规则识别的查状态 / 查物流请求直接调用工具；回答用模板（template）或一次轻量 LLM 调用（llm）组织
+FAST_PATH_ENABLED = os.getenv("FAST_PATH_ENABLED", "1") == "1"
+FAST_PATH_RENDER = os.getenv("FAST_PATH_RENDER", "template")
+# FAQ 工具模式：answer（工具内调用 LLM 生成答案）或 context（直接返回带来源编号的文档片段，由 Agent 作答，少一次 LLM 调用）
+FAQ_RAG_MODE = os.getenv("FAQ_RAG_MODE", "answer")
+# context 模式下每个文档片段保留的最大字符数
+FAQ_CONTEXT_MAX_CHARS = int(os.getenv("FAQ_CONTEXT_MAX_CHARS", "500"))
+# FAQ 相关度阈值：最相关片段的余弦相似度低于该值时直接返回固定回复，不调用模型（0 表示关闭；
+# 取值与 embedding 模型有关，用 project/eval/calibrate_faq_threshold.py 在标注问题集上标定）
+FAQ_MIN_RELEVANCE = float(os.getenv("FAQ_MIN_RELEVANCE", "0"))
+FAQ_NO_INFO_REPLY = os.getenv(
+    "FAQ_NO_INFO_REPLY",
+    "FAQ 文档中没有找到与该问题相关的信息。如需进一步帮助，请联系人工客服。",
+)
+# 推测式 FAQ 检索预取（06 API）：线程数、复用预取结果的字符 bigram 双向覆盖率下限
+FAQ_PREFETCH_ENABLED = os.getenv("FAQ_PREFETCH_ENABLED", "1") == "1"
+FAQ_PREFETCH_WORKERS = int(os.getenv("FAQ_PREFETCH_WORKERS", "2"))
+FAQ_PREFETCH_MIN_OVERLAP = float(os.getenv("FAQ_PREFETCH_MIN_OVERLAP", "0.6"))
+# 订单与物流数据库（不存在时自动创建并写入种子数据）
+ORDER_DB_PATH = Path(os.getenv("ORDER_DB_PATH", str(DATA_DIR / "orders.db")))
+
 # 全局变量，用于缓存模型和检索器
 _model = None
+_embeddings = None
 _retriever = None
-_session_histories = {}
-_MAX_MESSAGES = 12
+_retriever_version = None
+_answer_cache = None
+# 问题向量缓存跨索引版本复用；检索结果缓存的 key 中带有索引版本
+_query_embedding_cache = caching_retriever.LRUStore(RETRIEVER_CACHE_MAX_ENTRIES)
+_retrieval_result_cache = caching_retriever.LRUStore(RETRIEVER_CACHE_MAX_ENTRIES)
+# 各检索路径（cached / dense / hybrid / sparse_fast_path）的累计次数
+_retrieval_path_counts = {}
+# FAQ 相关度阈值的提前返回次数
+_faq_relevance_counts = {"below_threshold": 0}
+# 流水线埋点：api_server 注册 hook 后输出为指标；调用 agent 时在 config 中传入 metrics_callback
+pipeline_metrics = instrumentation.PipelineInstrumentation()
+metrics_callback = instrumentation.MetricsCallbackHandler(pipeline_metrics)
+_session_store = None
+_history = None
+_order_store = None
+_tool_executor = None
+_fast_path_router = None
+_faq_prefetcher = None
 
 
 def init_model():
@@ -58,34 +167,336 @@ def init_embeddings():
     )
 
 
-def get_session_history(session_id: str) -> InMemoryChatMessageHistory:
-    history = _session_histories.get(session_id)
-    if history is None:
-        history = InMemoryChatMessageHistory()
-        _session_histories[session_id] = history
-    if len(history.messages) > _MAX_MESSAGES:
-        history.messages = history.messages[-_MAX_MESSAGES:]
-    return history
+def get_embeddings():
+    """获取全局复用的 Embedding 模型（检索与语义缓存共用同一实例）"""
+    global _embeddings
+    if _embeddings is None:
+        _embeddings = init_embeddings()
+    return _embeddings
+
+
+def get_index_version() -> str:
+    """根据向量库目录下各文件的修改时间与大小生成版本号，索引重建后版本随之变化"""
+    if not VECTOR_STORE_PATH.exists():
+        return ""
+    parts = []
+    for p in sorted(VECTOR_STORE_PATH.iterdir()):
+        if p.is_file():
+            st = p.stat()
+            parts.append(f"{p.name}:{st.st_mtime_ns}:{st.st_size}")
+    return hashlib.md5("|".join(parts).encode("utf-8")).hexdigest()[:12]
+
+
+def get_answer_cache():
+    """获取 faq_rag_tool 的语义答案缓存"""
+    global _answer_cache
+    if _answer_cache is None:
+        _answer_cache = semantic_cache.SemanticAnswerCache(
+            max_distance=SEMANTIC_CACHE_MAX_DISTANCE,
+            max_entries=SEMANTIC_CACHE_MAX_ENTRIES,
+            ttl_seconds=SEMANTIC_CACHE_TTL,
+            max_bytes=int(SEMANTIC_CACHE_MAX_MB * 1024 * 1024),
+        )
+    return _answer_cache
+
+
+def get_session_store():
+    """获取全局会话存储（api_server 与 get_session_history 共用）"""
+    global _session_store
+    if _session_store is None:
+        _session_store = session_store.create_session_store(
+            SESSION_STORE,
+            SESSION_DB_PATH,
+            max_sessions=SESSION_MAX_SESSIONS,
+            ttl_seconds=SESSION_TTL,
+            max_bytes=int(SESSION_MAX_MB * 1024 * 1024),
+        )
+    return _session_store
+
+
+def get_order_store():
+    """获取订单与物流数据访问层（进程内只打开一次）"""
+    global _order_store
+    if _order_store is None:
+        _order_store = order_store.OrderStore(ORDER_DB_PATH)
+    return _order_store
+
+
+def get_tool_executor():
+    """获取工具调用执行器（同一轮的多个工具调用并发执行，带超时）"""
+    global _tool_executor
+    if _tool_executor is None:
+        _tool_executor = tool_executor.ToolCallExecutor(TOOL_MAX_WORKERS, TOOL_TIMEOUT, TOOL_TIMEOUTS)
+    return _tool_executor
+
+
+def get_faq_prefetcher():
+    """获取推测式 FAQ 检索预取器"""
+    global _faq_prefetcher
+    if _faq_prefetcher is None:
+        _faq_prefetcher = retrieval_prefetch.RetrievalPrefetcher(
+            _faq_prefetch_embed,
+            _faq_prefetch_search,
+            max_workers=FAQ_PREFETCH_WORKERS,
+            min_overlap=FAQ_PREFETCH_MIN_OVERLAP,
+        )
+    return _faq_prefetcher
+
+
+_SUMMARY_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """你负责为客服对话维护一份滚动摘要。请把"已有摘要"和"新增对话"合并成一份新的摘要。
+要求：
+1. 保留用户昵称、语气与简洁程度等偏好
+2. 保留所有提到的订单号、快递单号及其查询结果要点，并注明最近一次提到的订单号
+3. 保留用户尚未解决的问题和已承诺的后续动作
+4. 不超过 200 字，只输出摘要本身"""),
+    ("user", "已有摘要：\n{summary}\n\n新增对话：\n{dialog}")
+])
+
+
+def _summary_messages(previous: str, messages):
+    dialog = "\n".join(
+        f"{'用户' if m['role'] == 'user' else '客服'}：{m['content']}" for m in messages
+    )
+    return _SUMMARY_PROMPT.invoke({"summary": previous or "（无）", "dialog": dialog})
+
+
+def summarize_history(previous: str, messages) -> str:
+    return init_model().invoke(_summary_messages(previous, messages)).content
+
+
+async def asummarize_history(previous: str, messages) -> str:
+    return (await init_model().ainvoke(_summary_messages(previous, messages))).content
+
+
+def get_history():
+    """获取 token 预算历史管理器（CLI 与 api_server 共用）"""
+    global _history
+    if _history is None:
+        _history = history_manager.TokenBudgetHistory(
+            get_session_store(),
+            summarize_history,
+            asummarize_history,
+            token_budget=HISTORY_TOKEN_BUDGET,
+            min_recent_messages=HISTORY_MIN_RECENT_MESSAGES,
+            max_messages=HISTORY_MAX_MESSAGES,
+        )
+    return _history
+
+
+def get_session_history(session_id: str):
+    return session_store.StoreChatMessageHistory(get_session_store(), session_id, HISTORY_MAX_MESSAGES)
 
 
 def get_retriever():
-    """获取或创建检索器"""
-    global _retriever
-    if _retriever is None:
+    """获取或创建检索器（向量库重建后自动重新加载）"""
+    global _retriever, _retriever_version
+    version = get_index_version()
+    if _retriever is None or version != _retriever_version:
         print("正在加载向量库...")
-        embeddings = init_embeddings()
-        vectorstore = FAISS.load_local(
-            str(VECTOR_STORE_PATH),
-            embeddings,
-            allow_dangerous_deserialization=True
+        embeddings = get_embeddings()
+        if mmap_store.is_mmap_store(VECTOR_STORE_PATH):
+            # 内存映射格式：索引与片段按需读取，不反序列化 pickle
+            vectorstore = mmap_store.load_store(VECTOR_STORE_PATH, embeddings)
+        else:
+            vectorstore = FAISS.load_local(
+                str(VECTOR_STORE_PATH),
+                embeddings,
+                allow_dangerous_deserialization=True
+            )
+        faiss_index.set_search_params(vectorstore.index, nprobe=SEARCH_NPROBE, ef_search=SEARCH_EF_SEARCH)
+        bm25 = None
+        if RETRIEVAL_MODE == "hybrid" and bm25_index.has_bm25_index(VECTOR_STORE_PATH):
+            bm25 = bm25_index.BM25Index.load(VECTOR_STORE_PATH)
+        # 创建带缓存的检索器（检索 top-3 相关文档）
+        _retriever = caching_retriever.CachingRetriever(
+            vectorstore,
+            k=3,
+            index_version=version,
+            embedding_cache=_query_embedding_cache,
+            result_cache=_retrieval_result_cache,
+            bm25=bm25,
+            fast_path_confidence=BM25_FAST_PATH_CONFIDENCE,
+            fast_path_margin=BM25_FAST_PATH_MARGIN,
+            stats=_retrieval_path_counts,
+            observe=pipeline_metrics.duration,
         )
-        # 创建检索器（检索 top-3 相关文档）
-        _retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
+        _retriever_version = version
         print("向量库加载成功")
     return _retriever
 
 
-@tool
+def warmup(question: str = "如何申请退款？"):
+    """预热本地资源：加载 embedding 模型与向量库，执行一次编码和检索
+
+    直接调用向量库，不经过检索器缓存，避免预热问题占用缓存条目。
+    Returns:
+        各步骤耗时（秒）
+    """
+    timings = {}
+    t0 = time.perf_counter()
+    retriever = get_retriever()
+    timings["load_retriever"] = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    vector = get_embeddings().embed_query(question)
+    timings["embed"] = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    retriever.vectorstore.similarity_search_by_vector(vector, k=retriever.k)
+    if retriever.bm25 is not None:
+        retriever.bm25.search(question, retriever.fetch_k)
+    timings["search"] = time.perf_counter() - t0
+    return timings
+
+
+def get_retriever_cache_stats():
+    """检索器缓存统计（问题向量缓存与检索结果缓存）"""
+    return {
+        "embedding_hits_total": _query_embedding_cache.hits,
+        "embedding_misses_total": _query_embedding_cache.misses,
+        "embedding_entries": len(_query_embedding_cache),
+        "result_hits_total": _retrieval_result_cache.hits,
+        "result_misses_total": _retrieval_result_cache.misses,
+        "result_entries": len(_retrieval_result_cache),
+    }
+
+
+def get_faq_relevance_stats():
+    """FAQ 相关度阈值：低于阈值、未调用模型直接返回固定回复的次数"""
+    return {
+        "below_threshold_total": _faq_relevance_counts["below_threshold"],
+        "min_relevance": FAQ_MIN_RELEVANCE,
+    }
+
+
+def get_retrieval_path_stats():
+    """各检索路径的累计次数（结果缓存命中 / 仅向量 / 混合 / BM25 快速路径）"""
+    return {f"{path}_total": _retrieval_path_counts.get(path, 0)
+            for path in ("cached", "dense", "hybrid", "sparse_fast_path")}
+
+
+_FAQ_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """你是一个智能客服助手，基于提供的 FAQ 文档内容回答用户问题。
+要求：
+1. 只基于提供的文档内容回答，不要编造信息
+2. 如果文档中没有相关信息，诚实告知用户
+3. 回答要简洁、准确、友好
+4. 如果文档中有多个相关答案，可以综合回答
+
+FAQ 文档内容：
+{context}
+
+请基于以上文档内容回答用户问题。"""),
+    ("user", "{question}")
+])
+
+
+def format_faq_context(docs, max_chars: int = FAQ_CONTEXT_MAX_CHARS) -> str:
+    """context 模式的工具输出：每个片段一段，带来源编号 [S1]、[S2]…，内容重复的片段只保留一次"""
+    blocks = []
+    seen = set()
+    for doc in docs:
+        text = " ".join(doc.page_content.split())
+        if not text or text in seen:
+            continue
+        seen.add(text)
+        if len(text) > max_chars:
+            text = text[:max_chars] + "…"
+        source = doc.metadata.get("source", "FAQ")
+        blocks.append(f"[S{len(blocks) + 1}] 来源：{source}\n{text}")
+    return "\n\n".join(blocks) if blocks else "知识库中没有找到相关内容。"
+
+
+def _faq_retrieve(question: str):
+    """FAQ 问答的检索阶段（本地 CPU 计算：向量化、语义缓存、检索）
+
+    Returns:
+        (工具输出, None, None, None) 或 (None, prompt 消息, 检索器, 问题向量)；
+        工具输出为缓存答案（answer 模式）、格式化后的文档片段（context 模式），
+        或最相关片段的相似度低于 FAQ_MIN_RELEVANCE 时的固定回复
+    """
+    retriever = get_retriever()
+    
+    # 先做 BM25 检索：关键词命中足够明确时走稀疏快速路径，检索不需要问题向量，
+    # 语义答案缓存按归一化后的问题精确查找，全程不调用 embedding 模型
+    sparse = retriever.bm25_search(question)
+    if retriever.sparse_fast_path(sparse):
+        if _faq_uses_vector():
+            cached = get_answer_cache().lookup_text(caching_retriever.normalize_query(question), retriever.index_version)
+            if cached is not None:
+                return cached, None, None, None
+        return _faq_answer_or_context(question, retriever.invoke_with_score(question, sparse=sparse), retriever, None)
+    
+    # 语义缓存需要问题本身的向量（带缓存），检索时复用；不使用预取的原始消息向量，
+    # 否则会用整条消息的向量查找、写入工具问题的答案
+    # context 模式不生成答案，语义答案缓存不适用（检索结果由检索器自身的结果缓存负责）
+    vector = None
+    if _faq_uses_vector():
+        vector = retriever.embed_query(question)
+        cached = get_answer_cache().lookup(vector, retriever.index_version)
+        if cached is not None:
+            return cached, None, None, None
+    
+    # 本次请求已用原始消息推测式预取过、且与问题双向相近时，复用预取的检索结果
+    prefetched = None
+    if FAQ_PREFETCH_ENABLED:
+        prefetched = get_faq_prefetcher().take(question, retriever.index_version)
+    if prefetched is not None:
+        get_faq_prefetcher().credit(prefetched, query_embedded=vector is not None)
+        result = prefetched.result
+    else:
+        result = retriever.invoke_with_score(question, vector=vector, sparse=sparse)
+    return _faq_answer_or_context(question, result, retriever, vector)
+
+
+def _faq_answer_or_context(question: str, result, retriever, vector):
+    """根据检索结果 (文档列表, 相似度) 生成 _faq_retrieve 的返回值"""
+    docs, score = result
+    # 知识库中没有足够相关的内容：直接返回固定回复，不调用模型（BM25 快速路径的 score 为 None，视为相关）
+    if score is not None and score < FAQ_MIN_RELEVANCE:
+        _faq_relevance_counts["below_threshold"] += 1
+        return FAQ_NO_INFO_REPLY, None, None, None
+    if FAQ_RAG_MODE == "context":
+        return format_faq_context(docs), None, None, None
+    
+    # 将文档内容拼接成上下文
+    context = "\n\n".join([doc.page_content for doc in docs])
+    messages = _FAQ_PROMPT.invoke({
+        "context": context,
+        "question": question
+    })
+    return None, messages, retriever, vector
+
+
+def _faq_uses_vector() -> bool:
+    return SEMANTIC_CACHE_ENABLED and FAQ_RAG_MODE == "answer"
+
+
+def _faq_prefetch_embed(message: str):
+    """预取的编码阶段，返回 (索引版本, 原始消息向量)；单独计时，工具自行编码了问题时只按检索阶段计算节省"""
+    retriever = get_retriever()
+    return retriever.index_version, retriever.embed_query(message)
+
+
+def _faq_prefetch_search(message: str, vector):
+    """预取的检索阶段，返回 (文档列表, 相似度)"""
+    return get_retriever().invoke_with_score(message, vector=vector)
+
+
+def faq_prefetch(message: str):
+    """推测式 FAQ 检索（上下文管理器，供 06 API 包住 agent 调用）：与 Agent 的第一次 LLM 调用并行检索原始消息"""
+    if not FAQ_PREFETCH_ENABLED:
+        return contextlib.nullcontext()
+    return get_faq_prefetcher().speculate(message)
+
+
+def _faq_store(question: str, answer: str, retriever, vector) -> None:
+    """写入语义答案缓存；同时以归一化问题为文本键，稀疏快速路径（vector 为 None）只能按文本键命中"""
+    if SEMANTIC_CACHE_ENABLED:
+        get_answer_cache().store(
+            question, vector, answer, retriever.index_version, text=caching_retriever.normalize_query(question)
+        )
+
+
 def faq_rag_tool(question: str) -> str:
     """
     基于 FAQ 知识库回答用户问题。适用于：
@@ -103,43 +514,47 @@ def faq_rag_tool(question: str) -> str:
         基于 FAQ 文档的回答
     """
     try:
-        # 获取检索器和模型
-        retriever = get_retriever()
-        model = init_model()
-        
-        # 检索相关文档
-        docs = retriever.invoke(question)
-        
-        # 将文档内容拼接成上下文
-        context = "\n\n".join([doc.page_content for doc in docs])
+        cached, messages, retriever, vector = _faq_retrieve(question)
+        if cached is not None:
+            return cached
+        response = init_model().invoke(messages)
+        _faq_store(question, response.content, retriever, vector)
+        return response.content
         
-        # 创建 prompt
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", """你是一个智能客服助手，基于提供的 FAQ 文档内容回答用户问题。
-要求：
-1. 只基于提供的文档内容回答，不要编造信息
-2. 如果文档中没有相关信息，诚实告知用户
-3. 回答要简洁、准确、友好
-4. 如果文档中有多个相关答案，可以综合回答
+    except Exception as e:
+        # ToolException 由 handle_tool_error 转成返回给模型的文本，工具调用记为失败
+        raise ToolException(f"查询 FAQ 时发生错误：{str(e)}")
 
-FAQ 文档内容：
-{context}
 
-请基于以上文档内容回答用户问题。"""),
-            ("user", "{question}")
-        ])
-        
-        # 格式化 prompt 并调用模型
-        messages = prompt.invoke({
-            "context": context,
-            "question": question
-        })
-        
-        response = model.invoke(messages)
+async def _afaq_rag_tool(question: str) -> str:
+    """faq_rag_tool 的异步实现：检索放到线程中执行，模型调用使用 ainvoke，不占用线程等待上游"""
+    try:
+        cached, messages, retriever, vector = await asyncio.to_thread(_faq_retrieve, question)
+        if cached is not None:
+            return cached
+        response = await init_model().ainvoke(messages)
+        _faq_store(question, response.content, retriever, vector)
         return response.content
         
     except Exception as e:
-        return f"查询 FAQ 时发生错误：{str(e)}"
+        raise ToolException(f"查询 FAQ 时发生错误：{str(e)}")
+
+
+_FAQ_CONTEXT_DESCRIPTION = """检索 FAQ 知识库，返回与问题相关的文档片段（带来源编号 [S1]、[S2]…）。适用于：
+退款退货、订单流程、物流配送、支付、账户与会员、售后服务等常见问题。
+请只依据返回的片段回答用户，片段中没有的信息要如实告知，不要编造。
+
+Args:
+    question: 用户的问题"""
+
+
+# 同时提供同步与异步实现：agent.invoke 走同步版本，agent.ainvoke 走异步版本
+faq_rag_tool = StructuredTool.from_function(
+    faq_rag_tool,
+    coroutine=_afaq_rag_tool,
+    description=_FAQ_CONTEXT_DESCRIPTION if FAQ_RAG_MODE == "context" else None,
+    handle_tool_error=True,
+)
 
 
 @tool
@@ -153,42 +568,9 @@ def query_order_status(order_id: str) -> str:
     Returns:
         订单状态的详细信息
     """
-    # Mock 数据：模拟不同订单号返回不同状态
-    mock_orders = {
-        "123456": {
-            "status": "已发货",
-            "order_time": "2024-01-15 10:30:00",
-            "total_amount": "299.00",
-            "items": ["商品A x1", "商品B x2"]
-        },
-        "123457": {
-            "status": "待发货",
-            "order_time": "2024-01-20 14:20:00",
-            "total_amount": "599.00",
-            "items": ["商品C x1"]
-        },
-        "123458": {
-            "status": "已完成",
-            "order_time": "2024-01-10 09:15:00",
-            "total_amount": "199.00",
-            "items": ["商品D x1"]
-        }
-    }
-    
-    # 规范化订单号
-    oid_raw = order_id or ""
-    oid_digits = re.sub(r"\D", "", oid_raw)
-    resolved_id = None
-    if oid_digits in mock_orders:
-        resolved_id = oid_digits
-    else:
-        for k in mock_orders.keys():
-            if k in oid_raw:
-                resolved_id = k
-                break
+    order = get_order_store().get_order(order_id)
     # 返回对应信息或默认
-    if resolved_id in mock_orders:
-        order = mock_orders[resolved_id]
+    if order is not None:
         return f"""订单号：{order_id}
 订单状态：{order['status']}
 下单时间：{order['order_time']}
@@ -214,68 +596,10 @@ def query_shipping_info(order_id: str) -> str:
     Returns:
         物流信息的详细信息，包括快递公司、快递单号、物流轨迹等
     """
-    # Mock 数据：模拟不同订单号的物流信息
-    mock_shipping = {
-        "123456": {
-            "carrier": "顺丰快递",
-            "tracking_number": "SF1234567890123",
-            "status": "运输中",
-            "current_location": "北京分拨中心",
-            "estimated_delivery": "2024-01-22",
-            "tracking": [
-                {"time": "2024-01-18 10:00", "location": "商家已发货", "status": "已揽收"},
-                {"time": "2024-01-18 15:30", "location": "北京分拨中心", "status": "运输中"},
-            ]
-        },
-        "123457": {
-            "carrier": "中通快递",
-            "tracking_number": "ZTO9876543210987",
-            "status": "待发货",
-            "current_location": "商家仓库",
-            "estimated_delivery": "预计 1-3 个工作日发货",
-            "tracking": [
-                {"time": "2024-01-20 14:20", "location": "订单已确认", "status": "待发货"},
-            ]
-        },
-        "123458": {
-            "carrier": "圆通快递",
-            "tracking_number": "YTO4567890123456",
-            "status": "已签收",
-            "current_location": "已送达",
-            "estimated_delivery": "2024-01-12（已送达）",
-            "tracking": [
-                {"time": "2024-01-10 09:15", "location": "商家已发货", "status": "已揽收"},
-                {"time": "2024-01-11 12:00", "location": "上海分拨中心", "status": "运输中"},
-                {"time": "2024-01-12 14:30", "location": "上海XX区", "status": "派送中"},
-                {"time": "2024-01-12 16:00", "location": "已签收", "status": "已签收"},
-            ]
-        }
-    }
-    
-    # 规范化订单号或快递单号，尽可能解析到订单号
-    oid_raw = order_id or ""
-    oid_digits = re.sub(r"\D", "", oid_raw)
-    resolved_id = None
-    if oid_digits in mock_shipping:
-        resolved_id = oid_digits
-    else:
-        for k in mock_shipping.keys():
-            if k in oid_raw:
-                resolved_id = k
-                break
-        if resolved_id is None:
-            for k, v in mock_shipping.items():
-                tn = v.get("tracking_number", "")
-                tn_digits = re.sub(r"\D", "", tn)
-                if oid_raw and oid_raw in tn:
-                    resolved_id = k
-                    break
-                if oid_digits and oid_digits == tn_digits:
-                    resolved_id = k
-                    break
+    # 按订单号或快递单号（完整单号或尾号）查询
+    shipping = get_order_store().get_shipment(order_id)
     # 返回对应信息或默认
-    if resolved_id in mock_shipping:
-        shipping = mock_shipping[resolved_id]
+    if shipping is not None:
         result = f"""订单号：{order_id}
 快递公司：{shipping['carrier']}
 快递单号：{shipping['tracking_number']}
@@ -294,17 +618,190 @@ def query_shipping_info(order_id: str) -> str:
 提示：如果订单尚未发货或订单号不正确，将无法查询到物流信息。请确认订单号是否正确，或联系客服咨询。"""
 
 
+# 批量查询工具单次最多处理的单号数
+_MAX_BATCH_LOOKUPS = 50
+
+
+def _split_batch(order_ids: List[str]) -> Tuple[List[str], List[str]]:
+    ids = list(dict.fromkeys(i.strip() for i in order_ids if i and i.strip()))
+    return ids[:_MAX_BATCH_LOOKUPS], ids[_MAX_BATCH_LOOKUPS:]
+
+
+@tool
+def query_orders_batch(order_ids: List[str]) -> str:
+    """
+    批量查询订单状态。用户一次提到多个订单号时使用，一次调用返回全部订单的状态。
+    
+    Args:
+        order_ids: 订单号列表（例如：["123456", "123457"]）
+        
+    Returns:
+        每个订单一行：状态、下单时间、金额、商品
+    """
+    ids, skipped = _split_batch(order_ids)
+    lines = []
+    for oid, order in get_order_store().get_orders(ids).items():
+        if order is None:
+            lines.append(f"{oid}：未找到该订单，请核对订单号")
+        else:
+            lines.append(f"{oid}：{order['status']} | 下单 {order['order_time']} | ¥{order['total_amount']} | "
+                         f"{', '.join(order['items'])}")
+    if skipped:
+        lines.append(f"另有 {len(skipped)} 个单号超出单次查询上限，未查询：{', '.join(skipped)}")
+    return "\n".join(lines) or "未提供订单号"
+
+
+@tool
+def query_shipping_batch(order_ids: List[str]) -> str:
+    """
+    批量查询物流信息。用户一次提到多个订单号或快递单号时使用，一次调用返回全部物流状态。
+    
+    Args:
+        order_ids: 订单号或快递单号列表（例如：["123456", "SF1234567890123"]）
+        
+    Returns:
+        每个单号一行：快递公司与单号、物流状态、当前位置、预计送达、最新轨迹
+    """
+    ids, skipped = _split_batch(order_ids)
+    lines = []
+    for oid, shipping in get_order_store().get_shipments(ids).items():
+        if shipping is None:
+            lines.append(f"{oid}：暂无物流信息（订单可能尚未发货或单号不正确）")
+            continue
+        line = (f"{oid}：订单 {shipping['order_id']} | {shipping['carrier']} {shipping['tracking_number']} | "
+                f"{shipping['status']} | {shipping['current_location']} | 预计送达 {shipping['estimated_delivery']}")
+        if shipping["tracking"]:
+            last = shipping["tracking"][-1]
+            line += f" | 最新：{last['time']} {last['location']} ({last['status']})"
+        lines.append(line)
+    if skipped:
+        lines.append(f"另有 {len(skipped)} 个单号超出单次查询上限，未查询：{', '.join(skipped)}")
+    return "\n".join(lines) or "未提供订单号"
+
+
+def get_fast_path_router():
+    """获取快速路径路由器（单号需能在订单库中查到）"""
+    global _fast_path_router
+    if _fast_path_router is None:
+        def exists(ids):
+            store = get_order_store()
+            shipments = [i for i in ids if not i.isdigit()]
+            return (all(store.get_orders([i for i in ids if i.isdigit()]).values())
+                    and all(store.get_shipments(shipments).values()))
+        _fast_path_router = fast_path_router.FastPathRouter(exists)
+    return _fast_path_router
+
+
+_FAST_PATH_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """你是一个专业的智能客服助手。请根据下面的查询结果，简洁、友好地回答用户的问题。
+只使用查询结果中的信息，不要编造。
+
+查询结果：
+{result}"""),
+    ("user", "{question}")
+])
+_FAST_PATH_LABELS = {"order_status": "订单信息", "shipping": "物流信息", "status_and_shipping": "订单与物流信息"}
+
+
+def _fast_path_calls(route):
+    """快速路径要执行的 (工具, 参数)：一个单号用单订单工具，多个单号用批量工具"""
+    single = len(route.order_ids) == 1
+    calls = []
+    if route.intent in ("order_status", "status_and_shipping"):
+        calls.append((query_order_status, {"order_id": route.order_ids[0]}) if single
+                     else (query_orders_batch, {"order_ids": route.order_ids}))
+    if route.intent in ("shipping", "status_and_shipping"):
+        calls.append((query_shipping_info, {"order_id": route.order_ids[0]}) if single
+                     else (query_shipping_batch, {"order_ids": route.order_ids}))
+    return calls
+
+
+def _fast_path_template(route, results) -> str:
+    body = "\n\n".join(output for _, output in results)
+    return f"我查询了您的{_FAST_PATH_LABELS[route.intent]}：\n\n{body}\n\n如需进一步帮助，请随时告诉我。"
+
+
+def fast_path_answer(message: str, config=None):
+    """快速路径作答：未命中（或执行出错）返回 None，命中返回 (回答, [(工具名, 工具输出)])"""
+    if not FAST_PATH_ENABLED:
+        return None
+    router = get_fast_path_router()
+    route = router.classify(message)
+    if route is None:
+        return None
+    t0 = time.perf_counter()
+    try:
+        results = [(t.name, t.invoke(args, config)) for t, args in _fast_path_calls(route)]
+        if FAST_PATH_RENDER == "llm":
+            result = "\n\n".join(output for _, output in results)
+            answer = init_model().invoke(_FAST_PATH_PROMPT.invoke({"result": result, "question": message}), config).content
+        else:
+            answer = _fast_path_template(route, results)
+    except Exception:
+        router.record(route, 0.0, ok=False)
+        return None
+    router.record(route, time.perf_counter() - t0)
+    return answer, results
+
+
+async def afast_path_answer(message: str, config=None, limiter=None):
+    """fast_path_answer 的异步版本（供 06 API 使用）
+
+    limiter：异步上下文管理器（如 06 的 chat_limiter），FAST_PATH_RENDER=llm 时只包住渲染用的模型调用，
+    与 Agent 共用模型并发名额；工具查询与模板渲染不占名额。进入 limiter 时的异常（如排队超时）直接抛给调用方。
+    """
+    if not FAST_PATH_ENABLED:
+        return None
+    router = get_fast_path_router()
+    # 规则匹配与订单库查询都是本地的毫秒级操作，放到线程中执行，不阻塞事件循环
+    route = await asyncio.to_thread(router.classify, message)
+    if route is None:
+        return None
+    t0 = time.perf_counter()
+    try:
+        results = [(t.name, await t.ainvoke(args, config)) for t, args in _fast_path_calls(route)]
+        if FAST_PATH_RENDER != "llm":
+            answer = _fast_path_template(route, results)
+    except Exception:
+        router.record(route, 0.0, ok=False)
+        return None
+    if FAST_PATH_RENDER == "llm":
+        result = "\n\n".join(output for _, output in results)
+        prompt = _FAST_PATH_PROMPT.invoke({"result": result, "question": message})
+        async with limiter or contextlib.nullcontext():
+            try:
+                answer = (await init_model().ainvoke(prompt, config)).content
+            except Exception:
+                router.record(route, 0.0, ok=False)
+                return None
+    router.record(route, time.perf_counter() - t0)
+    return answer, results
+
+
 def create_customer_service_agent():
     """创建客服 Agent"""
     model = init_model()
     
     # 定义所有工具
     tools = [faq_rag_tool, query_order_status, query_shipping_info]
+    if BATCH_TOOLS_ENABLED:
+        tools += [query_orders_batch, query_shipping_batch]
+    
+    # context 模式下 faq_rag_tool 返回的是文档片段，由 Agent 直接据此作答
+    faq_rules = ""
+    if FAQ_RAG_MODE == "context":
+        faq_rules = """
+FAQ 回答：
+- faq_rag_tool 返回的是知识库原文片段（[S1]、[S2]… 为来源编号），请直接依据片段组织回答，不要编造片段中没有的内容
+- 多个片段相关时综合回答；片段与问题无关或没有片段时，诚实告知用户并建议联系人工客服
+"""
     
     # 创建 Agent
     agent = create_agent(
         model,
         tools=tools,
+        # 同一条 AI 消息中的多个工具调用并发执行（并发上限 + 按工具超时）
+        middleware=[tool_executor.ToolExecutorMiddleware(get_tool_executor())],
         debug=True,  # 开启调试模式，可以看到 Agent 的思考过程
         system_prompt="""你是一个专业的智能客服助手，能够帮助用户解决各种问题。
 
@@ -312,15 +809,18 @@ def create_customer_service_agent():
 1. 回答常见问题（FAQ）：使用 faq_rag_tool 工具查询知识库，回答关于退款、退货、订单、物流、支付、账户等问题
 2. 查询订单状态：使用 query_order_status 工具查询订单的当前状态
 3. 查询物流信息：使用 query_shipping_info 工具查询订单的物流配送情况
+4. 批量查询：使用 query_orders_batch / query_shipping_batch 一次查询多个订单的状态或物流
 
 工作原则：
 - 根据用户问题，智能选择合适的工具或工具组合
 - 如果用户询问常见问题（如"如何申请退款"、"配送范围"等），使用 faq_rag_tool
 - 如果用户询问具体订单的状态，使用 query_order_status（需要从用户输入中提取订单号）
 - 如果用户询问具体订单的物流情况，使用 query_shipping_info（需要从用户输入中提取订单号）
+- 如果用户一次提到多个订单号或快递单号，把它们全部放进一次 query_orders_batch / query_shipping_batch 调用，
+  不要逐个调用单订单工具；同时问状态和物流时，可以在同一轮中并行调用这两个批量工具
 - 回答要友好、专业、准确
 - 在回答中简要说明你使用了什么工具来帮助用户（例如："我查询了您的订单信息..."）
-
+""" + faq_rules + """
 对话记忆：
 - 记住用户昵称与偏好（如语气、简洁程度），在后续回复中保持一致
 - 记住当前会话中最近提到的订单号作为“上下文订单号”
@@ -343,7 +843,8 @@ def main():
     # 创建 Agent
     agent = create_customer_service_agent()
     session_id = "cli"
-    session_messages = []
+    history = get_history()
+    history.store.clear(session_id)
     
     print("\n" + "=" * 60)
     print("系统就绪！我是您的智能客服助手，可以帮您：")
@@ -365,18 +866,20 @@ def main():
             if not user_input:
                 continue
             
-            session_messages.append({"role": "user", "content": user_input})
-            if len(session_messages) > _MAX_MESSAGES:
-                session_messages = session_messages[-_MAX_MESSAGES:]
-            result = agent.invoke({"messages": session_messages})
-            
-            # 获取最后一条消息（AI 的回答）
-            answer = result["messages"][-1].content
+            # 按 token 预算组装历史，较早的对话在后台折叠成摘要
+            session_messages = history.append(session_id, "user", user_input)
+            # 简单的查状态 / 查物流请求走快速路径，不经过 Agent
+            fast = fast_path_answer(user_input, config={"callbacks": [metrics_callback]})
+            if fast is not None:
+                answer = fast[0]
+            else:
+                prompt_messages, _ = history.build(session_id, session_messages)
+                result = agent.invoke({"messages": prompt_messages}, config={"callbacks": [metrics_callback]})
+                # 获取最后一条消息（AI 的回答）
+                answer = result["messages"][-1].content
             print(f"\n🤖 客服：{answer}\n")
             print("-" * 60 + "\n")
-            session_messages.append({"role": "assistant", "content": answer})
-            if len(session_messages) > _MAX_MESSAGES:
-                session_messages = session_messages[-_MAX_MESSAGES:]
+            history.append(session_id, "assistant", answer)
             
         except KeyboardInterrupt:
             print("\n\n感谢使用，再见！")
@@ -0,0 +1,114 @@
+"""
+确定性快速路径：在 Agent 之前用规则识别"查订单状态 / 查物流"这类简单请求，直接调用工具作答
+功能：
+1. 单号提取：订单号用与会话历史相同的规则（6~12 位数字），快递单号为字母前缀 + 10 位以上数字
+2. 意图识别：关键词正则判断查状态 / 查物流（两者都命中则一起查）；含退款、投诉、"怎么"（"怎么样"除外）等
+   需要理解或多步处理的表达，或消息过长时，一律交给 Agent
+3. 单号必须能在订单库中查到才走快速路径，查不到的交给 Agent 引导用户核对
+4. 统计请求数、命中快速路径的次数（按意图）、未命中原因与快速路径耗时
+
+命中时省去 Agent 规划工具调用与组织回答的两次以上 LLM 调用：用模板直接渲染工具结果，
+或（FAST_PATH_RENDER=llm）只做一次不带工具的轻量 LLM 调用来组织语言。
+"""
+
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from history_manager import ORDER_ID_RE
+
+TRACKING_RE = re.compile(r"(?<![0-9A-Za-z])[A-Za-z]{2,4}\d{10,15}(?![0-9])")
+SHIPPING_RE = re.compile(r"物流|快递|到哪|到了吗|到没到|配送|派送|运单|签收|送达|什么时候到|几天到|多久到|发到哪")
+STATUS_RE = re.compile(r"状态|进度|发货了吗|发货没|发了吗|订单情况|查询订单|查一下订单|查下订单|查订单|订单怎么样")
+# 出现这些表达说明不只是查询，需要 Agent 理解与处理（"怎么样"是询问状态，不拦截）
+BLOCK_RE = re.compile(
+    r"退款|退货|换货|取消|投诉|修改|改地址|地址|发票|为什么|怎么(?!样)|如何|能不能|可不可以|可以吗|"
+    r"赔|催|丢|坏|破损|少件|错发|人工|转接|会员|优惠|支付"
+)
+MAX_MESSAGE_CHARS = 80
+
+INTENTS = ("order_status", "shipping", "status_and_shipping")
+
+
+@dataclass
+class Route:
+    intent: str
+    order_ids: List[str] = field(default_factory=list)
+
+
+class FastPathRouter:
+    """规则路由：classify() 返回 Route（走快速路径）或 None（交给 Agent）
+
+    exists(order_ids) -> bool 用于确认单号都能在订单库中查到。
+    """
+
+    def __init__(self, exists, max_chars: int = MAX_MESSAGE_CHARS):
+        self.exists = exists
+        self.max_chars = max_chars
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.routed: Dict[str, int] = {intent: 0 for intent in INTENTS}
+        self.bypassed: Dict[str, int] = {}
+        self.seconds = 0.0
+        self.errors = 0
+
+    @staticmethod
+    def extract_ids(message: str) -> List[str]:
+        tracking = TRACKING_RE.findall(message)
+        rest = TRACKING_RE.sub(" ", message)
+        return list(dict.fromkeys(tracking + ORDER_ID_RE.findall(rest)))
+
+    def classify(self, message: str) -> Optional[Route]:
+        message = (message or "").strip()
+        route, reason = self._classify(message)
+        with self._lock:
+            self.requests += 1
+            if route is None:
+                self.bypassed[reason] = self.bypassed.get(reason, 0) + 1
+        return route
+
+    def _classify(self, message: str):
+        if len(message) > self.max_chars:
+            return None, "too_long"
+        if BLOCK_RE.search(message):
+            return None, "complex"
+        ids = self.extract_ids(message)
+        if not ids:
+            return None, "no_order_id"
+        shipping = bool(SHIPPING_RE.search(message))
+        status = bool(STATUS_RE.search(message))
+        if not shipping and not status:
+            return None, "no_intent"
+        if status and any(TRACKING_RE.fullmatch(i) for i in ids):
+            # 订单状态只能按订单号查询
+            return None, "tracking_number_status"
+        if not self.exists(ids):
+            return None, "unknown_order"
+        intent = "status_and_shipping" if shipping and status else ("shipping" if shipping else "order_status")
+        return Route(intent, ids), ""
+
+    def record(self, route: Route, seconds: float, ok: bool = True) -> None:
+        """记录一次快速路径执行（ok=False 表示执行出错、已回退到 Agent）"""
+        with self._lock:
+            if ok:
+                self.routed[route.intent] += 1
+                self.seconds += seconds
+            else:
+                self.errors += 1
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            served = sum(self.routed.values())
+            stats = {
+                "requests_total": self.requests,
+                "served_total": served,
+                "errors_total": self.errors,
+                "latency_seconds_total": self.seconds,
+                "served_ratio": served / self.requests if self.requests else 0.0,
+            }
+            for intent, n in self.routed.items():
+                stats[f"{intent}_total"] = n
+            for reason, n in self.bypassed.items():
+                stats[f"bypass_{reason}_total"] = n
+            return stats
@@ -0,0 +1,207 @@
+"""
+按 token 预算管理对话历史：近期消息原样保留，较早的消息折叠进滚动摘要
+功能：
+1. 逐条估算消息 token 数（安装了 tiktoken 时精确计数，否则按中文 1 字 1 token、其他约 4 字符 1 token 估算）
+2. 从最新消息往前，在预算内尽量多地原样保留；超出预算的较早消息交给后台任务生成/更新摘要
+3. 摘要在请求路径之外生成（有事件循环时用 ainvoke 任务，否则用后台线程），完成后才从会话中删除已折叠的消息；
+   删除时校验会话开头仍是被折叠的那些消息（及 meta 的 generation），其他 worker 已折叠或消息已被截断时放弃本次结果
+4. "上下文订单号"不依赖 LLM 摘要：折叠时用正则从原始消息中提取并单独保存，每次都写入摘要消息
+5. aappend / abuild 供异步服务使用：会话存储的读写（SQLite 后端可能等待写锁）放到线程中执行，不阻塞事件循环
+"""
+
+import asyncio
+import logging
+import re
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _ENCODING = None
+
+logger = logging.getLogger(__name__)
+
+Message = Dict[str, str]
+# 订单号：6~12 位数字（不属于更长的数字串或快递单号的一部分）
+ORDER_ID_RE = re.compile(r"(?<![0-9A-Za-z])\d{6,12}(?![0-9])")
+_CJK_RE = re.compile(r"[㐀-鿿豈-﫿]")
+# 每条消息的角色、分隔符等固定开销
+_MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def count_tokens(text: str) -> int:
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def message_tokens(msg: Message) -> int:
+    return count_tokens(msg.get("content", "")) + _MESSAGE_OVERHEAD_TOKENS
+
+
+def last_order_id(messages: List[Message], default: str = "") -> str:
+    """按时间顺序取最后出现的订单号"""
+    order_id = default
+    for msg in messages:
+        found = ORDER_ID_RE.findall(msg.get("content", ""))
+        if found:
+            order_id = found[-1]
+    return order_id
+
+
+class TokenBudgetHistory:
+    """基于 SessionStore 的 token 预算历史管理
+
+    summarize(previous_summary, messages) -> str 与 asummarize 为同一摘要逻辑的同步 / 异步版本。
+    """
+
+    def __init__(
+        self,
+        store,
+        summarize: Callable[[str, List[Message]], str],
+        asummarize,
+        token_budget: int = 2000,
+        min_recent_messages: int = 2,
+        max_messages: int = 200,
+    ):
+        self.store = store
+        self.summarize = summarize
+        self.asummarize = asummarize
+        self.token_budget = token_budget
+        self.min_recent_messages = min_recent_messages
+        self.max_messages = max_messages
+        self._lock = threading.Lock()
+        # 正在生成摘要的会话，避免同一会话重复折叠
+        self._pending = set()
+        self._tasks = set()
+        self.summaries = 0
+        self.summary_errors = 0
+        self.folded_messages = 0
+        self.fold_conflicts = 0
+        self.prompt_tokens = 0
+        self.requests = 0
+
+    def append(self, session_id: str, role: str, content: str) -> List[Message]:
+        """写入一条消息（条数上限只作兜底，正常由 token 预算控制长度），返回当前会话消息"""
+        return self.store.append(session_id, [{"role": role, "content": content}], self.max_messages)
+
+    async def aappend(self, session_id: str, role: str, content: str) -> List[Message]:
+        """append 的异步版本"""
+        return await asyncio.to_thread(self.append, session_id, role, content)
+
+    def build(self, session_id: str, messages: Optional[List[Message]] = None) -> Tuple[List[Message], int]:
+        """组装本次请求的历史：摘要消息（如有）+ 预算内的近期消息
+
+        超出预算的较早消息会安排后台折叠；返回 (消息列表, 估算 token 数)。
+        """
+        if messages is None:
+            messages = self.store.get(session_id)
+        return self._build(session_id, messages, self.store.get_meta(session_id))
+
+    async def abuild(self, session_id: str, messages: Optional[List[Message]] = None) -> Tuple[List[Message], int]:
+        """build 的异步版本：存储读取在线程中执行，组装与折叠调度在当前事件循环中进行（折叠使用 asummarize）"""
+        if messages is None:
+            messages = await asyncio.to_thread(self.store.get, session_id)
+        meta = await asyncio.to_thread(self.store.get_meta, session_id)
+        return self._build(session_id, messages, meta)
+
+    def _build(self, session_id: str, messages: List[Message], meta: Dict) -> Tuple[List[Message], int]:
+        summary_msg = self._summary_message(meta, messages)
+        used = message_tokens(summary_msg) if summary_msg else 0
+        keep = 0
+        for msg in reversed(messages):
+            cost = message_tokens(msg)
+            if keep >= self.min_recent_messages and used + cost > self.token_budget:
+                break
+            used += cost
+            keep += 1
+        recent = messages[len(messages) - keep:]
+        overflow = messages[:len(messages) - keep]
+        if overflow:
+            self._schedule_fold(session_id, meta, overflow)
+            if summary_msg is None:
+                # 摘要尚未生成时，至少保留从折叠部分提取的上下文订单号
+                summary_msg = self._summary_message({"order_id": last_order_id(overflow)}, recent)
+                used += message_tokens(summary_msg) if summary_msg else 0
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += used
+        return ([summary_msg] if summary_msg else []) + recent, used
+
+    def _summary_message(self, meta: Dict, recent: List[Message]) -> Optional[Message]:
+        summary = meta.get("summary", "")
+        order_id = last_order_id(recent, meta.get("order_id", ""))
+        if not summary and not meta.get("order_id"):
+            return None
+        lines = []
+        if summary:
+            lines.append(f"以下是本次会话较早内容的摘要：\n{summary}")
+        if order_id:
+            lines.append(f"上下文订单号：{order_id}")
+        return {"role": "system", "content": "\n".join(lines)}
+
+    def _schedule_fold(self, session_id: str, meta: Dict, overflow: List[Message]) -> None:
+        with self._lock:
+            if session_id in self._pending:
+                return
+            self._pending.add(session_id)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is not None:
+            task = loop.create_task(self._afold(session_id, meta, overflow))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        else:
+            threading.Thread(target=self._fold, args=(session_id, meta, overflow), daemon=True).start()
+
+    def _fold(self, session_id: str, meta: Dict, overflow: List[Message]) -> None:
+        try:
+            summary = self.summarize(meta.get("summary", ""), overflow)
+            self._commit(session_id, meta, overflow, summary)
+        except Exception:
+            self._fail(session_id)
+        finally:
+            self._pending.discard(session_id)
+
+    async def _afold(self, session_id: str, meta: Dict, overflow: List[Message]) -> None:
+        try:
+            summary = await self.asummarize(meta.get("summary", ""), overflow)
+            await asyncio.to_thread(self._commit, session_id, meta, overflow, summary)
+        except Exception:
+            self._fail(session_id)
+        finally:
+            self._pending.discard(session_id)
+
+    def _commit(self, session_id: str, meta: Dict, overflow: List[Message], summary: str) -> None:
+        new_meta = dict(meta, summary=summary, order_id=last_order_id(overflow, meta.get("order_id", "")))
+        if not self.store.compact(session_id, overflow, meta.get("generation", 0), new_meta):
+            # 会话开头已变化（其他 worker 已折叠这段消息，或超出条数上限被截断），摘要作废，下次请求重新折叠
+            with self._lock:
+                self.fold_conflicts += 1
+            return
+        with self._lock:
+            self.summaries += 1
+            self.folded_messages += len(overflow)
+
+    def _fail(self, session_id: str) -> None:
+        # 摘要失败时保留原消息，下次请求再尝试
+        logger.exception("会话 %s 生成摘要失败", session_id)
+        with self._lock:
+            self.summary_errors += 1
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "summaries_total": self.summaries,
+                "summary_errors_total": self.summary_errors,
+                "folded_messages_total": self.folded_messages,
+                "fold_conflicts_total": self.fold_conflicts,
+                "requests_total": self.requests,
+                "prompt_tokens_total": self.prompt_tokens,
+                "pending_summaries": len(self._pending),
+            }
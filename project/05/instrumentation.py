@@ -0,0 +1,127 @@
+"""
+Agent 流水线埋点：LLM 调用、各工具、embedding、向量检索的耗时，LLM token 用量，工具调用次数
+功能：
+1. PipelineInstrumentation：统一的记录入口，转发给注册的 hook（api_server 按 Prometheus / 简易模式各注册一个）
+2. MetricsCallbackHandler：LangChain 回调，记录 LLM 与工具的耗时、token 用量、工具调用结果
+3. embedding 与 FAISS / BM25 检索不产生 LangChain 回调，由检索器通过 duration() 直接上报
+
+阶段（stage）：llm / tool / embedding / vector_search / bm25_search；name 为模型名或工具名。
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+class PipelineInstrumentation:
+    """埋点分发器：没有注册 hook 时（如命令行模式）记录调用为空操作
+
+    hook 需实现 duration(stage, name, seconds)、tokens(model, prompt, completion)、tool_call(tool, status)。
+    """
+
+    def __init__(self):
+        self._hooks = []
+
+    def add_hook(self, hook) -> None:
+        self._hooks.append(hook)
+
+    def duration(self, stage: str, name: str, seconds: float) -> None:
+        for hook in self._hooks:
+            hook.duration(stage, name, seconds)
+
+    def tokens(self, model: str, prompt: int, completion: int) -> None:
+        for hook in self._hooks:
+            hook.tokens(model, prompt, completion)
+
+    def tool_call(self, tool: str, status: str) -> None:
+        for hook in self._hooks:
+            hook.tool_call(tool, status)
+
+    @contextmanager
+    def timed(self, stage: str, name: str = ""):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.duration(stage, name, time.perf_counter() - t0)
+
+
+def _usage(response) -> Tuple[int, int]:
+    """从 LLMResult 中取 (prompt_tokens, completion_tokens)，兼容 usage_metadata 与 llm_output 两种格式"""
+    prompt = completion = 0
+    for generations in response.generations:
+        for gen in generations:
+            usage = getattr(getattr(gen, "message", None), "usage_metadata", None)
+            if usage:
+                prompt += usage.get("input_tokens", 0)
+                completion += usage.get("output_tokens", 0)
+    if not prompt and not completion:
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        prompt = usage.get("prompt_tokens", 0)
+        completion = usage.get("completion_tokens", 0)
+    return prompt, completion
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """记录 LLM 与工具调用的回调（无状态，可在所有请求间共用一个实例）"""
+
+    # 只做内存计数，直接在事件循环中执行，不必丢到线程池
+    run_inline = True
+
+    def __init__(self, metrics: PipelineInstrumentation):
+        self.metrics = metrics
+        self._lock = threading.Lock()
+        # run_id -> (stage, name, 开始时间)
+        self._runs: Dict[UUID, Tuple[str, str, float]] = {}
+
+    def _start(self, run_id: UUID, stage: str, name: str) -> None:
+        with self._lock:
+            self._runs[run_id] = (stage, name, time.perf_counter())
+
+    def _finish(self, run_id: UUID):
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is None:
+            return None
+        stage, name, t0 = run
+        self.metrics.duration(stage, name, time.perf_counter() - t0)
+        return name
+
+    @staticmethod
+    def _model_name(serialized: Dict[str, Any], metadata) -> str:
+        return (metadata or {}).get("ls_model_name") or (serialized or {}).get("name") or "unknown"
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        self._start(run_id, "llm", self._model_name(serialized, metadata))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, metadata=None, **kwargs):
+        self._start(run_id, "llm", self._model_name(serialized, metadata))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        model = self._finish(run_id)
+        if model is not None:
+            prompt, completion = _usage(response)
+            if prompt or completion:
+                self.metrics.tokens(model, prompt, completion)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._start(run_id, "tool", (serialized or {}).get("name") or kwargs.get("name") or "unknown")
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        tool = self._finish(run_id)
+        if tool is not None:
+            # handle_tool_error 处理过的异常以 status="error" 的 ToolMessage 返回
+            status = "error" if getattr(output, "status", "success") == "error" else "success"
+            self.metrics.tool_call(tool, status)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        tool = self._finish(run_id)
+        if tool is not None:
+            self.metrics.tool_call(tool, "error")
@@ -0,0 +1,298 @@
+"""
+订单与物流数据访问层：query_order_status / query_shipping_info 等业务工具的数据来源
+功能：
+1. SQLite 存储订单与物流记录，订单号为主键；物流表对"快递单号的纯数字形式"建索引，
+   另存其倒序形式并建索引，按尾号查询变成前缀范围查询，同样走索引
+2. 首次使用时建库并写入种子数据（原来工具里的 mock 订单），进程内只打开一次，每个线程 / 进程独立连接
+3. 按订单号 / 快递单号解析：先取输入中的数字串按订单号精确查询，再按快递单号（完整或尾号）查询
+4. get_orders / get_shipments 批量查询：多个订单号合成一次 IN 查询（供批量查询工具使用）
+5. generate_synthetic() 生成大规模合成数据（见 bench_order_store.py）
+
+数百万订单时每次查询仍是 B 树索引查找（O(log n)），不再随数据量线性增长。
+"""
+
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+_DIGITS_RE = re.compile(r"\d+")
+# 按尾号查询快递单号时至少需要的位数（太短的尾号会匹配到大量运单）
+MIN_TRACKING_SUFFIX = 6
+
+SEED_ORDERS = [
+    {
+        "order_id": "123456",
+        "status": "已发货",
+        "order_time": "2024-01-15 10:30:00",
+        "total_amount": "299.00",
+        "items": ["商品A x1", "商品B x2"],
+    },
+    {
+        "order_id": "123457",
+        "status": "待发货",
+        "order_time": "2024-01-20 14:20:00",
+        "total_amount": "599.00",
+        "items": ["商品C x1"],
+    },
+    {
+        "order_id": "123458",
+        "status": "已完成",
+        "order_time": "2024-01-10 09:15:00",
+        "total_amount": "199.00",
+        "items": ["商品D x1"],
+    },
+]
+
+SEED_SHIPMENTS = [
+    {
+        "order_id": "123456",
+        "carrier": "顺丰快递",
+        "tracking_number": "SF1234567890123",
+        "status": "运输中",
+        "current_location": "北京分拨中心",
+        "estimated_delivery": "2024-01-22",
+        "tracking": [
+            {"time": "2024-01-18 10:00", "location": "商家已发货", "status": "已揽收"},
+            {"time": "2024-01-18 15:30", "location": "北京分拨中心", "status": "运输中"},
+        ],
+    },
+    {
+        "order_id": "123457",
+        "carrier": "中通快递",
+        "tracking_number": "ZTO9876543210987",
+        "status": "待发货",
+        "current_location": "商家仓库",
+        "estimated_delivery": "预计 1-3 个工作日发货",
+        "tracking": [
+            {"time": "2024-01-20 14:20", "location": "订单已确认", "status": "待发货"},
+        ],
+    },
+    {
+        "order_id": "123458",
+        "carrier": "圆通快递",
+        "tracking_number": "YTO4567890123456",
+        "status": "已签收",
+        "current_location": "已送达",
+        "estimated_delivery": "2024-01-12（已送达）",
+        "tracking": [
+            {"time": "2024-01-10 09:15", "location": "商家已发货", "status": "已揽收"},
+            {"time": "2024-01-11 12:00", "location": "上海分拨中心", "status": "运输中"},
+            {"time": "2024-01-12 14:30", "location": "上海XX区", "status": "派送中"},
+            {"time": "2024-01-12 16:00", "location": "已签收", "status": "已签收"},
+        ],
+    },
+]
+
+_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS orders ("
+    " order_id TEXT PRIMARY KEY,"
+    " status TEXT NOT NULL,"
+    " order_time TEXT NOT NULL,"
+    " total_amount TEXT NOT NULL,"
+    " items TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS shipments ("
+    " order_id TEXT PRIMARY KEY,"
+    " carrier TEXT NOT NULL,"
+    " tracking_number TEXT NOT NULL,"
+    " tracking_digits TEXT NOT NULL,"
+    " tracking_digits_rev TEXT NOT NULL,"
+    " status TEXT NOT NULL,"
+    " current_location TEXT NOT NULL,"
+    " estimated_delivery TEXT NOT NULL,"
+    " tracking TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS idx_shipments_tracking_digits ON shipments(tracking_digits)",
+    "CREATE INDEX IF NOT EXISTS idx_shipments_tracking_digits_rev ON shipments(tracking_digits_rev)",
+]
+
+
+def digits_of(text: str) -> str:
+    return "".join(_DIGITS_RE.findall(text or ""))
+
+
+def candidate_ids(text: str) -> List[str]:
+    """输入中可能的订单号：各段数字串，以及全部数字连起来（如 "12-34-56"）"""
+    runs = _DIGITS_RE.findall(text or "")
+    candidates = list(dict.fromkeys(runs))
+    joined = "".join(runs)
+    if len(runs) > 1 and joined not in candidates:
+        candidates.append(joined)
+    return candidates
+
+
+class OrderStore:
+    """订单 / 物流只读查询（写入只在建库、导入数据时发生）"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        conn = self._conn()
+        for stmt in _SCHEMA:
+            conn.execute(stmt)
+        if conn.execute("SELECT 1 FROM orders LIMIT 1").fetchone() is None:
+            self.add_orders(SEED_ORDERS)
+            self.add_shipments(SEED_SHIPMENTS)
+
+    def _conn(self) -> sqlite3.Connection:
+        # fork 之后不能复用父进程的连接，按进程号区分
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        # 连接为自动提交模式，批量写入放在一个事务里
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def add_orders(self, orders: Iterable[Dict]) -> None:
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO orders(order_id, status, order_time, total_amount, items) VALUES (?, ?, ?, ?, ?)",
+                ((o["order_id"], o["status"], o["order_time"], o["total_amount"],
+                  json.dumps(o["items"], ensure_ascii=False)) for o in orders),
+            )
+
+    def add_shipments(self, shipments: Iterable[Dict]) -> None:
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO shipments(order_id, carrier, tracking_number, tracking_digits, "
+                "tracking_digits_rev, status, current_location, estimated_delivery, tracking) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                ((s["order_id"], s["carrier"], s["tracking_number"], digits_of(s["tracking_number"]),
+                  digits_of(s["tracking_number"])[::-1], s["status"], s["current_location"],
+                  s["estimated_delivery"], json.dumps(s["tracking"], ensure_ascii=False)) for s in shipments),
+            )
+
+    @staticmethod
+    def _order(row) -> Dict:
+        return dict(row, items=json.loads(row["items"]))
+
+    @staticmethod
+    def _shipment(row) -> Dict:
+        shipment = dict(row, tracking=json.loads(row["tracking"]))
+        del shipment["tracking_digits"], shipment["tracking_digits_rev"]
+        return shipment
+
+    def get_order(self, text: str) -> Optional[Dict]:
+        """按输入中的订单号查询订单（输入可以带有其他文字，如 "订单123456"）"""
+        for oid in candidate_ids(text):
+            row = self._conn().execute("SELECT * FROM orders WHERE order_id = ?", (oid,)).fetchone()
+            if row is not None:
+                return self._order(row)
+        return None
+
+    def get_shipment(self, text: str) -> Optional[Dict]:
+        """按订单号或快递单号（完整单号或至少 MIN_TRACKING_SUFFIX 位尾号）查询物流"""
+        conn = self._conn()
+        for oid in candidate_ids(text):
+            row = conn.execute("SELECT * FROM shipments WHERE order_id = ?", (oid,)).fetchone()
+            if row is not None:
+                return self._shipment(row)
+        digits = digits_of(text)
+        if not digits:
+            return None
+        row = conn.execute("SELECT * FROM shipments WHERE tracking_digits = ? LIMIT 1", (digits,)).fetchone()
+        if row is None:
+            row = self._by_tracking_suffix(digits)
+        return self._shipment(row) if row is not None else None
+
+    def _by_tracking_suffix(self, digits: str) -> Optional[sqlite3.Row]:
+        if len(digits) < MIN_TRACKING_SUFFIX:
+            return None
+        # 尾号：倒序后变成前缀，按范围查询走索引；多个运单匹配同一尾号时不猜测
+        rev = digits[::-1]
+        rows = self._conn().execute(
+            "SELECT * FROM shipments WHERE tracking_digits_rev >= ? AND tracking_digits_rev < ? LIMIT 2",
+            (rev, rev + ":"),
+        ).fetchall()
+        return rows[0] if len(rows) == 1 else None
+
+    def _select_in(self, table: str, column: str, values: List[str]) -> List[sqlite3.Row]:
+        values = list(dict.fromkeys(values))
+        if not values:
+            return []
+        placeholders = ",".join("?" * len(values))
+        return self._conn().execute(f"SELECT * FROM {table} WHERE {column} IN ({placeholders})", values).fetchall()
+
+    def get_orders(self, texts: List[str]) -> Dict[str, Optional[Dict]]:
+        """批量查询订单：所有输入的候选订单号合成一次 IN 查询，返回 输入 -> 订单（未找到为 None）"""
+        candidates = {text: candidate_ids(text) for text in texts}
+        rows = self._select_in("orders", "order_id", [oid for ids in candidates.values() for oid in ids])
+        found = {row["order_id"]: self._order(row) for row in rows}
+        return {text: next((found[oid] for oid in ids if oid in found), None) for text, ids in candidates.items()}
+
+    def get_shipments(self, texts: List[str]) -> Dict[str, Optional[Dict]]:
+        """批量查询物流：按订单号、完整快递单号各一次 IN 查询，剩余的按尾号逐条查询"""
+        candidates = {text: candidate_ids(text) for text in texts}
+        rows = self._select_in("shipments", "order_id", [oid for ids in candidates.values() for oid in ids])
+        by_order = {row["order_id"]: row for row in rows}
+        result = {text: next((by_order[oid] for oid in ids if oid in by_order), None)
+                  for text, ids in candidates.items()}
+        missing = {text: digits_of(text) for text, row in result.items() if row is None and digits_of(text)}
+        rows = self._select_in("shipments", "tracking_digits", list(missing.values()))
+        by_tracking = {row["tracking_digits"]: row for row in rows}
+        for text, digits in missing.items():
+            result[text] = by_tracking.get(digits) or self._by_tracking_suffix(digits)
+        return {text: self._shipment(row) if row is not None else None for text, row in result.items()}
+
+    def count(self) -> Dict[str, int]:
+        conn = self._conn()
+        return {
+            "orders": conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0],
+            "shipments": conn.execute("SELECT COUNT(*) FROM shipments").fetchone()[0],
+        }
+
+
+_CARRIERS = [("顺丰快递", "SF"), ("中通快递", "ZTO"), ("圆通快递", "YTO"), ("韵达快递", "YD"), ("京东物流", "JD")]
+_ORDER_STATUSES = ["待付款", "待发货", "已发货", "已完成"]
+_CITIES = ["北京", "上海", "广州", "深圳", "杭州", "成都", "武汉"]
+
+
+def generate_synthetic(store: OrderStore, n: int, start_id: int = 20000000, batch: int = 50000, seed: int = 0) -> None:
+    """写入 n 条合成订单（已发货 / 已完成的订单同时生成物流记录），订单号从 start_id 起连续编号"""
+    rng = random.Random(seed)
+    for lo in range(0, n, batch):
+        orders, shipments = [], []
+        for i in range(lo, min(lo + batch, n)):
+            oid = str(start_id + i)
+            status = rng.choice(_ORDER_STATUSES)
+            day = f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+            orders.append({
+                "order_id": oid,
+                "status": status,
+                "order_time": f"{day} {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00",
+                "total_amount": f"{rng.randint(10, 5000)}.00",
+                "items": [f"商品{chr(65 + rng.randint(0, 25))} x{rng.randint(1, 3)}"],
+            })
+            if status in ("已发货", "已完成"):
+                carrier, prefix = rng.choice(_CARRIERS)
+                city = rng.choice(_CITIES)
+                shipments.append({
+                    "order_id": oid,
+                    "carrier": carrier,
+                    "tracking_number": f"{prefix}{rng.randrange(10 ** 12, 10 ** 13)}",
+                    "status": "运输中" if status == "已发货" else "已签收",
+                    "current_location": f"{city}分拨中心" if status == "已发货" else "已送达",
+                    "estimated_delivery": day,
+                    "tracking": [{"time": f"{day} 10:00", "location": "商家已发货", "status": "已揽收"}],
+                })
+        store.add_orders(orders)
+        store.add_shipments(shipments)
@@ -0,0 +1,170 @@
+"""
+推测式 FAQ 检索预取：Agent 第一次 LLM 调用的同时，用用户原始消息提前检索 FAQ 知识库
+功能：
+1. speculate(message)：在后台线程中依次执行编码（embed）与检索（search），预取句柄放入 contextvar，
+   随请求上下文传到工具调用中（asyncio 任务与工具执行器的线程都会复制 contextvars）
+2. faq_rag_tool 在语义答案缓存未命中后调用 take(query, ...)：工具查询与原始消息双向相近时
+   （各自的字符 bigram 都有足够比例出现在对方中）复用预取的检索结果（尚未完成则等待），否则丢弃，照常检索。
+   只看查询在消息中的覆盖率时，一条同时问多件事的消息会覆盖其中任一子问题，子问题会拿到整条消息的检索结果；
+   预取的消息向量不交给工具，语义答案缓存始终按工具问题自身的向量查找与写入
+3. 请求结束时仍未开始执行的预取直接取消，不占用 CPU
+4. 统计预取次数、命中 / 未命中 / 未使用次数、命中率与节省的耗时，供 /metrics 输出；
+   节省的耗时只计入工具实际跳过的阶段（credit：检索阶段，工具没有自行编码问题时再加上编码阶段），
+   并扣除工具等待预取完成的时间
+
+命中时，编码与向量检索的耗时与 LLM 调用重叠，不再出现在工具调用的关键路径上。
+"""
+
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict
+
+from caching_retriever import normalize_query
+
+_current: contextvars.ContextVar = contextvars.ContextVar("faq_prefetch", default=None)
+
+
+def bigrams(text: str) -> set:
+    """归一化后（去掉空格）的字符 bigram 集合；只有一个字时返回单字集合"""
+    text = normalize_query(text).replace(" ", "")
+    return {text[i:i + 2] for i in range(len(text) - 1)} or set(text)
+
+
+def overlap(query: str, message: str) -> float:
+    """query 的 bigram 中出现在 message 里的比例"""
+    q = bigrams(query)
+    return len(q & bigrams(message)) / len(q) if q else 0.0
+
+
+def similarity(query: str, message: str) -> float:
+    """双向覆盖率的较小值：一方只是另一方的一小部分时相似度低"""
+    return min(overlap(query, message), overlap(message, query))
+
+
+class Prefetched:
+    """可复用的预取结果：检索结果、两个阶段的耗时，以及工具等待预取完成的时间"""
+
+    def __init__(self, result, embed_seconds: float, search_seconds: float, waited: float):
+        self.result = result
+        self.embed_seconds = embed_seconds
+        self.search_seconds = search_seconds
+        self.waited = waited
+
+
+class Prefetch:
+    """一次预取：原始消息、后台 Future（结果为 (index_version, Prefetched)）与结局"""
+
+    def __init__(self, message: str, future):
+        self.message = message
+        self.future = future
+        # 同一轮中可能有多个 faq_rag_tool 调用并发执行，预取结果只复用一次
+        self.lock = threading.Lock()
+        self.outcome = None  # "hit" / "miss"，请求结束时仍为 None 记为 unused
+
+
+class RetrievalPrefetcher:
+    """embed(message) -> (index_version, 消息向量或 None)；search(message, 向量) -> 检索结果；在线程池中依次执行"""
+
+    def __init__(self, embed: Callable, search: Callable, max_workers: int = 2, min_overlap: float = 0.6):
+        self.embed = embed
+        self.search = search
+        self.min_overlap = min_overlap
+        self._pool = ThreadPoolExecutor(max_workers, thread_name_prefix="faq-prefetch")
+        self._lock = threading.Lock()
+        self.started = 0
+        self.hits = 0
+        self.misses = 0
+        self.unused = 0
+        self.errors = 0
+        self.saved_seconds = 0.0
+
+    def _count(self, field: str, delta=1) -> None:
+        with self._lock:
+            setattr(self, field, getattr(self, field) + delta)
+
+    def _run(self, message: str):
+        t0 = time.perf_counter()
+        index_version, vector = self.embed(message)
+        t1 = time.perf_counter()
+        result = self.search(message, vector)
+        return index_version, Prefetched(result, t1 - t0, time.perf_counter() - t1, 0.0)
+
+    @contextmanager
+    def speculate(self, message: str):
+        """请求期间的预取（上下文管理器）：进入时提交后台检索，退出时结算并清理"""
+        ctx = contextvars.copy_context()
+        prefetch = Prefetch(message, self._pool.submit(ctx.run, self._run, message))
+        self._count("started")
+        token = _current.set(prefetch)
+        try:
+            yield prefetch
+        finally:
+            try:
+                _current.reset(token)
+            except ValueError:
+                # 流式响应的生成器可能在另一个上下文中被关闭
+                pass
+            self._finish(prefetch)
+
+    def _finish(self, prefetch: Prefetch) -> None:
+        if prefetch.outcome is None:
+            prefetch.future.cancel()
+            self._count("unused")
+        elif prefetch.outcome == "hit":
+            self._count("hits")
+        else:
+            self._count("misses")
+
+    def take(self, query: str, index_version: str):
+        """返回可复用的 Prefetched，不可复用时返回 None（调用方照常编码、检索）"""
+        prefetch = _current.get()
+        if prefetch is None:
+            return None
+        with prefetch.lock:
+            if prefetch.outcome == "hit":
+                return None
+            prefetched = self._take(query, index_version, prefetch)
+            prefetch.outcome = "miss" if prefetched is None else "hit"
+            return prefetched
+
+    def _take(self, query: str, index_version: str, prefetch: Prefetch):
+        # 先判断是否相近，不相近时不必等待预取完成
+        if similarity(query, prefetch.message) < self.min_overlap:
+            return None
+        if prefetch.future.cancel():
+            # 线程池繁忙，预取还没开始执行，等待它不如直接检索
+            return None
+        t0 = time.perf_counter()
+        try:
+            prefetched_version, prefetched = prefetch.future.result()
+        except Exception:
+            self._count("errors")
+            return None
+        if prefetched_version != index_version:
+            return None
+        prefetched.waited = time.perf_counter() - t0
+        return prefetched
+
+    def credit(self, prefetched: Prefetched, query_embedded: bool = False) -> None:
+        """记录复用预取结果后实际省下的耗时：检索阶段，加上（工具没有自行编码问题时）编码阶段，扣除等待时间
+
+        例如开启语义答案缓存时工具已为查缓存编码了问题，检索会复用该向量，省下的只有检索本身。
+        """
+        skipped = prefetched.search_seconds + (0.0 if query_embedded else prefetched.embed_seconds)
+        self._count("saved_seconds", max(0.0, skipped - prefetched.waited))
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            finished = self.hits + self.misses + self.unused
+            return {
+                "started_total": self.started,
+                "hits_total": self.hits,
+                "misses_total": self.misses,
+                "unused_total": self.unused,
+                "errors_total": self.errors,
+                "saved_seconds_total": self.saved_seconds,
+                "hit_ratio": self.hits / finished if finished else 0.0,
+            }
@@ -0,0 +1,171 @@
+"""
+语义答案缓存：放在 faq_rag_tool 前面，按问题的 embedding 复用已生成的回答
+功能：
+1. 新问题与某个已缓存问题的余弦距离不超过阈值时，直接返回缓存答案（跳过检索和 LLM 调用）
+2. LRU + TTL 淘汰，并按估算的内存占用设置上限
+3. 缓存绑定向量库版本，索引重建后自动失效
+4. 统计命中/未命中等计数，供 api_server 的 /metrics 输出
+5. 每条缓存可另带一个文本键（调用方归一化后的问题），lookup_text 按文本精确查找；
+   没有问题向量的请求（如 BM25 稀疏快速路径）只按文本键写入与查找
+
+说明：embedding 已做归一化（normalize_embeddings=True），余弦相似度即向量点积。
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """按问题向量缓存回答的 LRU/TTL 缓存（线程安全）"""
+
+    def __init__(
+        self,
+        max_distance: float = 0.08,
+        max_entries: int = 1024,
+        ttl_seconds: float = 3600.0,
+        max_bytes: int = 32 * 1024 * 1024,
+    ):
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # key -> {"question", "vector", "text", "answer", "expires_at", "size"}，顺序即 LRU 顺序
+        self._entries: "OrderedDict[int, dict]" = OrderedDict()
+        # 文本键 -> key
+        self._by_text: Dict[str, int] = {}
+        self._next_key = 0
+        self._bytes = 0
+        self._index_version = None
+        # 向量矩阵按需重建，避免每次查找都重新堆叠
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_keys: List[int] = []
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def lookup(self, vector, index_version: str) -> Optional[str]:
+        """查找与 vector 足够接近的已缓存问题，命中返回答案，否则返回 None"""
+        query = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            self._check_version(index_version)
+            self._purge_expired(time.time())
+            matrix, keys = self._get_matrix()
+            if not keys:
+                self.misses += 1
+                return None
+            sims = matrix @ query
+            best = int(np.argmax(sims))
+            if 1.0 - float(sims[best]) > self.max_distance:
+                self.misses += 1
+                return None
+            key = keys[best]
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]["answer"]
+
+    def lookup_text(self, text: str, index_version: str) -> Optional[str]:
+        """按文本键精确查找，命中返回答案，否则返回 None"""
+        with self._lock:
+            self._check_version(index_version)
+            self._purge_expired(time.time())
+            key = self._by_text.get(text)
+            if key is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]["answer"]
+
+    def store(self, question: str, vector, answer: str, index_version: str, text: Optional[str] = None) -> None:
+        """写入一条缓存，超出条数或内存上限时按 LRU 淘汰
+
+        vector 为 None 时只能通过文本键 text 查到；同一文本键的旧条目被替换。
+        """
+        vec = None if vector is None else np.asarray(vector, dtype=np.float32)
+        size = (vec.nbytes if vec is not None else 0) + len(question.encode("utf-8")) + len(answer.encode("utf-8"))
+        if size > self.max_bytes or (vec is None and text is None):
+            return
+        with self._lock:
+            self._check_version(index_version)
+            if text is not None and text in self._by_text:
+                self._remove(self._by_text[text])
+            key = self._next_key
+            self._next_key += 1
+            self._entries[key] = {
+                "question": question,
+                "vector": vec,
+                "text": text,
+                "answer": answer,
+                "expires_at": time.time() + self.ttl_seconds,
+                "size": size,
+            }
+            if text is not None:
+                self._by_text[text] = key
+            self._bytes += size
+            self._matrix = None
+            while self._entries and (
+                len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+            ):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_text.clear()
+            self._bytes = 0
+            self._matrix = None
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "hits_total": self.hits,
+                "misses_total": self.misses,
+                "evictions_total": self.evictions,
+                "expirations_total": self.expirations,
+                "invalidations_total": self.invalidations,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+    def _check_version(self, index_version: str) -> None:
+        if self._index_version is None:
+            self._index_version = index_version
+        elif index_version != self._index_version:
+            # 向量库已重建，旧答案可能基于过期的文档，整体作废
+            self._entries.clear()
+            self._by_text.clear()
+            self._bytes = 0
+            self._matrix = None
+            self._index_version = index_version
+            self.invalidations += 1
+
+    def _purge_expired(self, now: float) -> None:
+        expired = [k for k, e in self._entries.items() if e["expires_at"] <= now]
+        for k in expired:
+            self._remove(k)
+            self.expirations += 1
+
+    def _remove(self, key: int) -> None:
+        entry = self._entries.pop(key)
+        if entry["text"] is not None and self._by_text.get(entry["text"]) == key:
+            del self._by_text[entry["text"]]
+        self._bytes -= entry["size"]
+        self._matrix = None
+
+    def _get_matrix(self):
+        """有问题向量的条目堆叠成的矩阵与对应的 key（没有时 key 列表为空）"""
+        if self._matrix is None:
+            self._matrix_keys = [k for k, e in self._entries.items() if e["vector"] is not None]
+            self._matrix = (
+                np.stack([self._entries[k]["vector"] for k in self._matrix_keys])
+                if self._matrix_keys else np.zeros((0, 0), dtype=np.float32)
+            )
+        return self._matrix, self._matrix_keys
@@ -0,0 +1,380 @@
+"""
+会话存储：保存每个会话最近的对话消息（{"role", "content"} 列表），替代进程内无上限的字典
+后端：
+1. MemorySessionStore：进程内 LRU + TTL，按会话数与估算内存设置上限（单进程默认）
+2. SqliteSessionStore：SQLite（WAL 模式），消息列表压缩后整行存储，多个 worker 进程可共享同一文件
+3. StoreChatMessageHistory：把任一后端适配成 LangChain 的 BaseChatMessageHistory
+4. 每个会话另有一份 meta（如滚动摘要、上下文订单号），compact 可原子地丢弃最早的消息并更新 meta；
+   meta 中的 generation 在会话开头的消息每次被丢弃（折叠或超出条数上限）时加一，
+   compact 只在开头的消息与 generation 都与调用方读取时一致时才生效，多个进程重复折叠同一段消息时只有一个生效
+
+两个后端都统计会话数、占用字节、淘汰/过期次数，供 api_server 的 /metrics 输出。
+SQLite 后端的会话数与字节数在每次写入的同一事务中增量维护（session_totals 表），/metrics 不必扫描全表。
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Sequence
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+
+Message = Dict[str, str]
+# 估算内存时每条消息的固定开销（dict 与字符串对象头）
+_MESSAGE_OVERHEAD = 200
+
+
+def _message_bytes(msg: Message) -> int:
+    return len(msg.get("content", "").encode("utf-8")) + _MESSAGE_OVERHEAD
+
+
+def _can_compact(messages: List[Message], stored_meta: Dict, head: Sequence[Message], generation: int) -> bool:
+    return stored_meta.get("generation", 0) == generation and messages[:len(head)] == list(head)
+
+
+def _trim(messages: List[Message], meta: Dict, max_messages: int):
+    """只保留最近 max_messages 条；丢弃了开头的消息时 generation 加一"""
+    if len(messages) <= max_messages:
+        return messages, meta
+    return messages[-max_messages:], dict(meta, generation=meta.get("generation", 0) + 1)
+
+
+class SessionStore:
+    """会话存储接口"""
+
+    def get(self, session_id: str) -> List[Message]:
+        raise NotImplementedError
+
+    def append(self, session_id: str, messages: Sequence[Message], max_messages: int) -> List[Message]:
+        """追加消息并只保留最近 max_messages 条，返回追加后的消息列表（副本）"""
+        raise NotImplementedError
+
+    def clear(self, session_id: str) -> None:
+        raise NotImplementedError
+
+    def get_meta(self, session_id: str) -> Dict:
+        raise NotImplementedError
+
+    def compact(self, session_id: str, head: Sequence[Message], generation: int, meta: Dict) -> bool:
+        """丢弃最早的 len(head) 条消息并写入 meta（消息已折叠进摘要时调用）
+
+        仅当会话当前开头的消息与 head 相同、且 meta 的 generation 仍为调用方读取时的值才执行，
+        否则（其他进程已折叠或消息已被截断）不做任何改动并返回 False。写入的 meta 的 generation 为原值加一。
+        """
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, float]:
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    """进程内 LRU + TTL 会话存储（线程安全）"""
+
+    def __init__(self, max_sessions: int = 10000, ttl_seconds: float = 86400.0, max_bytes: int = 64 * 1024 * 1024):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # session_id -> {"messages", "meta", "size", "touched_at"}，顺序即最近访问顺序
+        self._sessions: "OrderedDict[str, dict]" = OrderedDict()
+        self._bytes = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, session_id: str) -> List[Message]:
+        with self._lock:
+            self._purge_expired(time.time())
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return []
+            entry["touched_at"] = time.time()
+            self._sessions.move_to_end(session_id)
+            return list(entry["messages"])
+
+    def append(self, session_id: str, messages: Sequence[Message], max_messages: int) -> List[Message]:
+        now = time.time()
+        with self._lock:
+            self._purge_expired(now)
+            entry = self._sessions.pop(session_id, None)
+            if entry is None:
+                entry = {"messages": [], "meta": {}, "size": 0, "touched_at": now}
+            else:
+                self._bytes -= entry["size"]
+            msgs, meta = _trim(entry["messages"] + list(messages), entry["meta"], max_messages)
+            entry.update(messages=msgs, meta=meta, size=self._entry_bytes(msgs, meta), touched_at=now)
+            self._sessions[session_id] = entry
+            self._bytes += entry["size"]
+            # 超出上限时淘汰最久未访问的会话（至少保留当前会话）
+            while len(self._sessions) > 1 and (
+                len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes
+            ):
+                self._remove(next(iter(self._sessions)))
+                self.evictions += 1
+            return list(msgs)
+
+    def clear(self, session_id: str) -> None:
+        with self._lock:
+            if session_id in self._sessions:
+                self._remove(session_id)
+
+    def get_meta(self, session_id: str) -> Dict:
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            return dict(entry["meta"]) if entry is not None else {}
+
+    def compact(self, session_id: str, head: Sequence[Message], generation: int, meta: Dict) -> bool:
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or not _can_compact(entry["messages"], entry["meta"], head, generation):
+                return False
+            self._bytes -= entry["size"]
+            entry["messages"] = entry["messages"][len(head):]
+            entry["meta"] = dict(meta, generation=generation + 1)
+            entry["size"] = self._entry_bytes(entry["messages"], entry["meta"])
+            self._bytes += entry["size"]
+            return True
+
+    @staticmethod
+    def _entry_bytes(messages: List[Message], meta: Dict) -> int:
+        return sum(_message_bytes(m) for m in messages) + len(json.dumps(meta, ensure_ascii=False).encode("utf-8"))
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "bytes": self._bytes,
+                "evictions_total": self.evictions,
+                "expirations_total": self.expirations,
+            }
+
+    def _remove(self, session_id: str) -> None:
+        entry = self._sessions.pop(session_id)
+        self._bytes -= entry["size"]
+
+    def _purge_expired(self, now: float) -> None:
+        # 按访问顺序排列，最旧的在前，遇到未过期的即可停止
+        while self._sessions:
+            session_id, entry = next(iter(self._sessions.items()))
+            if now - entry["touched_at"] <= self.ttl_seconds:
+                break
+            self._remove(session_id)
+            self.expirations += 1
+
+
+class SqliteSessionStore(SessionStore):
+    """SQLite 会话存储：WAL 模式支持多进程并发读写，每个线程 / 进程使用独立连接
+
+    消息列表以紧凑 JSON + zlib 压缩后存为一行；过期与超量会话按写入次数定期清理。
+    """
+
+    def __init__(self, path, max_sessions: int = 100000, ttl_seconds: float = 86400.0, cleanup_every: int = 500):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.cleanup_every = cleanup_every
+        self._local = threading.local()
+        self._writes = 0
+        self.evictions = 0
+        self.expirations = 0
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " session_id TEXT PRIMARY KEY,"
+            " messages BLOB NOT NULL,"
+            " meta TEXT NOT NULL DEFAULT '{}',"
+            " updated_at REAL NOT NULL)"
+        )
+        # 旧版本创建的库没有 meta 列，CREATE TABLE IF NOT EXISTS 不会改动已有表，需要补上
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(sessions)")}
+        if "meta" not in columns:
+            try:
+                conn.execute("ALTER TABLE sessions ADD COLUMN meta TEXT NOT NULL DEFAULT '{}'")
+            except sqlite3.OperationalError as e:
+                # 多个 worker 同时启动时可能已被其他进程加上
+                if "duplicate column" not in str(e):
+                    raise
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_updated_at ON sessions(updated_at)")
+        # 会话数与消息字节数的累计值（单行）；首次创建时按现有数据初始化，之后随写入增量更新
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS session_totals ("
+            " id INTEGER PRIMARY KEY CHECK (id = 0),"
+            " sessions INTEGER NOT NULL,"
+            " bytes INTEGER NOT NULL)"
+        )
+        conn.execute(
+            "INSERT OR IGNORE INTO session_totals(id, sessions, bytes) "
+            "SELECT 0, COUNT(*), COALESCE(SUM(LENGTH(messages)), 0) FROM sessions"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        # fork 之后不能复用父进程的连接，按进程号区分
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """写事务：BEGIN IMMEDIATE 先拿写锁，读-改-写期间其他进程不会穿插写入"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _add_totals(conn: sqlite3.Connection, sessions: int, size: int) -> None:
+        if sessions or size:
+            conn.execute(
+                "UPDATE session_totals SET sessions = sessions + ?, bytes = bytes + ? WHERE id = 0", (sessions, size)
+            )
+
+    @staticmethod
+    def _encode(messages: List[Message]) -> bytes:
+        return zlib.compress(json.dumps(messages, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+    @staticmethod
+    def _decode(blob: bytes) -> List[Message]:
+        return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+    def get(self, session_id: str) -> List[Message]:
+        row = self._conn().execute(
+            "SELECT messages, updated_at FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None or time.time() - row[1] > self.ttl_seconds:
+            return []
+        return self._decode(row[0])
+
+    def append(self, session_id: str, messages: Sequence[Message], max_messages: int) -> List[Message]:
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT messages, meta, updated_at FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            # 已过期的会话视为新会话，消息与 meta 一并重置
+            alive = row is not None and now - row[2] <= self.ttl_seconds
+            old = self._decode(row[0]) if alive else []
+            old_meta = json.loads(row[1]) if alive else {}
+            msgs, meta = _trim(old + list(messages), old_meta, max_messages)
+            blob = self._encode(msgs)
+            conn.execute(
+                "INSERT INTO sessions(session_id, messages, meta, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET messages = excluded.messages, "
+                "meta = excluded.meta, updated_at = excluded.updated_at",
+                (session_id, blob, json.dumps(meta, ensure_ascii=False), now),
+            )
+            self._add_totals(conn, 1 if row is None else 0, len(blob) - (len(row[0]) if row is not None else 0))
+        self._writes += 1
+        if self._writes % self.cleanup_every == 0:
+            self.cleanup()
+        return msgs
+
+    def clear(self, session_id: str) -> None:
+        with self._transaction() as conn:
+            row = conn.execute("SELECT LENGTH(messages) FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if row is not None:
+                conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                self._add_totals(conn, -1, -row[0])
+
+    def get_meta(self, session_id: str) -> Dict:
+        row = self._conn().execute("SELECT meta FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return json.loads(row[0]) if row is not None else {}
+
+    def compact(self, session_id: str, head: Sequence[Message], generation: int, meta: Dict) -> bool:
+        # 检查与写入在同一个写事务中，其他进程的折叠 / 追加不会穿插进来
+        with self._transaction() as conn:
+            row = conn.execute("SELECT messages, meta FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if row is None:
+                return False
+            msgs = self._decode(row[0])
+            if not _can_compact(msgs, json.loads(row[1]), head, generation):
+                return False
+            blob = self._encode(msgs[len(head):])
+            conn.execute(
+                "UPDATE sessions SET messages = ?, meta = ? WHERE session_id = ?",
+                (blob, json.dumps(dict(meta, generation=generation + 1), ensure_ascii=False), session_id),
+            )
+            self._add_totals(conn, 0, len(blob) - len(row[0]))
+            return True
+
+    def cleanup(self) -> None:
+        """删除过期会话，并在超过 max_sessions 时删除最久未更新的会话"""
+        with self._transaction() as conn:
+            self.expirations += self._delete_where(conn, "updated_at < ?", (time.time() - self.ttl_seconds,))
+            count = conn.execute("SELECT sessions FROM session_totals WHERE id = 0").fetchone()[0]
+            if count > self.max_sessions:
+                self.evictions += self._delete_where(
+                    conn,
+                    "session_id IN (SELECT session_id FROM sessions ORDER BY updated_at LIMIT ?)",
+                    (count - self.max_sessions,),
+                )
+
+    def _delete_where(self, conn: sqlite3.Connection, where: str, params) -> int:
+        """删除满足条件的会话并同步累计值，返回删除的会话数"""
+        count, size = conn.execute(
+            f"SELECT COUNT(*), COALESCE(SUM(LENGTH(messages)), 0) FROM sessions WHERE {where}", params
+        ).fetchone()
+        if count:
+            conn.execute(f"DELETE FROM sessions WHERE {where}", params)
+            self._add_totals(conn, -count, -size)
+        return count
+
+    def stats(self) -> Dict[str, float]:
+        count, size = self._conn().execute("SELECT sessions, bytes FROM session_totals WHERE id = 0").fetchone()
+        return {
+            "sessions": count,
+            "bytes": size,
+            "evictions_total": self.evictions,
+            "expirations_total": self.expirations,
+        }
+
+
+def create_session_store(backend: str, sqlite_path, max_sessions: int, ttl_seconds: float, max_bytes: int) -> SessionStore:
+    if backend == "memory":
+        return MemorySessionStore(max_sessions=max_sessions, ttl_seconds=ttl_seconds, max_bytes=max_bytes)
+    if backend == "sqlite":
+        return SqliteSessionStore(sqlite_path, max_sessions=max_sessions, ttl_seconds=ttl_seconds)
+    raise ValueError(f"不支持的会话存储类型: {backend}，可选: memory / sqlite")
+
+
+class StoreChatMessageHistory(BaseChatMessageHistory):
+    """LangChain 聊天历史适配器：消息读写都落到 SessionStore"""
+
+    def __init__(self, store: SessionStore, session_id: str, max_messages: int):
+        self.store = store
+        self.session_id = session_id
+        self.max_messages = max_messages
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        return [
+            HumanMessage(content=m["content"]) if m["role"] == "user" else AIMessage(content=m["content"])
+            for m in self.store.get(self.session_id)
+        ]
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        records = [
+            {"role": "user" if m.type == "human" else "assistant", "content": m.content}
+            for m in messages
+            if isinstance(m.content, str)
+        ]
+        if records:
+            self.store.append(self.session_id, records, self.max_messages)
+
+    def clear(self) -> None:
+        self.store.clear(self.session_id)
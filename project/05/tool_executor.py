@@ -0,0 +1,190 @@
+"""
+工具调用执行器：同一条 AI 消息中的多个独立工具调用并发执行，带超时与并发上限
+功能：
+1. 同步工具在有界线程池中执行，异步工具在同一事件循环内并发（每个事件循环一个信号量限制并发数）
+2. 按工具名配置超时（默认 TOOL_TIMEOUT 秒），超时的调用以 status="error" 的 ToolMessage 返回给模型，不阻塞其他调用
+3. 结果顺序与 AI 消息中的 tool_calls 顺序一致，与各工具的完成先后无关
+4. ToolExecutorMiddleware：接入 create_agent（05 的客服 Agent）；run_tool_calls / arun_tool_calls：供手写的 LangGraph 工具节点使用（08）
+5. 统计调用次数、超时 / 失败次数、执行中的调用数，供 /metrics 输出
+
+一轮工具调用的耗时由各工具耗时之和变为其中最慢的一个。
+说明：Python 线程无法被强制终止，超时的同步工具会在后台执行完毕（结果被丢弃），但仍占用一个线程池名额。
+"""
+
+import asyncio
+import contextvars
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain.agents.middleware import AgentMiddleware
+from langchain_core.messages import ToolMessage
+
+
+class ToolTimeout(Exception):
+    pass
+
+
+def parse_timeouts(spec: str) -> Dict[str, float]:
+    """解析 "faq_rag_tool=20,query_order_status=5" 形式的按工具超时配置"""
+    timeouts = {}
+    for item in (spec or "").split(","):
+        name, sep, value = item.partition("=")
+        if sep and name.strip():
+            timeouts[name.strip()] = float(value)
+    return timeouts
+
+
+def _error_message(tool_call: Dict, content: str) -> ToolMessage:
+    return ToolMessage(content=content, name=tool_call["name"], tool_call_id=tool_call["id"], status="error")
+
+
+class ToolCallExecutor:
+    def __init__(self, max_workers: int = 16, default_timeout: float = 30.0, timeouts: Optional[Dict[str, float]] = None):
+        self.max_workers = max_workers
+        self.default_timeout = default_timeout
+        self.timeouts = dict(timeouts or {})
+        self._pool = ThreadPoolExecutor(max_workers, thread_name_prefix="tool")
+        self._lock = threading.Lock()
+        self._semaphores: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+        self.calls = 0
+        self.timed_out = 0
+        self.errors = 0
+        self.in_flight = 0
+
+    def timeout_for(self, name: str) -> float:
+        return self.timeouts.get(name, self.default_timeout)
+
+    def _count(self, field: str, delta: int = 1) -> None:
+        with self._lock:
+            setattr(self, field, getattr(self, field) + delta)
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        # asyncio.Semaphore 绑定事件循环，每个事件循环各用一个
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            sem = self._semaphores.get(loop)
+            if sem is None:
+                sem = self._semaphores[loop] = asyncio.Semaphore(self.max_workers)
+            return sem
+
+    def _run(self, fn: Callable[[], Any]) -> Any:
+        self._count("in_flight")
+        try:
+            return fn()
+        finally:
+            self._count("in_flight", -1)
+
+    def submit(self, fn: Callable[[], Any]):
+        """在线程池中执行 fn（复制当前 contextvars，LangChain 回调与 trace 上下文不丢失），返回 Future"""
+        self._count("calls")
+        ctx = contextvars.copy_context()
+        return self._pool.submit(ctx.run, self._run, fn)
+
+    def wait(self, name: str, future, deadline: float) -> Any:
+        """等待 submit 返回的 Future，超过 deadline（time.monotonic()）时抛出 ToolTimeout"""
+        try:
+            return future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeoutError:
+            future.cancel()
+            self._count("timed_out")
+            raise ToolTimeout(f"工具 {name} 执行超过 {self.timeout_for(name):g} 秒，已放弃等待")
+
+    def call(self, name: str, fn: Callable[[], Any]) -> Any:
+        """同步执行单个工具调用（在线程池中执行，带超时）"""
+        future = self.submit(fn)
+        return self.wait(name, future, time.monotonic() + self.timeout_for(name))
+
+    async def acall(self, name: str, coro_fn: Callable[[], Any]) -> Any:
+        """异步执行单个工具调用（受并发上限与超时约束）"""
+        async with self._semaphore():
+            self._count("calls")
+            self._count("in_flight")
+            try:
+                task = asyncio.ensure_future(coro_fn())
+                # 不用 wait_for：它会等被取消的任务真正结束（线程中的同步工具要等到执行完）
+                done, _ = await asyncio.wait({task}, timeout=self.timeout_for(name))
+                if not done:
+                    task.cancel()
+                    self._count("timed_out")
+                    raise ToolTimeout(f"工具 {name} 执行超过 {self.timeout_for(name):g} 秒，已放弃等待")
+                return task.result()
+            finally:
+                self._count("in_flight", -1)
+
+    def run_tool_calls(self, tool_calls: List[Dict], tools_by_name: Dict[str, Any], config=None) -> List[ToolMessage]:
+        """并发执行一条 AI 消息中的全部工具调用，按 tool_calls 的顺序返回 ToolMessage"""
+        start = time.monotonic()
+        futures = []
+        for tc in tool_calls:
+            tool = tools_by_name.get(tc["name"])
+            call = dict(tc, type="tool_call")
+            futures.append(None if tool is None else self.submit(lambda t=tool, c=call: t.invoke(c, config)))
+        return [self._collect(tc, future, start) for tc, future in zip(tool_calls, futures)]
+
+    def _collect(self, tool_call: Dict, future, start: float) -> ToolMessage:
+        name = tool_call["name"]
+        if future is None:
+            return _error_message(tool_call, f"未知工具：{name}")
+        try:
+            # 各调用同时开始，超时从提交时刻算起
+            return self.wait(name, future, start + self.timeout_for(name))
+        except ToolTimeout as e:
+            return _error_message(tool_call, str(e))
+        except Exception as e:
+            self._count("errors")
+            return _error_message(tool_call, f"工具执行失败：{e}")
+
+    async def arun_tool_calls(self, tool_calls: List[Dict], tools_by_name: Dict[str, Any], config=None) -> List[ToolMessage]:
+        """run_tool_calls 的异步版本（asyncio.gather 保持 tool_calls 顺序）"""
+
+        async def run_one(tc: Dict) -> ToolMessage:
+            tool = tools_by_name.get(tc["name"])
+            if tool is None:
+                return _error_message(tc, f"未知工具：{tc['name']}")
+            try:
+                return await self.acall(tc["name"], lambda: tool.ainvoke(dict(tc, type="tool_call"), config))
+            except ToolTimeout as e:
+                return _error_message(tc, str(e))
+            except Exception as e:
+                self._count("errors")
+                return _error_message(tc, f"工具执行失败：{e}")
+
+        return list(await asyncio.gather(*(run_one(tc) for tc in tool_calls)))
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "calls_total": self.calls,
+                "timeouts_total": self.timed_out,
+                "errors_total": self.errors,
+                "in_flight": self.in_flight,
+                "max_workers": self.max_workers,
+            }
+
+
+class ToolExecutorMiddleware(AgentMiddleware):
+    """create_agent 中间件：每个工具调用经由 ToolCallExecutor 执行（并发上限 + 超时）
+
+    create_agent 本身会并发分发同一条 AI 消息中的工具调用，这里负责限流与超时，超时转成错误 ToolMessage。
+    """
+
+    def __init__(self, executor: ToolCallExecutor):
+        super().__init__()
+        self.executor = executor
+
+    def wrap_tool_call(self, request, handler):
+        tool_call = request.tool_call
+        try:
+            return self.executor.call(tool_call["name"], lambda: handler(request))
+        except ToolTimeout as e:
+            return _error_message(tool_call, str(e))
+
+    async def awrap_tool_call(self, request, handler):
+        tool_call = request.tool_call
+        try:
+            return await self.executor.acall(tool_call["name"], lambda: handler(request))
+        except ToolTimeout as e:
+            return _error_message(tool_call, str(e))
@@ -1,6 +1,6 @@
 import os
+import asyncio
 import importlib.util
-import logging
 import json
 import time
 import uuid
@@ -8,22 +8,30 @@ import contextvars
 from functools import wraps
 from pathlib import Path
 from typing import Dict, List
-from fastapi import FastAPI, Response, Request
+from fastapi import FastAPI, HTTPException, Response, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
 import uvicorn
+load_dotenv()
+
+# 多 worker 部署时的共享指标目录（见 gunicorn.conf.py），需在导入 prometheus_client 之前设置
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR", "")
 try:
-    from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+    from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry
+    from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
     PROM = True
 except Exception:
     PROM = False
     Counter = None
     Histogram = None
     generate_latest = None
+    REGISTRY = None
+    CollectorRegistry = None
+    CounterMetricFamily = None
+    GaugeMetricFamily = None
     CONTENT_TYPE_LATEST = "text/plain; version=0.0.4"
 
-load_dotenv()
-
 app = FastAPI(title="Customer Service Agent API", version="1.0.0")
 
 root = Path(__file__).resolve().parents[2]
@@ -33,37 +41,210 @@ agent_file = project_dir / "05" / "cust_service_agent_cli.py"
 spec = importlib.util.spec_from_file_location("cust_service_agent_cli", agent_file)
 mod = importlib.util.module_from_spec(spec)
 spec.loader.exec_module(mod)
+# gunicorn preload 模式下在 master 进程中加载只读资源（embedding 模型权重、FAISS 索引），
+# fork 后各 worker 以写时复制方式共享；STORE_FORMAT=mmap 时索引通过页缓存共享
+if os.getenv("PRELOAD_ASSETS") == "1":
+    mod.get_retriever()
 TRACE_ID = contextvars.ContextVar("trace_id", default="")
 SESSION_ID = contextvars.ContextVar("session_id", default="")
 logs_dir = project_dir / "logs"
 logs_dir.mkdir(parents=True, exist_ok=True)
-logger = logging.getLogger("app")
-logger.setLevel(logging.INFO)
-fh = logging.FileHandler(logs_dir / "app.jsonl", encoding="utf-8")
-formatter = logging.Formatter("%(message)s")
-fh.setFormatter(formatter)
-if not logger.handlers:
-    logger.addHandler(fh)
-
-def count_tool_calls(result):
-    cnt = 0
-    for m in result.get("messages", []):
-        t = getattr(m, "type", None)
-        r = getattr(m, "role", None)
-        c = getattr(m, "content", "")
-        if t == "tool" or r == "tool":
-            cnt += 1
-        elif isinstance(c, str) and ("工具" in c or "Tool" in c):
-            cnt += 1
-    return cnt
+_logger_spec = importlib.util.spec_from_file_location("jsonl_logger", Path(__file__).resolve().parent / "jsonl_logger.py")
+jsonl_logger = importlib.util.module_from_spec(_logger_spec)
+_logger_spec.loader.exec_module(jsonl_logger)
+# 请求路径只把日志记录放进队列，由后台线程批量写入并按大小 / 时间滚动；
+# 多 worker 时设置 LOG_FILE_PER_WORKER=1，每个 worker 写 app-<pid>.jsonl
+app_log = jsonl_logger.AsyncJsonlLogger(
+    logs_dir / ("app-{pid}.jsonl" if os.getenv("LOG_FILE_PER_WORKER") == "1" else "app.jsonl"),
+    max_bytes=int(float(os.getenv("LOG_MAX_MB", "100")) * 1024 * 1024),
+    rotate_seconds=float(os.getenv("LOG_ROTATE_SECONDS", "86400")),
+    backup_count=int(os.getenv("LOG_BACKUP_COUNT", "14")),
+    compress=os.getenv("LOG_COMPRESS", "1") == "1",
+    queue_size=int(os.getenv("LOG_QUEUE_SIZE", "10000")),
+    batch_size=int(os.getenv("LOG_BATCH_SIZE", "256")),
+    flush_interval=float(os.getenv("LOG_FLUSH_INTERVAL", "0.5")),
+)
+
+def count_tool_calls(result, start: int = 0):
+    """本次执行的工具调用数：result 中第 start 条之后的 ToolMessage 条数（start 为输入消息数）"""
+    return sum(1 for m in result.get("messages", [])[start:] if getattr(m, "type", None) == "tool")
+
+
 agent = mod.create_customer_service_agent()
 
-SESSION_MESSAGES: Dict[str, List[Dict[str, str]]] = {}
-MAX_MESSAGES = 12
+# 会话历史存储（与 05 模块共用，后端由 SESSION_STORE 配置）
+session_store = mod.get_session_store()
+# 按 token 预算组装历史（较早的对话异步折叠成摘要）
+history = mod.get_history()
+# 同时执行的 agent 请求上限；超出的请求排队等待，排队超过 CHAT_QUEUE_TIMEOUT 秒返回 503
+CHAT_MAX_IN_FLIGHT = int(os.getenv("CHAT_MAX_IN_FLIGHT", "256"))
+CHAT_QUEUE_TIMEOUT = float(os.getenv("CHAT_QUEUE_TIMEOUT", "30"))
+
+
+class ConcurrencyLimiter:
+    """基于 asyncio.Semaphore 的并发限制，记录执行中 / 排队中的请求数"""
+
+    def __init__(self, max_in_flight: int, queue_timeout: float):
+        self.max_in_flight = max_in_flight
+        self.queue_timeout = queue_timeout
+        self._sem = asyncio.Semaphore(max_in_flight)
+        self.in_flight = 0
+        self.queued = 0
+        self.rejected = 0
+        self.completed = 0
+        self.queue_wait_seconds = 0.0
+
+    async def acquire(self):
+        self.queued += 1
+        t0 = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._sem.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="服务繁忙，请稍后重试")
+        finally:
+            self.queued -= 1
+            self.queue_wait_seconds += time.perf_counter() - t0
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self.completed += 1
+        self._sem.release()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "queue_depth": self.queued,
+            "max_in_flight": self.max_in_flight,
+            "rejected_total": self.rejected,
+            "completed_total": self.completed,
+            "queue_wait_seconds_total": self.queue_wait_seconds,
+        }
+
+
+chat_limiter = ConcurrencyLimiter(CHAT_MAX_IN_FLIGHT, CHAT_QUEUE_TIMEOUT)
+# 首轮（无历史）请求合并：相同问题同时到达时只执行一次 agent
+CHAT_SINGLEFLIGHT_ENABLED = os.getenv("CHAT_SINGLEFLIGHT_ENABLED", "1") == "1"
+
+
+class SingleFlight:
+    """合并相同 key 的并发调用：第一个请求发起执行，执行期间到达的请求等待同一结果
+
+    执行放在独立任务中，发起者断开连接（被取消）不会影响其他等待者。
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    async def do(self, key, fn):
+        """返回 (结果, 是否为合并请求)"""
+        task = self._calls.get(key)
+        shared = task is not None
+        if shared:
+            self.coalesced += 1
+        else:
+            self.executions += 1
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        return await asyncio.shield(task), shared
+
+    def _done(self, key, task):
+        self._calls.pop(key, None)
+        # 所有等待者都已断开时，避免 "exception was never retrieved" 警告
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self):
+        return {
+            "executions_total": self.executions,
+            "coalesced_total": self.coalesced,
+            "in_flight_keys": len(self._calls),
+        }
+
+
+chat_singleflight = SingleFlight()
+
+# 启动预热：后台加载 embedding 模型、向量库并发起一次极短的 LLM 调用，完成前 /ready 返回 503
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "1") == "1"
+WARMUP_LLM_PING = os.getenv("WARMUP_LLM_PING", "1") == "1"
+WARMUP = {"status": "pending", "timings": {}, "errors": {}}
+_warmup_task = None
+
+
+async def run_warmup():
+    """依次预热本地检索资源与 LLM 连接，记录各步骤耗时
+
+    本地资源加载失败时状态为 failed（/ready 保持 503）；LLM 预热失败只记录错误，不影响就绪。
+    """
+    WARMUP["status"] = "running"
+    t0 = time.perf_counter()
+    try:
+        WARMUP["timings"].update(await asyncio.to_thread(mod.warmup))
+    except Exception as e:
+        WARMUP["errors"]["retriever"] = str(e)
+        WARMUP["status"] = "failed"
+    if WARMUP_LLM_PING:
+        t1 = time.perf_counter()
+        try:
+            # 建立到模型服务的连接（TLS 握手、连接池），只生成 1 个 token
+            await mod.init_model().bind(max_tokens=1).ainvoke("ping")
+            WARMUP["timings"]["llm_ping"] = time.perf_counter() - t1
+        except Exception as e:
+            WARMUP["errors"]["llm_ping"] = str(e)
+    WARMUP["timings"]["total"] = time.perf_counter() - t0
+    if WARMUP["status"] != "failed":
+        WARMUP["status"] = "ready"
+    app_log.log({
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "level": "INFO" if WARMUP["status"] == "ready" else "ERROR",
+        "type": "warmup",
+        "status": WARMUP["status"],
+        "timings_ms": {k: int(v * 1000) for k, v in WARMUP["timings"].items()},
+        "errors": dict(WARMUP["errors"]),
+    })
+
+
+def warmup_stats():
+    stats = {"ready": 1 if WARMUP["status"] == "ready" else 0}
+    for step, seconds in WARMUP["timings"].items():
+        stats[f"{step}_seconds"] = seconds
+    return stats
 if PROM:
     REQUEST_COUNT = Counter("http_requests_total", "Total HTTP requests", ["path", "method", "status"])
     REQUEST_LATENCY = Histogram("http_request_latency_seconds", "HTTP request latency", ["path", "method"])
     TOOL_CALLS = Counter("tool_calls_total", "Tool calls", ["tool", "status"])
+    # 流式接口首 token 耗时（从收到请求到第一个回答 token 发出，含排队时间）
+    CHAT_TTFT = Histogram(
+        "chat_time_to_first_token_seconds", "Time to first answer token on /chat/stream",
+        buckets=(0.1, 0.25, 0.5, 1, 1.5, 2, 3, 5, 8, 13, 20, 30),
+    )
+    # 每次请求带入的历史（摘要 + 近期消息）估算 token 数；未安装时由 chat_history_* 的累计值代替
+    CHAT_HISTORY_TOKENS = Histogram(
+        "chat_request_history_tokens", "Estimated history tokens sent to the agent per request",
+        buckets=(50, 100, 200, 400, 800, 1200, 1600, 2000, 3000, 4000, 8000),
+    )
+    # agent 流水线各阶段耗时（stage：llm / tool / embedding / vector_search / bm25_search）
+    STAGE_LATENCY = Histogram(
+        "agent_stage_latency_seconds", "Agent pipeline stage latency", ["stage", "name"],
+        buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+    )
+    LLM_TOKENS = Counter("llm_tokens_total", "LLM token usage", ["model", "kind"])
+    # 快速路径（不经过 agent）作答耗时；未安装时由 fast_path_router_latency_seconds_total / served_total 代替
+    FAST_PATH_LATENCY = Histogram(
+        "chat_fast_path_latency_seconds", "Latency of chat requests answered on the rule-based fast path",
+        buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+    )
 else:
     REQUEST_COUNT = None
     REQUEST_LAT_SUM = {}
@@ -71,6 +252,155 @@ else:
     TOOL_CALLS = None
     SIMPLE_REQ_COUNT = {}
     SIMPLE_TOOL_CALLS = {}
+    CHAT_TTFT = None
+    TTFT_SUM = 0.0
+    TTFT_COUNT = 0
+    STAGE_LAT_SUM = {}
+    STAGE_LAT_COUNT = {}
+    SIMPLE_LLM_TOKENS = {}
+
+
+class PipelineMetricsHook:
+    """把 05 模块的流水线埋点（LLM、工具、embedding、检索）写入 Prometheus 指标或简易计数"""
+
+    def duration(self, stage: str, name: str, seconds: float) -> None:
+        if PROM:
+            STAGE_LATENCY.labels(stage=stage, name=name).observe(seconds)
+        else:
+            key = (stage, name)
+            STAGE_LAT_SUM[key] = STAGE_LAT_SUM.get(key, 0.0) + seconds
+            STAGE_LAT_COUNT[key] = STAGE_LAT_COUNT.get(key, 0) + 1
+
+    def tokens(self, model: str, prompt: int, completion: int) -> None:
+        for kind, n in (("prompt", prompt), ("completion", completion)):
+            if PROM:
+                LLM_TOKENS.labels(model=model, kind=kind).inc(n)
+            else:
+                SIMPLE_LLM_TOKENS[(model, kind)] = SIMPLE_LLM_TOKENS.get((model, kind), 0) + n
+
+    def tool_call(self, tool: str, status: str) -> None:
+        if PROM:
+            TOOL_CALLS.labels(tool=tool, status=status).inc()
+        else:
+            SIMPLE_TOOL_CALLS[(tool, status)] = SIMPLE_TOOL_CALLS.get((tool, status), 0) + 1
+
+
+mod.pipeline_metrics.add_hook(PipelineMetricsHook())
+# 每次调用 agent 时传入，记录 LLM 与工具调用
+AGENT_CONFIG = {"callbacks": [mod.metrics_callback]}
+
+
+def component_stats():
+    """各组件的运行统计（名称前缀 -> 统计字典），键以 _total 结尾的按 counter 输出，其余按 gauge"""
+    return {
+        "faq_answer_cache": mod.get_answer_cache().stats(),
+        "retriever_cache": mod.get_retriever_cache_stats(),
+        "retrieval_path": mod.get_retrieval_path_stats(),
+        "chat_concurrency": chat_limiter.stats(),
+        "chat_singleflight": chat_singleflight.stats(),
+        "session_store": session_store.stats(),
+        "warmup": warmup_stats(),
+        "chat_history": history.stats(),
+        "app_log": app_log.stats(),
+        "tool_executor": mod.get_tool_executor().stats(),
+        "fast_path_router": mod.get_fast_path_router().stats(),
+        "faq_prefetch": mod.get_faq_prefetcher().stats(),
+        "faq_relevance": mod.get_faq_relevance_stats(),
+    }
+
+
+# 多 worker 时各进程定期把统计快照写入 MULTIPROC_DIR，/metrics 汇总所有 worker 的快照
+STATS_SNAPSHOT_INTERVAL = float(os.getenv("STATS_SNAPSHOT_INTERVAL", "1"))
+_last_snapshot = 0.0
+
+
+def stats_snapshot():
+    """本进程统计快照：组件统计，以及未安装 prometheus_client 时的简易计数"""
+    snap = {"components": component_stats()}
+    if not PROM:
+        snap["simple"] = {
+            "requests": [[*k, v] for k, v in SIMPLE_REQ_COUNT.items()],
+            "latency_sum": [[*k, v] for k, v in REQUEST_LAT_SUM.items()],
+            "latency_count": [[*k, v] for k, v in REQUEST_LAT_COUNT.items()],
+            "tool_calls": [[*k, v] for k, v in SIMPLE_TOOL_CALLS.items()],
+            "stage_latency_sum": [[*k, v] for k, v in STAGE_LAT_SUM.items()],
+            "stage_latency_count": [[*k, v] for k, v in STAGE_LAT_COUNT.items()],
+            "llm_tokens": [[*k, v] for k, v in SIMPLE_LLM_TOKENS.items()],
+            "ttft": [TTFT_SUM, TTFT_COUNT],
+        }
+    return snap
+
+
+def write_stats_snapshot(force: bool = False) -> None:
+    global _last_snapshot
+    now = time.time()
+    if not MULTIPROC_DIR or (not force and now - _last_snapshot < STATS_SNAPSHOT_INTERVAL):
+        return
+    _last_snapshot = now
+    path = Path(MULTIPROC_DIR) / f"stats_{os.getpid()}.json"
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(stats_snapshot(), f, ensure_ascii=False)
+    tmp.replace(path)
+
+
+def read_stats_snapshots():
+    """读取所有 worker 的快照（先刷新本进程的），返回 {pid: 快照}"""
+    write_stats_snapshot(force=True)
+    snaps = {}
+    for path in sorted(Path(MULTIPROC_DIR).glob("stats_*.json")):
+        try:
+            with path.open("r", encoding="utf-8") as f:
+                snaps[path.stem[len("stats_"):]] = json.load(f)
+        except (OSError, ValueError):
+            # worker 已退出或文件正在替换
+            continue
+    return snaps
+
+
+def iter_component_metrics():
+    """产出 (指标名, 类型, 值, 标签)
+
+    多 worker 时 counter 跨 worker 求和；gauge 是进程内状态，按 pid 标签分别输出。
+    """
+    if not MULTIPROC_DIR:
+        for prefix, stats in component_stats().items():
+            for key, value in stats.items():
+                kind = "counter" if key.endswith("_total") else "gauge"
+                yield f"{prefix}_{key}", kind, value, {}
+        return
+    totals = {}
+    gauges = []
+    for pid, snap in read_stats_snapshots().items():
+        for prefix, stats in snap["components"].items():
+            for key, value in stats.items():
+                name = f"{prefix}_{key}"
+                if key.endswith("_total"):
+                    totals[name] = totals.get(name, 0) + value
+                else:
+                    gauges.append((name, value, pid))
+    for name, value in totals.items():
+        yield name, "counter", value, {}
+    for name, value, pid in gauges:
+        yield name, "gauge", value, {"pid": pid}
+
+
+if PROM:
+    class ComponentStatsCollector:
+        """在抓取时读取组件统计，转成 Prometheus 指标"""
+
+        def collect(self):
+            families = {}
+            for name, kind, value, labels in iter_component_metrics():
+                family = families.get(name)
+                if family is None:
+                    family_cls = CounterMetricFamily if kind == "counter" else GaugeMetricFamily
+                    family = families[name] = family_cls(name, name, labels=list(labels))
+                family.add_metric(list(labels.values()), value)
+            yield from families.values()
+
+    if not MULTIPROC_DIR:
+        REGISTRY.register(ComponentStatsCollector())
 
 
 class ChatRequest(BaseModel):
@@ -117,68 +447,306 @@ async def access_log(request: Request, call_next):
             "status": status_code,
             "latency_ms": int(elapsed * 1000),
         }
-        logger.info(json.dumps(rec, ensure_ascii=False))
+        app_log.log(rec)
+        write_stats_snapshot()
+
+
+@app.on_event("startup")
+async def start_warmup():
+    global _warmup_task
+    if WARMUP_ENABLED:
+        # 在后台执行，不阻塞启动；多 worker 时每个 worker 各自预热
+        _warmup_task = asyncio.create_task(run_warmup())
+    else:
+        WARMUP["status"] = "ready"
+
+
+@app.on_event("shutdown")
+def close_app_log():
+    # 写完队列中剩余的日志
+    app_log.close()
+
+
+@app.on_event("shutdown")
+def flush_stats_snapshot():
+    # 退出前写一次最新快照，worker 退出后由 gunicorn 的 child_exit 并入归档
+    write_stats_snapshot(force=True)
 
 
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
+
+@app.get("/ready")
+def ready(response: Response):
+    """就绪探针：预热完成前返回 503（/health 只表示进程存活）"""
+    if WARMUP["status"] != "ready":
+        response.status_code = 503
+    return {
+        "status": WARMUP["status"],
+        "timings_ms": {k: int(v * 1000) for k, v in WARMUP["timings"].items()},
+        "errors": WARMUP["errors"],
+    }
+
 @app.get("/c_hello")
 def c_hello():
     return {"c_hello": "hello, longchain"}
 
 
-@app.post("/chat", response_model=ChatResponse)
-def chat(req: ChatRequest):
-    sid = req.session_id or "default"
-    SESSION_ID.set(sid)
-    msgs = SESSION_MESSAGES.get(sid)
-    if msgs is None:
-        msgs = []
-        SESSION_MESSAGES[sid] = msgs
-    msgs.append({"role": "user", "content": req.message})
-    if len(msgs) > MAX_MESSAGES:
-        SESSION_MESSAGES[sid] = msgs[-MAX_MESSAGES:]
-        msgs = SESSION_MESSAGES[sid]
-    result = agent.invoke({"messages": msgs})
-    answer = result["messages"][-1].content
-    tool_calls = count_tool_calls(result)
-    msgs.append({"role": "assistant", "content": answer})
-    if len(msgs) > MAX_MESSAGES:
-        SESSION_MESSAGES[sid] = msgs[-MAX_MESSAGES:]
-    trace_id = TRACE_ID.get()
-    logger.info(json.dumps({
+async def push_session_message(sid: str, role: str, content: str) -> List[Dict[str, str]]:
+    """追加一条会话消息，返回当前会话消息列表（存储读写在线程中执行，SQLite 等待写锁时不阻塞其他请求）"""
+    return await history.aappend(sid, role, content)
+
+
+async def build_history(sid: str, msgs: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """按 token 预算组装本次请求的历史，并记录 token 数"""
+    prompt_msgs, tokens = await history.abuild(sid, msgs)
+    if PROM:
+        CHAT_HISTORY_TOKENS.observe(tokens)
+    return prompt_msgs
+
+
+def log_chat(trace_id: str, sid: str, message: str, answer: str, tool_calls: int, **extra):
+    app_log.log({
         "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
         "level": "INFO",
         "trace_id": trace_id,
         "session_id": sid,
         "type": "chat",
-        "user_message": req.message[:500],
+        "user_message": message[:500],
         "reply_preview": answer[:500],
         "tool_calls_count": tool_calls,
         "reply_length": len(answer),
-    }, ensure_ascii=False))
+        **extra,
+    })
+
+
+async def try_fast_path(message: str):
+    """规则能识别的查状态 / 查物流请求直接调用工具作答，返回 (回答, [(工具名, 输出)]) 或 None
+
+    FAST_PATH_RENDER=llm 时渲染回答的模型调用占用 chat_limiter 名额（排队超时返回 503），模板渲染不占用。
+    """
+    t0 = time.perf_counter()
+    fast = await mod.afast_path_answer(message, config=AGENT_CONFIG, limiter=chat_limiter)
+    if fast is not None and PROM:
+        FAST_PATH_LATENCY.observe(time.perf_counter() - t0)
+    return fast
+
+
+@app.post("/chat", response_model=ChatResponse)
+async def chat(req: ChatRequest):
+    sid = req.session_id or "default"
+    SESSION_ID.set(sid)
+    msgs = await push_session_message(sid, "user", req.message)
+    fast = await try_fast_path(req.message)
+    if fast is not None:
+        answer, results = fast
+        await push_session_message(sid, "assistant", answer)
+        trace_id = TRACE_ID.get()
+        log_chat(trace_id, sid, req.message, answer, len(results), fast_path=True)
+        return ChatResponse(reply=answer, session_id=sid, trace_id=trace_id)
+    first_turn = len(msgs) == 1
+    prompt_msgs = await build_history(sid, msgs)
+
+    async def run_agent():
+        # 异步执行 agent：等待模型响应期间不占用线程；同时推测式预取原始消息的 FAQ 检索结果
+        async with chat_limiter:
+            with mod.faq_prefetch(req.message):
+                return await agent.ainvoke({"messages": prompt_msgs}, config=AGENT_CONFIG)
+
+    coalesced = False
+    if CHAT_SINGLEFLIGHT_ENABLED and first_turn:
+        # 首轮请求的上下文只有这一条消息，归一化后相同的问题共享同一次执行
+        key = mod.caching_retriever.normalize_query(req.message)
+        result, coalesced = await chat_singleflight.do(key, run_agent)
+    else:
+        result = await run_agent()
+    answer = result["messages"][-1].content
+    tool_calls = count_tool_calls(result, len(prompt_msgs))
+    await push_session_message(sid, "assistant", answer)
+    trace_id = TRACE_ID.get()
+    log_chat(trace_id, sid, req.message, answer, tool_calls, coalesced=coalesced)
     return ChatResponse(reply=answer, session_id=sid, trace_id=trace_id)
 
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def observe_ttft(seconds: float) -> None:
+    global TTFT_SUM, TTFT_COUNT
+    if PROM:
+        CHAT_TTFT.observe(seconds)
+    else:
+        TTFT_SUM += seconds
+        TTFT_COUNT += 1
+
+
+async def fast_path_events(fast, sid: str, trace_id: str, message: str, t0: float):
+    """快速路径的 SSE 事件：与 agent 路径相同的事件序列，回答作为一个 token 事件一次发出"""
+    answer, results = fast
+    for name, output in results:
+        yield sse_event("tool_start", {"name": name, "input": None})
+        yield sse_event("tool_end", {"name": name, "output": str(output)[:200]})
+    ttft = time.perf_counter() - t0
+    observe_ttft(ttft)
+    yield sse_event("token", {"text": answer})
+    await push_session_message(sid, "assistant", answer)
+    yield sse_event("done", {"reply": answer, "session_id": sid, "trace_id": trace_id})
+    log_chat(trace_id, sid, message, answer, len(results), stream=True, fast_path=True, ttft_ms=int(ttft * 1000))
+
+
+@app.post("/chat/stream")
+async def chat_stream(req: ChatRequest):
+    """SSE 流式对话：依次推送 tool_start / tool_end / token 事件，最后推送 done（完整回复）
+
+    只有 agent 主模型节点（model）产生的 token 会推送，faq_rag_tool 内部的模型调用不会混入回答。
+    排队超过 CHAT_QUEUE_TIMEOUT 时推送 error 事件（status=503）。
+    """
+    t0 = time.perf_counter()
+    sid = req.session_id or "default"
+    SESSION_ID.set(sid)
+    trace_id = TRACE_ID.get()
+    fast = await try_fast_path(req.message)
+    if fast is not None:
+        await push_session_message(sid, "user", req.message)
+        return StreamingResponse(
+            fast_path_events(fast, sid, trace_id, req.message, t0),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    async def events():
+        parts = []
+        answer = None
+        tool_calls = 0
+        ttft = None
+        # 并发名额在生成器内占用：生成器开始执行后，任何异常或客户端断开都会走到 finally 释放；
+        # 若在响应返回前占用，响应开始前出错或客户端断开时生成器不会执行，名额永久泄漏
+        try:
+            await chat_limiter.acquire()
+        except HTTPException as e:
+            yield sse_event("error", {"message": e.detail, "status": e.status_code, "trace_id": trace_id})
+            return
+        try:
+            prompt_msgs = await build_history(sid, await push_session_message(sid, "user", req.message))
+            # 与 Agent 的第一次 LLM 调用并行，推测式预取原始消息的 FAQ 检索结果
+            with mod.faq_prefetch(req.message):
+                async for ev in agent.astream_events({"messages": prompt_msgs}, config=AGENT_CONFIG, version="v2"):
+                    kind = ev["event"]
+                    if kind == "on_tool_start":
+                        yield sse_event("tool_start", {"name": ev["name"], "input": ev["data"].get("input")})
+                    elif kind == "on_tool_end":
+                        tool_calls += 1
+                        output = getattr(ev["data"].get("output"), "content", ev["data"].get("output"))
+                        yield sse_event("tool_end", {"name": ev["name"], "output": str(output)[:200]})
+                    elif kind == "on_chat_model_stream" and ev.get("metadata", {}).get("langgraph_node") == "model":
+                        text = ev["data"]["chunk"].content
+                        if isinstance(text, str) and text:
+                            if ttft is None:
+                                ttft = time.perf_counter() - t0
+                                observe_ttft(ttft)
+                            parts.append(text)
+                            yield sse_event("token", {"text": text})
+                    elif kind == "on_chain_end" and ev["name"] == agent.name and not ev.get("parent_ids"):
+                        answer = ev["data"]["output"]["messages"][-1].content
+            if answer is None:
+                answer = "".join(parts)
+            await push_session_message(sid, "assistant", answer)
+            yield sse_event("done", {"reply": answer, "session_id": sid, "trace_id": trace_id})
+            log_chat(trace_id, sid, req.message, answer, tool_calls, stream=True,
+                     ttft_ms=int(ttft * 1000) if ttft is not None else None)
+        except Exception as e:
+            yield sse_event("error", {"message": str(e), "trace_id": trace_id})
+        finally:
+            chat_limiter.release()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _merge_simple_counts(snaps):
+    """汇总各 worker 的简易计数（未安装 prometheus_client 时使用）"""
+    merged = {
+        "requests": {}, "latency_sum": {}, "latency_count": {}, "tool_calls": {},
+        "stage_latency_sum": {}, "stage_latency_count": {}, "llm_tokens": {},
+    }
+    ttft = [0.0, 0]
+    for snap in snaps:
+        simple = snap["simple"]
+        for field, counts in merged.items():
+            for *key, value in simple[field]:
+                counts[tuple(key)] = counts.get(tuple(key), 0) + value
+        ttft[0] += simple["ttft"][0]
+        ttft[1] += simple["ttft"][1]
+    return merged, ttft
+
+
+def _format_labels(labels) -> str:
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}" if labels else ""
+
+
 @app.get("/metrics")
 def metrics():
     if PROM:
-        data = generate_latest()
+        if MULTIPROC_DIR:
+            # 多 worker：prometheus_client 汇总各进程的 counter / histogram 文件，组件统计读快照
+            from prometheus_client import multiprocess
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+            registry.register(ComponentStatsCollector())
+            data = generate_latest(registry)
+        else:
+            data = generate_latest()
         return Response(content=data, media_type=CONTENT_TYPE_LATEST)
+    if MULTIPROC_DIR:
+        merged, (ttft_sum, ttft_count) = _merge_simple_counts(read_stats_snapshots().values())
+    else:
+        merged = {
+            "requests": SIMPLE_REQ_COUNT,
+            "latency_sum": REQUEST_LAT_SUM,
+            "latency_count": REQUEST_LAT_COUNT,
+            "tool_calls": SIMPLE_TOOL_CALLS,
+            "stage_latency_sum": STAGE_LAT_SUM,
+            "stage_latency_count": STAGE_LAT_COUNT,
+            "llm_tokens": SIMPLE_LLM_TOKENS,
+        }
+        ttft_sum, ttft_count = TTFT_SUM, TTFT_COUNT
     lines = []
     lines.append("# TYPE http_requests_total counter")
-    for (path, method, status), cnt in SIMPLE_REQ_COUNT.items():
+    for (path, method, status), cnt in merged["requests"].items():
         lines.append(f'http_requests_total{{path="{path}",method="{method}",status="{status}"}} {cnt}')
     lines.append("# TYPE http_request_latency_seconds summary")
-    for key, s in REQUEST_LAT_SUM.items():
-        c = REQUEST_LAT_COUNT.get(key, 0)
+    for key, s in merged["latency_sum"].items():
+        c = merged["latency_count"].get(key, 0)
         path, method = key
         lines.append(f'http_request_latency_seconds_sum{{path="{path}",method="{method}"}} {s}')
         lines.append(f'http_request_latency_seconds_count{{path="{path}",method="{method}"}} {c}')
     lines.append("# TYPE tool_calls_total counter")
-    for (tool, status), cnt in SIMPLE_TOOL_CALLS.items():
+    for (tool, status), cnt in merged["tool_calls"].items():
         lines.append(f'tool_calls_total{{tool="{tool}",status="{status}"}} {cnt}')
+    lines.append("# TYPE agent_stage_latency_seconds summary")
+    for key, s in merged["stage_latency_sum"].items():
+        c = merged["stage_latency_count"].get(key, 0)
+        stage, name = key
+        lines.append(f'agent_stage_latency_seconds_sum{{stage="{stage}",name="{name}"}} {s}')
+        lines.append(f'agent_stage_latency_seconds_count{{stage="{stage}",name="{name}"}} {c}')
+    lines.append("# TYPE llm_tokens_total counter")
+    for (model, kind), cnt in merged["llm_tokens"].items():
+        lines.append(f'llm_tokens_total{{model="{model}",kind="{kind}"}} {cnt}')
+    lines.append("# TYPE chat_time_to_first_token_seconds summary")
+    lines.append(f"chat_time_to_first_token_seconds_sum {ttft_sum}")
+    lines.append(f"chat_time_to_first_token_seconds_count {ttft_count}")
+    typed = set()
+    for name, kind, value, labels in iter_component_metrics():
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"{name}{_format_labels(labels)} {value}")
     return Response(content="\n".join(lines) + "\n", media_type=CONTENT_TYPE_LATEST)
 
 if __name__ == "__main__":
@@ -0,0 +1,93 @@
+"""
+api_server 多 worker 部署配置（gunicorn + UvicornWorker，preload 模式）
+用法（在项目根目录执行）：
+    pip install gunicorn
+    STORE_FORMAT=mmap python project/03/rag_qa_local_embedding.py --update   # 可选：索引改为 mmap 格式
+    gunicorn -c project/06/gunicorn.conf.py --chdir project/06 api_server:app
+
+说明：
+1. preload_app：master 进程导入 api_server 并加载 embedding 模型权重与 FAISS 索引（PRELOAD_ASSETS=1），
+   fork 后各 worker 写时复制共享；mmap 格式的索引通过操作系统页缓存共享
+2. 会话默认存入 SQLite（SESSION_STORE=sqlite），任一 worker 都能拿到完整的多轮上下文，不需要会话亲和
+3. 指标：prometheus_client 多进程模式（PROMETHEUS_MULTIPROC_DIR），/metrics 汇总所有 worker；
+   未安装 prometheus_client 时各 worker 把简易计数写到同一目录，由 /metrics 汇总；
+   worker 退出后，其统计快照中的累计值并入归档快照 stats_archived.json（仍参与求和），counter 不会因重启而回退
+4. CHAT_MAX_IN_FLIGHT 等并发限制按 worker 生效
+5. 日志：每个 worker 写各自的 logs/app-<pid>.jsonl（LOG_FILE_PER_WORKER=1），各自滚动，互不干扰；
+   重启后旧 worker 留下的文件由新 worker 按 LOG_BACKUP_COUNT 清理
+"""
+
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+bind = os.getenv("API_BIND", "127.0.0.1:8000")
+workers = int(os.getenv("API_WORKERS", str(os.cpu_count() or 1)))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+# agent 一次请求可能包含多次 LLM 调用
+timeout = int(os.getenv("API_WORKER_TIMEOUT", "120"))
+graceful_timeout = 30
+
+# 以下环境变量需在 master 导入 api_server（以及 prometheus_client）之前设置
+os.environ.setdefault("PRELOAD_ASSETS", "1")
+os.environ.setdefault("SESSION_STORE", "sqlite")
+os.environ.setdefault("LOG_FILE_PER_WORKER", "1")
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", str(Path(tempfile.gettempdir()) / "cust_service_api_metrics"))
+
+# 启动时清空上次运行留下的指标文件
+_multiproc_dir = Path(os.environ["PROMETHEUS_MULTIPROC_DIR"])
+shutil.rmtree(_multiproc_dir, ignore_errors=True)
+_multiproc_dir.mkdir(parents=True, exist_ok=True)
+
+
+def _merge_counts(old, new):
+    """合并 [[*标签, 值], ...] 形式的简易计数"""
+    counts = {tuple(key): value for *key, value in old}
+    for *key, value in new:
+        counts[tuple(key)] = counts.get(tuple(key), 0) + value
+    return [[*key, value] for key, value in counts.items()]
+
+
+def archive_stats_snapshot(path: Path) -> None:
+    """把已退出 worker 的统计快照并入归档快照：组件的 *_total 与简易计数累加保留，gauge 丢弃"""
+    try:
+        snap = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return
+    archive_path = _multiproc_dir / "stats_archived.json"
+    try:
+        archive = json.loads(archive_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        archive = {"components": {}}
+    for prefix, stats in snap.get("components", {}).items():
+        merged = archive["components"].setdefault(prefix, {})
+        for key, value in stats.items():
+            if key.endswith("_total"):
+                merged[key] = merged.get(key, 0) + value
+    if "simple" in snap:
+        simple = archive.setdefault("simple", {})
+        for field, value in snap["simple"].items():
+            if field == "ttft":
+                old = simple.get("ttft", [0.0, 0])
+                simple["ttft"] = [old[0] + value[0], old[1] + value[1]]
+            else:
+                simple[field] = _merge_counts(simple.get(field, []), value)
+    # 先写临时文件再替换，/metrics 读到的总是完整的归档
+    tmp = archive_path.with_name(archive_path.name + ".tmp")
+    tmp.write_text(json.dumps(archive, ensure_ascii=False), encoding="utf-8")
+    tmp.replace(archive_path)
+
+
+def child_exit(server, worker):
+    """worker 退出后清理它的 gauge 文件；统计快照中的累计值并入归档快照后删除（counter 不回退）"""
+    try:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+    except ImportError:
+        pass
+    path = _multiproc_dir / f"stats_{worker.pid}.json"
+    archive_stats_snapshot(path)
+    path.unlink(missing_ok=True)
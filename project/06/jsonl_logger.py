@@ -0,0 +1,246 @@
+"""
+非阻塞的 JSONL 日志：请求路径只把记录放进队列，后台线程批量序列化并写入文件
+功能：
+1. log() 不做 IO 也不等待：队列满时丢弃记录并计数，日志不会成为请求的尾延迟来源
+2. 后台线程攒批写入（达到批大小或超过刷新间隔即写），每批只 write + flush 一次
+3. 按大小和时间滚动：当前文件改名为 <文件名>.<时间戳>，可选 gzip 压缩（在独立线程中进行），只保留最近 N 个
+4. 统计队列深度、丢弃 / 写入条数、批次数、滚动次数，供 /metrics 输出
+
+多进程：后台线程不会跨 fork 存在，首次在新进程中写日志时重新创建队列与线程；
+多个 worker 不能滚动同一个文件：path 中可以包含 {pid}，在各进程首次写日志时替换为进程号，
+gunicorn 部署时每个 worker 写各自的文件（见 gunicorn.conf.py）。已退出的 worker 留下的文件（当前文件与已滚动的文件）
+在其他进程启动写日志线程及每次滚动时一并清理，与本进程已滚动的文件共用 backup_count 名额。
+"""
+
+import gzip
+import json
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+_STOP = object()
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class AsyncJsonlLogger:
+    def __init__(
+        self,
+        path,
+        max_bytes: int = 100 * 1024 * 1024,
+        rotate_seconds: float = 86400.0,
+        backup_count: int = 14,
+        compress: bool = True,
+        queue_size: int = 10000,
+        batch_size: int = 256,
+        flush_interval: float = 0.5,
+    ):
+        self._path_template = str(path)
+        self.path = Path(self._path_template.format(pid=os.getpid()))
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.backup_count = backup_count
+        self.compress = compress
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self._queue: Optional[queue.Queue] = None
+        self._thread: Optional[threading.Thread] = None
+        self._file = None
+        self._size = 0
+        self._opened_at = 0.0
+        self.dropped = 0
+        self.written = 0
+        self.batches = 0
+        self.rotations = 0
+        self.write_errors = 0
+
+    def log(self, record: Dict) -> bool:
+        """记录入队（不阻塞）；队列已满时丢弃并返回 False。入队后不要再修改 record"""
+        if self._pid != os.getpid():
+            self._start()
+        try:
+            self._queue.put_nowait(record)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _start(self) -> None:
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # fork 后父进程的线程不存在，继承来的计数也不属于本进程
+            self.path = Path(self._path_template.format(pid=os.getpid()))
+            self._queue = queue.Queue(self.queue_size)
+            self._file = None
+            self.dropped = self.written = self.batches = self.rotations = self.write_errors = 0
+            self._thread = threading.Thread(target=self._run, name="jsonl-logger", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def close(self, timeout: float = 5.0) -> None:
+        """写完队列中剩余的记录后停止后台线程"""
+        if self._pid != os.getpid() or self._thread is None:
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+        self._pid = None
+
+    def _run(self) -> None:
+        # 清理上一批已退出 worker 留下的文件，不必等到本进程第一次滚动
+        self._prune()
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while batch[-1] is not _STOP and len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            stop = batch[-1] is _STOP
+            if stop:
+                batch.pop()
+            if batch:
+                self._write(batch)
+            if stop:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                return
+
+    def _write(self, batch) -> None:
+        lines = []
+        for record in batch:
+            try:
+                lines.append(json.dumps(record, ensure_ascii=False, default=str))
+            except (TypeError, ValueError):
+                self.write_errors += 1
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        try:
+            if self._file is None:
+                self._open()
+            elif self._should_rotate(len(data)):
+                self._rotate()
+            self._file.write(data)
+            self._file.flush()
+            self._size += len(data)
+            self.written += len(lines)
+            self.batches += 1
+        except OSError:
+            self.write_errors += len(lines)
+
+    def _open(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = self.path.open("ab")
+        self._size = self._file.tell()
+        # 沿用已有文件时，按文件修改时间计算下一次按时间滚动的时刻
+        self._opened_at = self.path.stat().st_mtime if self._size else time.time()
+
+    def _should_rotate(self, incoming: int) -> bool:
+        if self._size and self._size + incoming > self.max_bytes:
+            return True
+        return self.rotate_seconds > 0 and time.time() - self._opened_at >= self.rotate_seconds
+
+    def _rotate(self) -> None:
+        self._file.close()
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        target = self.path.with_name(f"{self.path.name}.{stamp}")
+        same_second = [self._rotated_order(p)[1] for p in self.path.parent.glob(target.name + "*")]
+        if same_second:
+            # 同一秒内多次滚动时追加序号（取已有最大序号 + 1，避免与已清理的旧文件重名而乱序）
+            target = target.with_name(f"{target.name}.{max(same_second) + 1}")
+        self.path.replace(target)
+        self.rotations += 1
+        self._open()
+        if self.compress:
+            # 压缩较慢，放到独立线程，不阻塞后续写入
+            threading.Thread(target=self._compress, args=(target,), daemon=True).start()
+        else:
+            self._prune()
+
+    def _compress(self, path: Path) -> None:
+        tmp = path.with_name(path.name + ".gz.tmp")
+        try:
+            with path.open("rb") as src, gzip.open(tmp, "wb") as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            tmp.replace(path.with_name(path.name + ".gz"))
+            path.unlink()
+        except OSError:
+            tmp.unlink(missing_ok=True)
+        self._prune()
+
+    def _prune(self) -> None:
+        """只保留最近 backup_count 个已滚动的文件（连同已退出 worker 留下的文件一起计算）"""
+        rotated = [
+            (self._rotated_order(p), p)
+            for p in self.path.parent.glob(self.path.name + ".*") if not p.name.endswith(".tmp")
+        ]
+        for base in self._orphaned_names():
+            for p in self.path.parent.glob(base + "*"):
+                try:
+                    if p.name.endswith(".tmp"):
+                        # 压缩到一半时进程退出留下的临时文件
+                        p.unlink(missing_ok=True)
+                    elif p.name == base:
+                        # 未滚动的当前文件按最后写入时间排序
+                        rotated.append(((time.strftime("%Y%m%d-%H%M%S", time.localtime(p.stat().st_mtime)), 0), p))
+                    else:
+                        rotated.append((self._rotated_order(p, base), p))
+                except OSError:
+                    # 其他 worker 同时在清理
+                    continue
+        rotated.sort(key=lambda item: item[0])
+        for _, old in rotated[:-self.backup_count] if self.backup_count > 0 else []:
+            old.unlink(missing_ok=True)
+
+    def _orphaned_names(self):
+        """已退出的其他进程的日志文件名（文件名不含 {pid} 时为空）"""
+        name = Path(self._path_template).name
+        if "{pid}" not in name:
+            return []
+        prefix, suffix = name.split("{pid}", 1)
+        pattern = re.compile(re.escape(prefix) + r"(\d+)" + re.escape(suffix) + r"(?:\..*)?$")
+        pids = set()
+        for p in self.path.parent.glob(prefix + "*" + suffix + "*"):
+            m = pattern.match(p.name)
+            if m and int(m.group(1)) != os.getpid():
+                pids.add(int(m.group(1)))
+        return [f"{prefix}{pid}{suffix}" for pid in sorted(pids) if not _pid_alive(pid)]
+
+    def _rotated_order(self, path: Path, base: Optional[str] = None):
+        # <文件名>.<时间戳>[.<序号>][.gz]：先按时间戳，同一秒内再按序号
+        parts = path.name[len(base or self.path.name) + 1:].removesuffix(".gz").split(".")
+        return parts[0], int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 0
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "queue_capacity": self.queue_size,
+            "dropped_total": self.dropped,
+            "written_total": self.written,
+            "batches_total": self.batches,
+            "rotations_total": self.rotations,
+            "write_errors_total": self.write_errors,
+        }
@@ -0,0 +1,465 @@
+"""
+api_server 日志分析：流式读取一个或多个 JSONL 日志（含滚动后的 .gz 文件），内存占用与日志大小无关
+用法（在项目根目录执行）：
+    python project/06/log_analytics.py                          # 默认分析 project/logs/app*.jsonl*
+    python project/06/log_analytics.py logs/app-*.jsonl* --workers 8 --top 20
+    python project/06/log_analytics.py logs/app.jsonl --json > report.json
+
+功能：
+1. 按路径统计请求数、5xx 数与延迟 p50/p90/p99（对数分桶的可合并分位数草图，相对误差默认 1%）
+2. 按会话统计对话请求数（Misra-Gries 高频项，只保留计数最高的会话，报告计数误差上限）
+3. tool_calls_count 分布
+4. 按 trace_id 关联 access 与 chat 记录，按工具调用次数统计 /chat 延迟
+5. 未压缩的大文件按字节范围切块、多进程并行处理，各块结果（草图、计数、未关联的记录）最后合并
+
+说明：安装了 orjson 时用它解析 JSON（快数倍），否则用标准库 json。
+"""
+
+import argparse
+import glob
+import gzip
+import json
+import math
+import os
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+DEFAULT_LOG_GLOB = str(Path(__file__).resolve().parents[1] / "logs" / "app*.jsonl*")
+# 未压缩文件按此大小切块并行处理
+CHUNK_BYTES = 64 * 1024 * 1024
+# 需要与 chat 记录关联的 access 路径
+CHAT_PATHS = ("/chat", "/chat/stream")
+# 工具调用次数分组的上限（>= 该值归为一组）
+TOOL_CALLS_CAP = 10
+
+
+class LatencySketch:
+    """对数分桶的分位数草图（DDSketch 思路）
+
+    桶 i 覆盖 (gamma^(i-1), gamma^i]，分位数的相对误差不超过 relative_accuracy；
+    桶数只与取值范围有关，两个草图合并即桶计数相加。
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins: Dict[int, int] = {}
+        self.zero = 0
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        # 日志中的延迟是整数毫秒，缓存取值 -> 桶号，省去大部分 log 计算
+        self._index_cache: Dict[float, int] = {}
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+        if value <= 0:
+            self.zero += 1
+            return
+        index = self._index_cache.get(value)
+        if index is None:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            if len(self._index_cache) < 100000:
+                self._index_cache[value] = index
+        self.bins[index] = self.bins.get(index, 0) + 1
+
+    def merge(self, other: "LatencySketch") -> None:
+        for index, n in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + n
+        self.zero += other.zero
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * (self.count - 1)
+        seen = self.zero
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if rank < seen:
+                # 取桶的中点，使上下两侧的相对误差相等
+                return min(2 * self.gamma ** index / (self.gamma + 1), self.max)
+        return self.max
+
+    def __getstate__(self):
+        # 多进程回传结果时不需要带上缓存
+        state = dict(self.__dict__)
+        state["_index_cache"] = {}
+        return state
+
+
+class HeavyHitters:
+    """Misra-Gries 高频项：最多跟踪 2 * capacity 个键，超出时统一扣减并淘汰低频键
+
+    估计值偏小，误差不超过 error（累计扣减量）；两个结果合并为计数相加后再裁剪。
+    """
+
+    def __init__(self, capacity: int = 1000):
+        self.capacity = capacity
+        self.counts: Dict[str, int] = {}
+        self.error = 0
+        self.total = 0
+
+    def add(self, key: str, n: int = 1) -> None:
+        self.total += n
+        self.counts[key] = self.counts.get(key, 0) + n
+        if len(self.counts) > 2 * self.capacity:
+            self._reduce()
+
+    def merge(self, other: "HeavyHitters") -> None:
+        for key, n in other.counts.items():
+            self.counts[key] = self.counts.get(key, 0) + n
+        self.total += other.total
+        self.error += other.error
+        if len(self.counts) > 2 * self.capacity:
+            self._reduce()
+
+    def _reduce(self) -> None:
+        # 扣减第 capacity + 1 大的计数，只剩下计数更高的键
+        cut = sorted(self.counts.values(), reverse=True)[self.capacity]
+        self.error += cut
+        self.counts = {k: n - cut for k, n in self.counts.items() if n > cut}
+
+    def top(self, n: int) -> List[Tuple[str, int]]:
+        return sorted(self.counts.items(), key=lambda kv: kv[1], reverse=True)[:n]
+
+
+class PathStats:
+    def __init__(self, relative_accuracy: float):
+        self.latency = LatencySketch(relative_accuracy)
+        self.errors = 0
+
+    def merge(self, other: "PathStats") -> None:
+        self.latency.merge(other.latency)
+        self.errors += other.errors
+
+
+class LogStats:
+    """单个数据块（或合并后全部日志）的统计结果"""
+
+    def __init__(self, relative_accuracy: float = 0.01, session_capacity: int = 1000, max_pending: int = 100000):
+        self.relative_accuracy = relative_accuracy
+        self.max_pending = max_pending
+        self.lines = 0
+        self.bad_lines = 0
+        self.types: Dict[str, int] = {}
+        self.paths: Dict[str, PathStats] = {}
+        self.sessions = HeavyHitters(session_capacity)
+        self.tool_calls: Counter = Counter()
+        self.streamed = 0
+        self.coalesced = 0
+        self.fast_path = 0
+        # 按工具调用次数分组的 /chat 延迟（access 与 chat 关联后）
+        self.chat_latency: Dict[int, LatencySketch] = {}
+        self.joined = 0
+        self.unmatched_access = 0
+        self.unmatched_chat = 0
+        # 等待关联的记录：trace_id -> 延迟毫秒 / 工具调用次数；按到达顺序淘汰，内存有上限
+        self.pending_access: "OrderedDict[str, float]" = OrderedDict()
+        self.pending_chat: "OrderedDict[str, int]" = OrderedDict()
+        self.first_ts = ""
+        self.last_ts = ""
+
+    def feed(self, rec: Dict) -> None:
+        kind = rec.get("type")
+        self.types[kind] = self.types.get(kind, 0) + 1
+        if kind == "access":
+            path = rec.get("path", "")
+            stats = self.paths.get(path)
+            if stats is None:
+                stats = self.paths[path] = PathStats(self.relative_accuracy)
+            latency = rec.get("latency_ms", 0)
+            stats.latency.add(latency)
+            if rec.get("status", 0) >= 500:
+                stats.errors += 1
+            if path in CHAT_PATHS:
+                self._join_access(rec.get("trace_id", ""), latency)
+        elif kind == "chat":
+            self.sessions.add(rec.get("session_id") or "default")
+            tool_calls = rec.get("tool_calls_count", 0)
+            self.tool_calls[tool_calls] += 1
+            if rec.get("stream"):
+                self.streamed += 1
+            if rec.get("coalesced"):
+                self.coalesced += 1
+            if rec.get("fast_path"):
+                self.fast_path += 1
+            self._join_chat(rec.get("trace_id", ""), tool_calls)
+
+    def _join_access(self, trace_id: str, latency: float) -> None:
+        tool_calls = self.pending_chat.pop(trace_id, None)
+        if tool_calls is not None:
+            self._record_join(tool_calls, latency)
+            return
+        self.pending_access[trace_id] = latency
+        if len(self.pending_access) > self.max_pending:
+            self.pending_access.popitem(last=False)
+            self.unmatched_access += 1
+
+    def _join_chat(self, trace_id: str, tool_calls: int) -> None:
+        latency = self.pending_access.pop(trace_id, None)
+        if latency is not None:
+            self._record_join(tool_calls, latency)
+            return
+        self.pending_chat[trace_id] = tool_calls
+        if len(self.pending_chat) > self.max_pending:
+            self.pending_chat.popitem(last=False)
+            self.unmatched_chat += 1
+
+    def _record_join(self, tool_calls: int, latency: float) -> None:
+        key = min(tool_calls, TOOL_CALLS_CAP)
+        sketch = self.chat_latency.get(key)
+        if sketch is None:
+            sketch = self.chat_latency[key] = LatencySketch(self.relative_accuracy)
+        sketch.add(latency)
+        self.joined += 1
+
+    def merge(self, other: "LogStats") -> None:
+        """合并另一块的结果；两块边界两侧的 access / chat 记录在这里完成关联"""
+        self.lines += other.lines
+        self.bad_lines += other.bad_lines
+        for kind, n in other.types.items():
+            self.types[kind] = self.types.get(kind, 0) + n
+        for path, stats in other.paths.items():
+            if path in self.paths:
+                self.paths[path].merge(stats)
+            else:
+                self.paths[path] = stats
+        self.sessions.merge(other.sessions)
+        self.tool_calls.update(other.tool_calls)
+        self.streamed += other.streamed
+        self.coalesced += other.coalesced
+        self.fast_path += other.fast_path
+        for key, sketch in other.chat_latency.items():
+            if key in self.chat_latency:
+                self.chat_latency[key].merge(sketch)
+            else:
+                self.chat_latency[key] = sketch
+        self.joined += other.joined
+        self.unmatched_access += other.unmatched_access
+        self.unmatched_chat += other.unmatched_chat
+        for trace_id, latency in other.pending_access.items():
+            self._join_access(trace_id, latency)
+        for trace_id, tool_calls in other.pending_chat.items():
+            self._join_chat(trace_id, tool_calls)
+        if other.first_ts and (not self.first_ts or other.first_ts < self.first_ts):
+            self.first_ts = other.first_ts
+        self.last_ts = max(self.last_ts, other.last_ts)
+
+    def report(self, top: int = 10) -> Dict:
+        def summary(sketch: LatencySketch) -> Dict:
+            return {
+                "count": sketch.count,
+                "mean_ms": round(sketch.sum / sketch.count, 1) if sketch.count else 0.0,
+                "p50_ms": round(sketch.quantile(0.5), 1),
+                "p90_ms": round(sketch.quantile(0.9), 1),
+                "p99_ms": round(sketch.quantile(0.99), 1),
+                "max_ms": sketch.max,
+            }
+
+        return {
+            "lines": self.lines,
+            "bad_lines": self.bad_lines,
+            "time_range": [self.first_ts, self.last_ts],
+            "types": dict(self.types),
+            "paths": {
+                path: dict(summary(stats.latency), errors_5xx=stats.errors)
+                for path, stats in sorted(self.paths.items(), key=lambda kv: kv[1].latency.count, reverse=True)
+            },
+            "sessions": {
+                "chat_requests": self.sessions.total,
+                "count_error_bound": self.sessions.error,
+                "top": self.sessions.top(top),
+            },
+            "tool_calls": {
+                "distribution": {str(k): n for k, n in sorted(self.tool_calls.items())},
+                "streamed": self.streamed,
+                "coalesced": self.coalesced,
+                "fast_path": self.fast_path,
+            },
+            "chat_latency_by_tool_calls": {
+                (f"{k}+" if k == TOOL_CALLS_CAP else str(k)): summary(s) for k, s in sorted(self.chat_latency.items())
+            },
+            "join": {
+                "joined": self.joined,
+                "unmatched_access": self.unmatched_access + len(self.pending_access),
+                "unmatched_chat": self.unmatched_chat + len(self.pending_chat),
+            },
+        }
+
+
+def iter_lines(path: str, start: int = 0, end: Optional[int] = None) -> Iterable[bytes]:
+    """逐行读取；给定 [start, end) 时只返回起始位置落在该范围内的行（首尾不完整的行归相邻块）"""
+    if path.endswith(".gz"):
+        with gzip.open(path, "rb") as f:
+            yield from f
+        return
+    with open(path, "rb", buffering=1024 * 1024) as f:
+        if start:
+            # 从 start - 1 读到行尾：若 start 恰为行首，只会读掉上一行的换行符
+            f.seek(start - 1)
+            f.readline()
+        pos = f.tell()
+        for line in f:
+            if end is not None and pos >= end:
+                break
+            pos += len(line)
+            yield line
+
+
+def analyze_chunk(task: Tuple[str, int, Optional[int]], relative_accuracy: float = 0.01,
+                  session_capacity: int = 1000, max_pending: int = 100000) -> LogStats:
+    path, start, end = task
+    stats = LogStats(relative_accuracy, session_capacity, max_pending)
+    feed = stats.feed
+    lines = bad = 0
+    first = last = None
+    for line in iter_lines(path, start, end):
+        lines += 1
+        try:
+            rec = _loads(line)
+        except ValueError:
+            # 写入中途被截断的最后一行等
+            bad += 1
+            continue
+        if isinstance(rec, dict):
+            feed(rec)
+            if first is None:
+                first = rec
+            last = rec
+        else:
+            bad += 1
+    stats.lines = lines
+    stats.bad_lines = bad
+    # 单个日志文件按时间顺序追加，块内时间范围取首尾两条即可
+    if first is not None:
+        stats.first_ts = first.get("timestamp", "")
+        stats.last_ts = last.get("timestamp", "")
+    return stats
+
+
+def _rotated_order(path: str):
+    """app.jsonl.<时间戳>[.<序号>][.gz] 按时间先后排序，当前文件排在最后"""
+    name = Path(path).name
+    base, _, suffix = name.partition(".jsonl")
+    parts = suffix.lstrip(".").removesuffix(".gz").split(".") if suffix else []
+    if not parts or not parts[0]:
+        return base, "~", 0
+    return base, parts[0], int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 0
+
+
+def resolve_paths(patterns: List[str]) -> List[str]:
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "*.jsonl*")
+        matched = glob.glob(pattern) if glob.has_magic(pattern) else [pattern]
+        paths.extend(p for p in matched if os.path.isfile(p) and not p.endswith(".tmp"))
+    # 同一日志的各个滚动文件按时间顺序处理，跨文件的 access / chat 记录也能关联
+    return sorted(set(paths), key=_rotated_order)
+
+
+def make_tasks(paths: List[str], chunk_bytes: int = CHUNK_BYTES) -> List[Tuple[str, int, Optional[int]]]:
+    tasks = []
+    for path in paths:
+        size = os.path.getsize(path)
+        if path.endswith(".gz") or size <= chunk_bytes:
+            tasks.append((path, 0, None))
+            continue
+        for start in range(0, size, chunk_bytes):
+            tasks.append((path, start, min(start + chunk_bytes, size)))
+    return tasks
+
+
+def analyze(paths: List[str], workers: int = 1, relative_accuracy: float = 0.01,
+            session_capacity: int = 1000, max_pending: int = 100000, chunk_bytes: int = CHUNK_BYTES) -> LogStats:
+    tasks = make_tasks(paths, chunk_bytes)
+    total = LogStats(relative_accuracy, session_capacity, max_pending)
+    args = (relative_accuracy, session_capacity, max_pending)
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(min(workers, len(tasks))) as pool:
+            # map 按任务顺序返回，块按文件内的先后顺序合并
+            for stats in pool.map(analyze_chunk, tasks, *[[a] * len(tasks) for a in args]):
+                total.merge(stats)
+    else:
+        for task in tasks:
+            total.merge(analyze_chunk(task, *args))
+    return total
+
+
+def print_report(report: Dict, elapsed: float, nbytes: int) -> None:
+    print(f"共 {report['lines']} 行（解析失败 {report['bad_lines']} 行），{nbytes / 1e6:.1f} MB，"
+          f"耗时 {elapsed:.2f}s（{nbytes / 1e6 / max(elapsed, 1e-9):.0f} MB/s）")
+    print(f"时间范围：{report['time_range'][0]} ~ {report['time_range'][1]}")
+    print("记录类型：" + ", ".join(f"{k}={v}" for k, v in report["types"].items()))
+
+    header = f"{'count':>9} {'5xx':>6} {'mean_ms':>9} {'p50_ms':>9} {'p90_ms':>9} {'p99_ms':>9} {'max_ms':>9}"
+    print(f"\n按路径：\n{'path':<24} {header}")
+    for path, s in report["paths"].items():
+        print(f"{path:<24} {s['count']:>9} {s['errors_5xx']:>6} {s['mean_ms']:>9} "
+              f"{s['p50_ms']:>9} {s['p90_ms']:>9} {s['p99_ms']:>9} {s['max_ms']:>9}")
+
+    sessions = report["sessions"]
+    print(f"\n对话请求最多的会话（共 {sessions['chat_requests']} 次对话请求，计数误差 <= {sessions['count_error_bound']}）：")
+    for sid, n in sessions["top"]:
+        print(f"  {sid:<40} {n:>8}")
+
+    tools = report["tool_calls"]
+    total = sum(tools["distribution"].values()) or 1
+    print(f"\n工具调用次数分布（流式 {tools['streamed']}，合并执行 {tools['coalesced']}，"
+          f"快速路径 {tools['fast_path']}，占 {tools['fast_path'] / total:.1%}）：")
+    for k, n in tools["distribution"].items():
+        print(f"  {k:>3} 次 {n:>9} {n / total:>7.1%}")
+
+    join = report["join"]
+    print(f"\n按工具调用次数的 /chat 延迟（关联 {join['joined']}，未关联 access {join['unmatched_access']} / "
+          f"chat {join['unmatched_chat']}）：\n{'tool_calls':<10} {'count':>9} {'mean_ms':>9} {'p50_ms':>9} {'p90_ms':>9} {'p99_ms':>9}")
+    for k, s in report["chat_latency_by_tool_calls"].items():
+        print(f"{k:<10} {s['count']:>9} {s['mean_ms']:>9} {s['p50_ms']:>9} {s['p90_ms']:>9} {s['p99_ms']:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="api_server JSONL 日志分析（流式、常数内存、多进程）")
+    parser.add_argument("paths", nargs="*", default=[DEFAULT_LOG_GLOB], help="日志文件、目录或通配符（支持 .gz）")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="并行进程数")
+    parser.add_argument("--top", type=int, default=10, help="输出对话请求最多的前 N 个会话")
+    parser.add_argument("--accuracy", type=float, default=0.01, help="分位数相对误差")
+    parser.add_argument("--session-capacity", type=int, default=1000, help="跟踪的高频会话数")
+    parser.add_argument("--max-pending", type=int, default=100000, help="等待关联的 access / chat 记录上限（每块）")
+    parser.add_argument("--chunk-mb", type=int, default=CHUNK_BYTES // (1024 * 1024), help="未压缩文件的切块大小")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    paths = resolve_paths(args.paths)
+    if not paths:
+        parser.error(f"没有找到日志文件：{' '.join(args.paths)}")
+    t0 = time.perf_counter()
+    stats = analyze(paths, args.workers, args.accuracy, args.session_capacity, args.max_pending,
+                    args.chunk_mb * 1024 * 1024)
+    report = stats.report(args.top)
+    elapsed = time.perf_counter() - t0
+    if args.json:
+        print(json.dumps(dict(report, files=paths), ensure_ascii=False, indent=2))
+    else:
+        print_report(report, elapsed, sum(os.path.getsize(p) for p in paths))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,7 @@ LangGraph 基础示例：最小版 langgraph_agent 框架
 功能目标（对应学习文档第 9 阶段）：
 - 定义 AgentState（包含 messages）
 - 创建 call_model 节点：调用 LLM
-- 创建 tool_node 节点：执行工具（使用 LangGraph 预置 ToolNode）
+- 创建 tool_node 节点：执行工具（同一条 AI 消息中的多个工具调用并发执行，带超时，见 05/tool_executor.py）
 - 定义图结构：
   START -> call_model
   call_model -> (判断是否调用工具) -> tool_node / END
@@ -14,16 +14,18 @@ LangGraph 基础示例：最小版 langgraph_agent 框架
 
 from __future__ import annotations
 
+import importlib.util
 import os
+from pathlib import Path
 from typing import Annotated, List, TypedDict
 
 from dotenv import load_dotenv
 from langchain.chat_models import init_chat_model
 from langchain_core.messages import AnyMessage, HumanMessage, SystemMessage
+from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import tool
 from langgraph.graph import END, StateGraph
 from langgraph.graph.message import add_messages
-from langgraph.prebuilt import ToolNode
 
 
 # ===== 0. 初始化模型 =====
@@ -69,7 +71,31 @@ def simple_calculator(expression: str) -> str:
 
 
 TOOLS = [simple_calculator]
-tool_node = ToolNode(TOOLS)
+TOOLS_BY_NAME = {t.name: t for t in TOOLS}
+
+# 工具执行器与 05 的客服 Agent 共用同一实现
+_executor_file = Path(__file__).resolve().parents[1] / "05" / "tool_executor.py"
+_spec = importlib.util.spec_from_file_location("tool_executor", _executor_file)
+tool_executor = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(tool_executor)
+
+_executor = tool_executor.ToolCallExecutor(
+    max_workers=int(os.getenv("TOOL_MAX_WORKERS", "16")),
+    default_timeout=float(os.getenv("TOOL_TIMEOUT", "30")),
+    timeouts=tool_executor.parse_timeouts(os.getenv("TOOL_TIMEOUTS", "")),
+)
+
+
+def tool_node(state: AgentState, config: RunnableConfig) -> AgentState:
+    """
+    执行最后一条 AI 消息中的全部工具调用。
+
+    - 多个调用并发执行（有界线程池），一轮耗时约等于最慢的那个工具
+    - 超时或出错的调用返回 status="error" 的 ToolMessage，模型可以据此换个方式回答
+    - 返回的 ToolMessage 顺序与 tool_calls 顺序一致
+    """
+    tool_calls = state["messages"][-1].tool_calls
+    return {"messages": _executor.run_tool_calls(tool_calls, TOOLS_BY_NAME, config)}
 
 
 # ===== 3. 定义调用模型的节点 =====
@@ -0,0 +1,107 @@
+"""
+FAQ 相关度阈值标定：在标注好的问题集上扫描 FAQ_MIN_RELEVANCE，权衡误拒与省下的模型调用
+用法：
+    python project/eval/calibrate_faq_threshold.py
+    python project/eval/calibrate_faq_threshold.py --cases tests/faq_relevance.json --min-recall 0.95 --step 0.01
+
+说明：
+- 问题集为 JSON 列表，每条 {"question": ..., "in_scope": true/false}，in_scope 表示 FAQ 文档中有答案
+- 每个问题按 faq_rag_tool 相同的方式检索（invoke_with_score），取最相关片段的余弦相似度；
+  BM25 稀疏快速路径不计算相似度，任何阈值下都视为相关
+- 对每个阈值输出：知识库内问题的保留率（recall）、知识库外问题的拒答率、整体准确率、可省去的模型调用比例
+- 推荐值：在保留率不低于 --min-recall 的前提下拒答率最高的阈值（取其中最大者）
+"""
+
+import argparse
+import importlib.util
+import json
+from pathlib import Path
+
+import numpy as np
+from dotenv import load_dotenv
+
+
+def load_agent_module(agent_file: Path):
+    spec = importlib.util.spec_from_file_location("cust_service_agent_cli", agent_file)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def score_cases(retriever, cases):
+    """返回 [(问题, 是否在知识库内, 相似度或 None)]"""
+    scored = []
+    for case in cases:
+        _, score = retriever.invoke_with_score(case["question"])
+        scored.append((case["question"], bool(case["in_scope"]), score))
+    return scored
+
+
+def sweep(scored, thresholds):
+    """每个阈值下的 (阈值, 保留率, 拒答率, 准确率, 拒答比例)"""
+    in_scope = [s for _, label, s in scored if label]
+    out_scope = [s for _, label, s in scored if not label]
+    rows = []
+    for t in thresholds:
+        kept_in = sum(1 for s in in_scope if s is None or s >= t)
+        rejected_out = sum(1 for s in out_scope if s is not None and s < t)
+        rejected = sum(1 for _, _, s in scored if s is not None and s < t)
+        rows.append((
+            float(t),
+            kept_in / len(in_scope) if in_scope else 1.0,
+            rejected_out / len(out_scope) if out_scope else 0.0,
+            (kept_in + rejected_out) / len(scored),
+            rejected / len(scored),
+        ))
+    return rows
+
+
+def recommend(rows, min_recall: float):
+    candidates = [r for r in rows if r[1] >= min_recall]
+    if not candidates:
+        return None
+    best = max(r[2] for r in candidates)
+    return max(r[0] for r in candidates if r[2] == best)
+
+
+def main():
+    root = Path(__file__).resolve().parents[2]
+    parser = argparse.ArgumentParser(description="FAQ 相关度阈值标定")
+    parser.add_argument("--cases", type=Path, default=root / "tests" / "faq_relevance.json", help="标注问题集")
+    parser.add_argument("--min-recall", type=float, default=0.95, help="知识库内问题的最低保留率")
+    parser.add_argument("--step", type=float, default=0.02, help="阈值扫描步长")
+    parser.add_argument("--show-scores", action="store_true", help="打印每个问题的相似度")
+    args = parser.parse_args()
+
+    load_dotenv()
+    mod = load_agent_module(root / "project" / "05" / "cust_service_agent_cli.py")
+    cases = json.loads(args.cases.read_text(encoding="utf-8"))
+    scored = score_cases(mod.get_retriever(), cases)
+
+    if args.show_scores:
+        for question, label, score in sorted(scored, key=lambda x: (x[2] is None, x[2] or 0.0)):
+            shown = "BM25" if score is None else f"{score:.3f}"
+            print(f"{shown:>6} {'知识库内' if label else '知识库外'}  {question}")
+        print()
+
+    scores = [s for _, _, s in scored if s is not None]
+    if not scores:
+        print("所有问题都走了 BM25 稀疏快速路径，阈值不起作用")
+        return
+    thresholds = np.arange(np.floor(min(scores) / args.step) * args.step, max(scores) + args.step, args.step)
+    rows = sweep(scored, thresholds)
+    print(f"{'threshold':>9} {'recall':>7} {'reject_out':>10} {'accuracy':>8} {'skip_llm':>8}")
+    for t, recall, reject_out, accuracy, skipped in rows:
+        print(f"{t:>9.2f} {recall:>7.2f} {reject_out:>10.2f} {accuracy:>8.2f} {skipped:>8.2f}")
+
+    n_in = sum(1 for _, label, _ in scored if label)
+    print(f"\n问题数: {len(scored)}（知识库内 {n_in}，知识库外 {len(scored) - n_in}），当前 FAQ_MIN_RELEVANCE={mod.FAQ_MIN_RELEVANCE:g}")
+    threshold = recommend(rows, args.min_recall)
+    if threshold is None:
+        print(f"没有阈值能保证知识库内问题的保留率 ≥ {args.min_recall:g}，建议保持关闭（0）")
+    else:
+        print(f"推荐 FAQ_MIN_RELEVANCE={threshold:.2f}（保留率 ≥ {args.min_recall:g} 时拒答率最高）")
+
+
+if __name__ == "__main__":
+    main()
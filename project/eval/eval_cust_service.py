@@ -1,5 +1,7 @@
+import argparse
 import json
 import os
+import time
 from pathlib import Path
 from datetime import datetime
 from dotenv import load_dotenv
@@ -21,7 +23,15 @@ def evaluate_case(agent, case, session_messages):
     for m in messages:
         session_messages.append(m)
     session_messages.append({"role": "assistant", "content": answer})
-    return answer
+    return answer, count_turns(result["messages"][len(merged):])
+
+def count_turns(new_messages):
+    """本次执行的 LLM 调用轮数（AI 消息条数）与工具调用次数"""
+    llm_turns = sum(1 for m in new_messages if getattr(m, "type", None) == "ai")
+    tool_calls = sum(1 for m in new_messages if getattr(m, "type", None) == "tool")
+    faq_calls = sum(1 for m in new_messages
+                    if getattr(m, "type", None) == "tool" and getattr(m, "name", None) == "faq_rag_tool")
+    return {"llm_turns": llm_turns, "tool_calls": tool_calls, "faq_calls": faq_calls}
 
 def keyword_hits(text, keywords):
     hits = []
@@ -30,7 +40,74 @@ def keyword_hits(text, keywords):
             hits.append(k)
     return hits
 
+def load_agent_module(agent_file: Path, faq_rag_mode: str = ""):
+    """通过 importlib 动态加载被测 Agent 模块；指定 faq_rag_mode 时先设置 FAQ_RAG_MODE（模块导入时读取）"""
+    if faq_rag_mode:
+        os.environ["FAQ_RAG_MODE"] = faq_rag_mode
+    spec = importlib.util.spec_from_file_location("cust_service_agent_cli", agent_file)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+def run_cases(mod, cases, wf):
+    """用一个新的 Agent 与评估会话跑完全部用例，逐条写出 JSONL，返回记录列表"""
+    # 调用模块内的工厂函数，创建一个可交互的客服 Agent 实例
+    agent = mod.create_customer_service_agent()
+    # 单个评估会话的消息历史（模拟连续对话场景；如需独立会话可为每条用例创建新列表）
+    session_messages = []
+    results = []
+    # 逐条用例执行评估：调用 Agent → 收集回答与耗时 → 进行关键词命中统计 → 写出 JSONL
+    for case in cases:
+        cid = case.get("id", "")
+        t0 = time.perf_counter()
+        answer, turns = evaluate_case(agent, case, session_messages)
+        latency_ms = (time.perf_counter() - t0) * 1000
+        keys = case.get("expect_keywords", [])
+        hits = keyword_hits(answer, keys)
+        record = {
+            "id": cid,
+            "answer_length": len(answer),
+            "expect_keywords": keys,
+            "hit_keywords": hits,
+            "hit_count": len(hits),
+            "hit_rate": (len(hits) / len(keys)) if keys else 0.0,
+            "multi_order": case.get("multi_order", False),
+            "batch_tools_enabled": mod.BATCH_TOOLS_ENABLED,
+            "faq_rag_mode": mod.FAQ_RAG_MODE,
+            "latency_ms": latency_ms,
+            **turns,
+            "answer": answer
+        }
+        wf.write(json.dumps(record, ensure_ascii=False) + "\n")
+        results.append(record)
+    return results
+
+def _avg(records, key):
+    return sum(r[key] for r in records) / len(records) if records else 0.0
+
+def summarize(results):
+    """简单统计：整体、多订单用例、调用了 FAQ 工具的用例"""
+    multi = [r for r in results if r["multi_order"]]
+    faq = [r for r in results if r["faq_calls"]]
+    return {
+        "total_cases": len(results),
+        "avg_answer_length": _avg(results, "answer_length"),
+        "avg_hit_rate": _avg(results, "hit_rate"),
+        "avg_llm_turns": _avg(results, "llm_turns"),
+        "avg_latency_ms": _avg(results, "latency_ms"),
+        "multi_order_cases": len(multi),
+        "multi_order_avg_llm_turns": _avg(multi, "llm_turns"),
+        "multi_order_avg_tool_calls": _avg(multi, "tool_calls"),
+        "faq_cases": len(faq),
+        "faq_avg_hit_rate": _avg(faq, "hit_rate"),
+        "faq_avg_latency_ms": _avg(faq, "latency_ms"),
+    }
+
 def main():
+    parser = argparse.ArgumentParser(description="客服 Agent 评估")
+    parser.add_argument("--faq-modes", nargs="+", choices=["answer", "context"], default=[],
+                        help="依次以这些 FAQ_RAG_MODE 运行全部用例并对比（默认使用环境变量中的模式）")
+    args = parser.parse_args()
     # 加载环境变量（例如 API_KEY、BASE_URL），确保被被测 Agent 初始化时可用
     load_dotenv()
     # 计算仓库根目录：当前文件在 project/eval/ 目录下，向上两级即为仓库根
@@ -46,49 +123,29 @@ def main():
     ensure_dir(out_dir)
     # 输出文件名包含时间戳，避免覆盖历史
     out_file = out_dir / f"eval_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl"
-    # 通过 importlib 动态加载被测 Agent 模块，避免对项目结构的硬编码依赖
-    spec = importlib.util.spec_from_file_location("cust_service_agent_cli", agent_file)
-    mod = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(mod)
-    # 调用模块内的工厂函数，创建一个可交互的客服 Agent 实例
-    agent = mod.create_customer_service_agent()
     # 加载测试用例列表
     cases = load_cases(cases_path)
-    # 单个评估会话的消息历史（模拟连续对话场景；如需独立会话可为每条用例创建新列表）
-    session_messages = []
-    # 汇总结果（用于计算简单统计）
-    results = []
-    # 逐条用例执行评估：调用 Agent → 收集回答 → 进行关键词命中统计 → 写出 JSONL
+    # 每种 FAQ 模式重新加载一次被测模块（模式在导入时读取，各模式的缓存互不影响）
+    summaries = {}
     with out_file.open("w", encoding="utf-8") as wf:
-        for case in cases:
-            cid = case.get("id", "")
-            answer = evaluate_case(agent, case, session_messages)
-            keys = case.get("expect_keywords", [])
-            hits = keyword_hits(answer, keys)
-            record = {
-                "id": cid,
-                "answer_length": len(answer),
-                "expect_keywords": keys,
-                "hit_keywords": hits,
-                "hit_count": len(hits),
-                "hit_rate": (len(hits) / len(keys)) if keys else 0.0,
-                "answer": answer
-            }
-            wf.write(json.dumps(record, ensure_ascii=False) + "\n")
-            results.append(record)
-    # 计算并打印简单统计（用例数、平均回答长度、平均关键词命中率），便于快速评估质量
-    total = len(results)
-    avg_len = sum(r["answer_length"] for r in results) / total if total else 0
-    avg_hit = sum(r["hit_rate"] for r in results) / total if total else 0.0
-    summary = {
-        "total_cases": total,
-        "avg_answer_length": avg_len,
-        "avg_hit_rate": avg_hit
-    }
+        for faq_mode in args.faq_modes or [""]:
+            mod = load_agent_module(agent_file, faq_mode)
+            summaries[mod.FAQ_RAG_MODE] = (mod, summarize(run_cases(mod, cases, wf)))
+    # 打印统计（用例数、平均回答长度、平均关键词命中率、平均耗时），便于快速评估质量
     print("评估完成")
-    print(f"用例数: {summary['total_cases']}")
-    print(f"平均回答长度: {summary['avg_answer_length']:.1f}")
-    print(f"平均命中率: {summary['avg_hit_rate']:.2f}")
+    for faq_mode, (mod, summary) in summaries.items():
+        print(f"[FAQ_RAG_MODE={faq_mode}]")
+        print(f"用例数: {summary['total_cases']}")
+        print(f"平均回答长度: {summary['avg_answer_length']:.1f}")
+        print(f"平均命中率: {summary['avg_hit_rate']:.2f}")
+        print(f"平均 LLM 轮数: {summary['avg_llm_turns']:.2f}")
+        print(f"平均耗时: {summary['avg_latency_ms']:.0f} ms")
+        # 多订单用例的平均 LLM 轮数：分别以 BATCH_TOOLS_ENABLED=1 / 0 运行，对比批量工具减少的轮数
+        print(f"多订单用例（{summary['multi_order_cases']} 条，批量工具{'开启' if mod.BATCH_TOOLS_ENABLED else '关闭'}）"
+              f"平均 LLM 轮数: {summary['multi_order_avg_llm_turns']:.2f}，平均工具调用: {summary['multi_order_avg_tool_calls']:.2f}")
+        # FAQ 用例（调用了 faq_rag_tool）：对比 answer / context 模式的耗时与命中率
+        print(f"FAQ 用例（{summary['faq_cases']} 条）平均命中率: {summary['faq_avg_hit_rate']:.2f}，"
+              f"平均耗时: {summary['faq_avg_latency_ms']:.0f} ms")
     print(f"结果文件: {out_file}")
 
 if __name__ == "__main__":